@@ -1,29 +1,83 @@
 """Broadcast API endpoints."""
 import asyncio
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, Query, BackgroundTasks
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List
+from sqlalchemy import select, delete, text
+from typing import List, Optional
 import os
 
 from backend.db.database import get_db
-from backend.models.broadcast import Broadcast
-from backend.models.user import User
+from backend.db.segments import audience_where
+from backend.models.broadcast import Broadcast, BroadcastDelivery
 from backend.models.media import MediaFile
-from backend.schemas.schemas import BroadcastCreate, BroadcastUpdate, BroadcastResponse
+from backend.schemas.schemas import (
+    BroadcastCreate, BroadcastUpdate, BroadcastResponse, AudiencePreview, AudienceEstimate
+)
 
 router = APIRouter(prefix="/api/broadcasts", tags=["broadcasts"])
 
-# Get correct path to database
-import os
+# Get correct path to media directory
 BASE_DIR = os.getcwd()
-DB_PATH = os.path.join(BASE_DIR, 'bot.db')
 MEDIA_DIR = os.path.join(BASE_DIR, 'media')
 
 
-async def send_broadcast_messages(broadcast_id: int, project_id: int, content_text: str, content_type: str, target_audience: str):
+# Broadcasts being sent by this process
+running_broadcasts = set()
+
+
+async def count_audience(db: AsyncSession, project_id: int, target_audience: str, segment: Optional[dict]) -> int:
+    where, params = audience_where(target_audience, segment)
+    return await db.scalar(text(f"SELECT COUNT(*) FROM users u WHERE {where}"), dict(params, project_id=project_id))
+
+
+async def has_audience(db: AsyncSession, broadcast: Broadcast) -> bool:
+    """Whether the broadcast has any target user (an indexed EXISTS)."""
+    where, params = audience_where(broadcast.target_audience, broadcast.segment)
+    return bool(await db.scalar(
+        text(f"SELECT EXISTS (SELECT 1 FROM users u WHERE {where})"), dict(params, project_id=broadcast.project_id)
+    ))
+
+
+async def send_broadcast_messages(broadcast_id: int, project_id: int, content_text: str, content_type: str,
+                                  target_audience: str, segment: Optional[dict] = None):
     """Background task to send broadcast messages."""
-    import sqlite3
+    if broadcast_id in running_broadcasts:
+        print(f"[BCAST] Broadcast {broadcast_id} is already being sent")
+        return
+    
+    running_broadcasts.add(broadcast_id)
+    try:
+        await _send_broadcast_messages(broadcast_id, project_id, content_text, content_type, target_audience, segment)
+    finally:
+        running_broadcasts.discard(broadcast_id)
+
+
+async def resume_broadcasts(project_id: int):
+    """Resume broadcasts left in 'sending' state (e.g. after a restart).
+    
+    Users already present in the delivery log are skipped.
+    """
+    from bot.services import repository
+    
+    for pending in await repository.get_sending_broadcasts(project_id):
+        if pending["id"] in running_broadcasts:
+            continue
+        print(f"[BCAST] Resuming broadcast {pending['id']}")
+        await send_broadcast_messages(
+            pending["id"],
+            project_id,
+            pending["content_text"],
+            pending["content_type"],
+            pending["target_audience"],
+            pending["segment"]
+        )
+
+
+async def _send_broadcast_messages(broadcast_id: int, project_id: int, content_text: str, content_type: str,
+                                   target_audience: str, segment: Optional[dict] = None):
+    """Send a broadcast to every target user missing from its delivery log."""
+    from bot.services import repository
     
     # Import here to avoid circular imports
     try:
@@ -36,34 +90,21 @@ async def send_broadcast_messages(broadcast_id: int, project_id: int, content_te
     
     bot = get_bot_instance(project_id)
     if not bot:
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        owner = await repository.get_lease_owner(project_id, now)
+        if owner:
+            # The bot runs in another worker, which picks up 'sending' broadcasts
+            print(f"[BCAST] Broadcast {broadcast_id} left to worker {owner}")
+            return
         print(f"[X] No bot instance for project {project_id}")
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("UPDATE broadcasts SET status = 'failed' WHERE id = ?", (broadcast_id,))
-        conn.commit()
-        conn.close()
+        await repository.set_broadcast_status(broadcast_id, "failed")
         return
     
-    # Get users
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    
-    if target_audience == "active":
-        cursor.execute(
-            "SELECT id, telegram_id FROM users WHERE project_id = ? AND status = 'ACTIVE'",
-            (project_id,)
-        )
-    else:
-        cursor.execute(
-            "SELECT id, telegram_id FROM users WHERE project_id = ?",
-            (project_id,)
-        )
-    
-    users = cursor.fetchall()
-    print(f"[BCAST] Found {len(users)} users for broadcast")
-    
-    # Convert users to proper format
-    user_list = [{"id": u[0], "telegram_id": u[1]} for u in users]
+    # Users that have not received this broadcast yet (resume support),
+    # streamed from the DB in chunks while sending
+    total = await repository.count_broadcast_recipients(broadcast_id, project_id, target_audience, segment)
+    print(f"[BCAST] Found {total} users for broadcast")
+    recipients = repository.iter_broadcast_recipients(broadcast_id, project_id, target_audience, segment)
     
     # Create broadcast dict with required information
     broadcast = {
@@ -72,21 +113,18 @@ async def send_broadcast_messages(broadcast_id: int, project_id: int, content_te
         "content_text": content_text
     }
     
-    # Use ContentSender to send the broadcast
-    from bot.services.content_sender import ContentSender
-    content_sender = ContentSender(bot)
+    # Send concurrently under the bot's rate limit
+    from bot.services.broadcast_engine import BroadcastEngine
+    from bot.services.delivery_log import DeliveryLog
+    engine = BroadcastEngine(bot)
     
-    sent_count = await content_sender.send_broadcast(broadcast, user_list)
+    result = await engine.run(broadcast, recipients, DeliveryLog(broadcast_id))
     
-    # Update broadcast status
-    cursor.execute(
-        "UPDATE broadcasts SET status = 'completed', sent_count = ? WHERE id = ?",
-        (sent_count, broadcast_id)
-    )
-    conn.commit()
-    conn.close()
+    # Update broadcast status (sent_count is kept up to date by the delivery log)
+    await repository.set_broadcast_status(broadcast_id, "completed")
     
-    print(f"[OK] Broadcast {broadcast_id} completed: {sent_count} messages sent")
+    print(f"[OK] Broadcast {broadcast_id} completed: {result.sent} sent, "
+          f"{result.blocked} blocked, {result.failed} failed")
 
 
 @router.get("", response_model=List[BroadcastResponse])
@@ -106,6 +144,25 @@ async def get_broadcasts(
     return broadcasts
 
 
+@router.get("/audience", response_model=AudienceEstimate)
+async def estimate_audience(
+    project_id: int = Query(..., description="Project ID"),
+    target_audience: str = Query("all", description="all / active"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Number of users a broadcast to this audience would reach."""
+    count = await count_audience(db, project_id, target_audience, None)
+    return AudienceEstimate(project_id=project_id, target_audience=target_audience, count=count)
+
+
+@router.post("/audience", response_model=AudienceEstimate)
+async def preview_segment(preview: AudiencePreview, db: AsyncSession = Depends(get_db)):
+    """Size of an audience narrowed by a segment, before the broadcast is saved."""
+    segment = preview.segment.model_dump(exclude_none=True) if preview.segment else None
+    count = await count_audience(db, preview.project_id, preview.target_audience, segment)
+    return AudienceEstimate(project_id=preview.project_id, target_audience=preview.target_audience, count=count)
+
+
 @router.post("", response_model=BroadcastResponse)
 async def create_broadcast(
     broadcast: BroadcastCreate,
@@ -118,6 +175,7 @@ async def create_broadcast(
         content_text=broadcast.content_text,
         content_type=broadcast.content_type,
         target_audience=broadcast.target_audience,
+        segment=broadcast.segment.model_dump(mode="json", exclude_none=True) if broadcast.segment else None,
         scheduled_at=broadcast.scheduled_at,
         status="draft"
     )
@@ -127,7 +185,7 @@ async def create_broadcast(
             select(MediaFile).where(MediaFile.id.in_(broadcast.media_file_ids))
         )
         db_broadcast.media_files = result.scalars().all()
-        
+    
     db.add(db_broadcast)
     await db.commit()
     
@@ -172,6 +230,9 @@ async def update_broadcast(
         db_broadcast.media_files = result.scalars().all()
     if broadcast_update.target_audience is not None:
         db_broadcast.target_audience = broadcast_update.target_audience
+    if broadcast_update.segment is not None:
+        # An empty segment ({}) clears it
+        db_broadcast.segment = broadcast_update.segment.model_dump(mode="json", exclude_none=True) or None
     if broadcast_update.scheduled_at is not None:
         db_broadcast.scheduled_at = broadcast_update.scheduled_at
     
@@ -200,20 +261,16 @@ async def start_broadcast(
     if not broadcast.content_text and not broadcast.media_files:
         raise HTTPException(status_code=400, detail="Broadcast has no content")
     
-    # Count target users
-    query = select(User).where(User.project_id == broadcast.project_id)
-    if broadcast.target_audience == "active":
-        query = query.where(User.status == "ACTIVE")
-    
-    result = await db.execute(query)
-    users = result.scalars().all()
-    
-    if not users:
+    if not await has_audience(db, broadcast):
         raise HTTPException(status_code=400, detail="No users to send broadcast to")
     
+    # A broadcast stuck in 'sending' is resumed; otherwise start from scratch
+    if broadcast.status != "sending":
+        await db.execute(delete(BroadcastDelivery).where(BroadcastDelivery.broadcast_id == broadcast_id))
+        broadcast.sent_count = 0
+    
     # Update status to sending
     broadcast.status = "sending"
-    broadcast.sent_count = 0
     await db.commit()
     await db.refresh(broadcast)
     
@@ -224,10 +281,11 @@ async def start_broadcast(
         broadcast.project_id,
         broadcast.content_text,
         broadcast.content_type,
-        broadcast.target_audience
+        broadcast.target_audience,
+        broadcast.segment
     )
     
-    print(f"[BCAST] Starting broadcast {broadcast_id} to {len(users)} users")
+    print(f"[BCAST] Starting broadcast {broadcast_id} ({broadcast.target_audience} users)")
     
     return broadcast
 
@@ -252,20 +310,16 @@ async def resend_broadcast(
     if not broadcast.content_text and not broadcast.media_files:
         raise HTTPException(status_code=400, detail="Broadcast has no content")
     
-    # Count target users
-    query = select(User).where(User.project_id == broadcast.project_id)
-    if broadcast.target_audience == "active":
-        query = query.where(User.status == "ACTIVE")
-    
-    result = await db.execute(query)
-    users = result.scalars().all()
-    
-    if not users:
+    if not await has_audience(db, broadcast):
         raise HTTPException(status_code=400, detail="No users to send broadcast to")
     
+    # A broadcast stuck in 'sending' is resumed; otherwise send to everyone again
+    if broadcast.status != "sending":
+        await db.execute(delete(BroadcastDelivery).where(BroadcastDelivery.broadcast_id == broadcast_id))
+        broadcast.sent_count = 0
+    
     # Update status to sending
     broadcast.status = "sending"
-    broadcast.sent_count = 0
     await db.commit()
     await db.refresh(broadcast)
     
@@ -276,10 +330,11 @@ async def resend_broadcast(
         broadcast.project_id,
         broadcast.content_text,
         broadcast.content_type,
-        broadcast.target_audience
+        broadcast.target_audience,
+        broadcast.segment
     )
     
-    print(f"[BCAST] Resending broadcast {broadcast_id} to {len(users)} users")
+    print(f"[BCAST] Resending broadcast {broadcast_id} ({broadcast.target_audience} users)")
     
     return broadcast
 
@@ -294,6 +349,7 @@ async def delete_broadcast(broadcast_id: int, db: AsyncSession = Depends(get_db)
     if not broadcast:
         raise HTTPException(status_code=404, detail="Broadcast not found")
     
+    await db.execute(delete(BroadcastDelivery).where(BroadcastDelivery.broadcast_id == broadcast_id))
     await db.delete(broadcast)
     await db.commit()
     return {"message": "Broadcast deleted successfully"}
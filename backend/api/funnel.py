@@ -1,11 +1,13 @@
 """Funnel API endpoints."""
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, text
 from sqlalchemy.orm import selectinload
 from typing import List
+import secrets
 
 from backend.db.database import get_db
+from backend.db.funnel_queue import REFRESH_PROJECT_DUE_SQL
 from backend.models.funnel import FunnelStep
 from backend.models.media import MediaFile
 from backend.schemas.schemas import FunnelStepCreate, FunnelStepUpdate, FunnelStepResponse
@@ -13,6 +15,58 @@ from backend.schemas.schemas import FunnelStepCreate, FunnelStepUpdate, FunnelSt
 router = APIRouter(prefix="/api/funnel", tags=["funnel"])
 
 
+async def funnel_changed(db: AsyncSession, project_id: int, reschedule: bool = True):
+    """Propagate a funnel change: reschedule users and invalidate bot caches.
+
+    Due times are recomputed from the new delays, but never before a
+    user's funnel_hold_until (a retry backoff, catch-up or daily-cap slot).
+
+    Bumps projects.funnel_version so every process reloads its compiled
+    funnel, and drops the cached copy of this process right away.
+    """
+    if reschedule:
+        await db.execute(text(REFRESH_PROJECT_DUE_SQL), {"project_id": project_id})
+    await db.execute(
+        text("UPDATE projects SET funnel_version = COALESCE(funnel_version, 0) + 1 WHERE id = :project_id"),
+        {"project_id": project_id}
+    )
+    await db.commit()
+    
+    try:
+        from bot.services.funnel_cache import funnel_cache
+        from bot.services.funnel_scheduler import funnel_scheduler
+    except ImportError:
+        return
+    funnel_cache.invalidate(project_id)
+    if reschedule:
+        # Due times moved - reload the scheduler's timer heap
+        funnel_scheduler.refill_soon()
+
+
+def assign_button_ids(buttons: List[dict]) -> List[dict]:
+    """Give every button a stable id before the step is saved.
+
+    Ids survive edits, so a keyboard in an old message keeps pointing at
+    the same button after others are added, removed or moved. Buttons of
+    a step saved without ids keep their position as id, which is what
+    their keyboards were built with.
+    """
+    if not any(button.get("id") for button in buttons):
+        return [dict(button, id=str(index)) for index, button in enumerate(buttons)]
+    used = set()
+    result = []
+    for button in buttons:
+        # callback_data is limited to 64 bytes; copied buttons share an id
+        if not button.get("id") or len(button["id"]) > 16 or button["id"] in used:
+            new_id = secrets.token_hex(3)
+            while new_id in used or any(new_id == other.get("id") for other in buttons):
+                new_id = secrets.token_hex(3)
+            button = dict(button, id=new_id)
+        used.add(button["id"])
+        result.append(button)
+    return result
+
+
 @router.get("/steps", response_model=List[FunnelStepResponse])
 async def get_funnel_steps(
     project_id: int = Query(..., description="Project ID"),
@@ -50,7 +104,7 @@ async def create_funnel_step(
     # Convert buttons to list of dicts
     buttons_data = None
     if step.buttons:
-        buttons_data = [btn.model_dump() for btn in step.buttons]
+        buttons_data = assign_button_ids([btn.model_dump(exclude_none=True) for btn in step.buttons])
     
     db_step = FunnelStep(
         project_id=step.project_id,
@@ -73,6 +127,7 @@ async def create_funnel_step(
     
     db.add(db_step)
     await db.commit()
+    await funnel_changed(db, step.project_id)
     
     # Reload with relationships
     result = await db.execute(
@@ -108,7 +163,7 @@ async def update_funnel_step(
     
     # Update buttons
     if step_update.buttons is not None:
-        db_step.buttons = [btn.model_dump() for btn in step_update.buttons]
+        db_step.buttons = assign_button_ids([btn.model_dump(exclude_none=True) for btn in step_update.buttons])
     
     # Update media files if provided
     if step_update.media_file_ids is not None:
@@ -121,6 +176,7 @@ async def update_funnel_step(
         db_step.media_files = list(media_files)
     
     await db.commit()
+    await funnel_changed(db, db_step.project_id, reschedule=step_update.delay_seconds is not None)
     
     # Reload with relationships
     result = await db.execute(
@@ -149,4 +205,5 @@ async def delete_funnel_step(
     
     await db.delete(step)
     await db.commit()
+    await funnel_changed(db, project_id)
     return {"message": "Step deleted successfully"}
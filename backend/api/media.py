@@ -2,12 +2,13 @@
 import os
 import uuid
 import aiofiles
-from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Form, BackgroundTasks
 from fastapi.responses import FileResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from typing import List
 
+from backend.api.funnel import funnel_changed
 from backend.db.database import get_db
 from backend.models.media import MediaFile
 from backend.schemas.schemas import MediaFileResponse
@@ -31,6 +32,28 @@ def get_file_type(filename: str) -> str:
         raise ValueError(f"Unsupported file extension: {ext}")
 
 
+async def warm_up_uploaded_file(media_id: int, project_id: int, filename: str, file_type: str):
+    """Background task: upload a new file to Telegram once to cache its file_id."""
+    try:
+        from run import get_bot_instance
+        from bot.services.media_warmup import warm_up_media
+    except ImportError:
+        return
+    
+    bot = get_bot_instance(project_id)
+    if not bot:
+        return
+    
+    media = {
+        "id": media_id,
+        "project_id": project_id,
+        "filename": filename,
+        "file_type": file_type,
+        "telegram_file_id": None
+    }
+    await warm_up_media(bot, project_id, [media])
+
+
 @router.get("", response_model=List[MediaFileResponse])
 async def get_media_files(
     project_id: int = Query(..., description="Project ID"),
@@ -48,6 +71,7 @@ async def get_media_files(
 
 @router.post("/upload", response_model=MediaFileResponse)
 async def upload_media(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...),
     project_id: int = Form(...),
     db: AsyncSession = Depends(get_db)
@@ -85,6 +109,9 @@ async def upload_media(
     await db.commit()
     await db.refresh(db_file)
     
+    # Get telegram_file_id right away if the project's bot is running
+    background_tasks.add_task(warm_up_uploaded_file, db_file.id, project_id, unique_filename, file_type)
+    
     return db_file
 
 
@@ -112,6 +139,8 @@ async def delete_media(media_id: int, db: AsyncSession = Depends(get_db)):
     if os.path.exists(file_path):
         os.remove(file_path)
     
+    project_id = media.project_id
     await db.delete(media)
     await db.commit()
+    await funnel_changed(db, project_id, reschedule=False)
     return {"message": "Media file deleted successfully"}
@@ -1,20 +1,37 @@
 """Projects API endpoints."""
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, delete
+from sqlalchemy import select, delete, update
 from typing import List
 
+from backend.api.funnel import funnel_changed
 from backend.db.database import get_db
 from backend.models.project import Project
 from backend.models.user import User
-from backend.models.funnel import FunnelStep
+from backend.models.funnel import FunnelStep, FunnelDailySends
 from backend.models.media import MediaFile, funnel_media_association
-from backend.models.broadcast import Broadcast
-from backend.schemas.schemas import ProjectCreate, ProjectResponse
+from backend.models.broadcast import Broadcast, BroadcastDelivery
+from backend.models.button_click import ButtonClick
+from backend.schemas.schemas import ProjectCreate, ProjectUpdate, ProjectResponse
 
 router = APIRouter(prefix="/api/projects", tags=["projects"])
 
 
+def notify_bot_supervisor(project_id: int):
+    """Let the bot supervisor start, restart or stop the project's bot now.
+
+    Also drops this worker's webhook receiver of the project, so the next
+    update builds one with the current token.
+    """
+    try:
+        from run import bot_supervisor, forget_webhook_receiver
+    except ImportError:
+        return
+    forget_webhook_receiver(project_id)
+    if bot_supervisor:
+        bot_supervisor.notify(project_id)
+
+
 @router.get("", response_model=List[ProjectResponse])
 async def get_projects(db: AsyncSession = Depends(get_db)):
     """Get all projects."""
@@ -41,6 +58,7 @@ async def create_project(project: ProjectCreate, db: AsyncSession = Depends(get_
     db.add(db_project)
     await db.commit()
     await db.refresh(db_project)
+    notify_bot_supervisor(db_project.id)
     return db_project
 
 
@@ -56,6 +74,46 @@ async def get_project(project_id: int, db: AsyncSession = Depends(get_db)):
     return project
 
 
+@router.put("/{project_id}", response_model=ProjectResponse)
+async def update_project(
+    project_id: int,
+    project_update: ProjectUpdate,
+    db: AsyncSession = Depends(get_db)
+):
+    """Update a project; the bot restarts with the new settings."""
+    result = await db.execute(
+        select(Project).where(Project.id == project_id)
+    )
+    project = result.scalar_one_or_none()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    
+    token_changed = project_update.bot_token is not None and project_update.bot_token != project.bot_token
+    if token_changed:
+        existing = await db.execute(
+            select(Project).where(Project.bot_token == project_update.bot_token)
+        )
+        if existing.scalar_one_or_none():
+            raise HTTPException(status_code=400, detail="Bot token already exists")
+        project.bot_token = project_update.bot_token
+        # File ids are issued per bot - the new one rejects the old ids
+        await db.execute(
+            update(MediaFile).where(MediaFile.project_id == project_id).values(telegram_file_id=None)
+        )
+    if project_update.name is not None:
+        project.name = project_update.name
+    if project_update.admin_id is not None:
+        project.admin_id = project_update.admin_id
+    
+    await db.commit()
+    if token_changed:
+        # Cached funnels hold the old file ids; the new bot warms them up on start
+        await funnel_changed(db, project_id, reschedule=False)
+    await db.refresh(project)
+    notify_bot_supervisor(project_id)
+    return project
+
+
 @router.delete("/{project_id}")
 async def delete_project(project_id: int, db: AsyncSession = Depends(get_db)):
     """Delete a project and all related data."""
@@ -83,15 +141,25 @@ async def delete_project(project_id: int, db: AsyncSession = Depends(get_db)):
     # 3. Delete media files
     await db.execute(delete(MediaFile).where(MediaFile.project_id == project_id))
     
-    # 4. Delete users
+    # 4. Delete users and their button clicks
+    await db.execute(delete(ButtonClick).where(ButtonClick.project_id == project_id))
+    await db.execute(delete(FunnelDailySends).where(FunnelDailySends.project_id == project_id))
     await db.execute(delete(User).where(User.project_id == project_id))
     
-    # 5. Delete broadcasts
+    # 5. Delete broadcasts and their delivery logs
+    await db.execute(
+        delete(BroadcastDelivery).where(
+            BroadcastDelivery.broadcast_id.in_(
+                select(Broadcast.id).where(Broadcast.project_id == project_id)
+            )
+        )
+    )
     await db.execute(delete(Broadcast).where(Broadcast.project_id == project_id))
     
     # 6. Delete the project itself
     await db.delete(project)
     await db.commit()
+    notify_bot_supervisor(project_id)
     
     print(f"[DEL] Project {project_id} deleted with all related data")
     return {"message": "Project deleted successfully"}
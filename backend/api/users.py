@@ -1,29 +1,258 @@
 """Users API endpoints."""
+import base64
+import csv
+import io
+import json
+from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import List, Optional
+from sqlalchemy import select, text, func, tuple_, type_coerce, String
+from typing import Optional
 
-from backend.db.database import get_db
+from backend.core.config import USERS_EXPORT_CHUNK_SIZE
+from backend.db.database import get_db, engine
+from backend.db.funnel_queue import REFRESH_USER_DUE_SQL, DUE_TIME_FORMAT
 from backend.models.user import User
-from backend.schemas.schemas import UserResponse, UserStatusUpdate
+from backend.schemas.schemas import UserResponse, UserPage, UserStats, UserStatusUpdate
 
 router = APIRouter(prefix="/api/users", tags=["users"])
 
 
-@router.get("", response_model=List[UserResponse])
+# created_at as stored ('YYYY-MM-DD HH:MM:SS'); compared as text so bound
+# values match the stored format and the (project_id, created_at) index is used
+CREATED_AT = type_coerce(User.created_at, String)
+# Same for funnel_dead_at and the (project_id, funnel_dead_at) index
+DEAD_AT = type_coerce(User.funnel_dead_at, String)
+
+
+def encode_cursor(sort_key: str, user_id: int) -> str:
+    return base64.urlsafe_b64encode(f"{sort_key}|{user_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        sort_key, user_id = base64.urlsafe_b64decode(cursor.encode()).decode().rsplit("|", 1)
+        return sort_key, int(user_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def user_filters(
+    project_id: int,
+    status: Optional[str],
+    funnel_step: Optional[int],
+    created_from: Optional[datetime],
+    created_to: Optional[datetime],
+) -> list:
+    """WHERE conditions shared by the users list and the export."""
+    conditions = [User.project_id == project_id]
+    if status is not None:
+        conditions.append(User.status == status)
+    if funnel_step is not None:
+        conditions.append(User.funnel_step == funnel_step)
+    if created_from is not None:
+        conditions.append(CREATED_AT >= created_from.strftime(DUE_TIME_FORMAT))
+    if created_to is not None:
+        conditions.append(CREATED_AT < created_to.strftime(DUE_TIME_FORMAT))
+    return conditions
+
+
+@router.get("", response_model=UserPage)
 async def get_users(
     project_id: int = Query(..., description="Project ID"),
+    status: Optional[str] = Query(None, description="ACTIVE / BLOCKED"),
+    funnel_step: Optional[int] = Query(None, description="Current funnel step"),
+    created_from: Optional[datetime] = Query(None, description="Registered at or after"),
+    created_to: Optional[datetime] = Query(None, description="Registered before"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(50, ge=1, le=500),
     db: AsyncSession = Depends(get_db)
 ):
-    """Get all users for a project."""
+    """Get a page of a project's users, newest first.
+    
+    Keyset pagination on (created_at, id): every page is an index range
+    scan, no matter how deep, and new registrations do not shift pages.
+    """
+    query = (
+        select(User, CREATED_AT.label("created_at_raw"))
+        .where(*user_filters(project_id, status, funnel_step, created_from, created_to))
+        .order_by(User.created_at.desc(), User.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(CREATED_AT, User.id) < tuple_(*decode_cursor(cursor)))
+    
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_user, last_created_at = rows[-1]
+        next_cursor = encode_cursor(last_created_at, last_user.id)
+    return UserPage(items=[user for user, _ in rows], next_cursor=next_cursor)
+
+
+@router.get("/stats", response_model=UserStats)
+async def get_user_stats(
+    project_id: int = Query(..., description="Project ID"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Totals per status and per funnel step, counted from indexes."""
+    stats = UserStats()
     result = await db.execute(
-        select(User)
+        select(User.status, User.funnel_step, func.count())
         .where(User.project_id == project_id)
-        .order_by(User.created_at.desc())
+        .group_by(User.status, User.funnel_step)
+    )
+    for status, step, count in result.all():
+        stats.total += count
+        stats.by_status[status] = stats.by_status.get(status, 0) + count
+        stats.by_step[step or 0] = stats.by_step.get(step or 0, 0) + count
+    
+    stats.dead_letter = await db.scalar(
+        select(func.count())
+        .select_from(User)
+        .where(User.project_id == project_id, User.funnel_dead_at.is_not(None))
+    )
+    return stats
+
+
+async def retry_funnel(db: AsyncSession, where: str, params: dict) -> int:
+    """Clear the dead-letter state of matching users and schedule their step again."""
+    result = await db.execute(text(f"""
+        UPDATE users
+        SET funnel_dead_at = NULL, funnel_attempts = 0, funnel_error = NULL, funnel_hold_until = NULL
+        WHERE funnel_dead_at IS NOT NULL AND {where}
+        RETURNING id
+    """), params)
+    user_ids = result.scalars().all()
+    if user_ids:
+        await db.execute(text(REFRESH_USER_DUE_SQL), [{"user_id": user_id} for user_id in user_ids])
+    await db.commit()
+    
+    try:
+        from bot.services.funnel_scheduler import funnel_scheduler
+    except ImportError:
+        return len(user_ids)
+    funnel_scheduler.refill_soon()
+    return len(user_ids)
+
+
+@router.get("/dead-letter", response_model=UserPage)
+async def get_dead_letter_users(
+    project_id: int = Query(..., description="Project ID"),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(50, ge=1, le=500),
+    db: AsyncSession = Depends(get_db)
+):
+    """A page of the users whose funnel stopped because a step could not be delivered.
+    
+    Latest first, keyset paginated on (funnel_dead_at, id) like the users
+    list - after a bad token or media file this can be the whole audience.
+    """
+    query = (
+        select(User, DEAD_AT.label("dead_at_raw"))
+        .where(User.project_id == project_id, User.funnel_dead_at.is_not(None))
+        .order_by(User.funnel_dead_at.desc(), User.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(DEAD_AT, User.id) < tuple_(*decode_cursor(cursor)))
+    
+    rows = (await db.execute(query)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last_user, last_dead_at = rows[-1]
+        next_cursor = encode_cursor(last_dead_at, last_user.id)
+    return UserPage(items=[user for user, _ in rows], next_cursor=next_cursor)
+
+
+@router.post("/dead-letter/retry")
+async def retry_dead_letter_users(
+    project_id: int = Query(..., description="Project ID"),
+    db: AsyncSession = Depends(get_db)
+):
+    """Send the failed step again to all dead-lettered users of a project."""
+    count = await retry_funnel(db, "project_id = :project_id", {"project_id": project_id})
+    return {"message": f"Funnel resumed for {count} users", "count": count}
+
+
+# Exported columns, in CSV header order
+EXPORT_COLUMNS = (
+    "id", "telegram_id", "username", "first_name", "last_name",
+    "status", "funnel_step", "funnel_step_sent_at", "created_at",
+)
+
+
+async def export_rows(conditions: list):
+    """Yield chunks of USERS_EXPORT_CHUNK_SIZE row tuples (EXPORT_COLUMNS), newest first.
+    
+    Every chunk is a short keyset query on its own connection: memory stays
+    flat, the connection goes back to the pool between chunks, and no read
+    transaction is held open for the whole export (it would keep the WAL
+    from being checkpointed).
+    """
+    columns = [User.__table__.c[name] for name in EXPORT_COLUMNS if name != "created_at"]
+    query = (
+        select(*columns, CREATED_AT.label("created_at"))
+        .where(*conditions)
+        .order_by(User.created_at.desc(), User.id.desc())
+        .limit(USERS_EXPORT_CHUNK_SIZE)
+    )
+    last = None
+    while True:
+        chunk_query = query if last is None else query.where(tuple_(CREATED_AT, User.id) < last)
+        async with engine.connect() as conn:
+            rows = (await conn.execute(chunk_query)).all()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < USERS_EXPORT_CHUNK_SIZE:
+            return
+        last = tuple_(rows[-1][-1], rows[-1][0])
+
+
+async def stream_csv(conditions: list):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    async for rows in export_rows(conditions):
+        writer.writerows(rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+async def stream_ndjson(conditions: list):
+    async for rows in export_rows(conditions):
+        yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False, default=str) + "\n" for row in rows)
+
+
+@router.get("/export")
+async def export_users(
+    project_id: int = Query(..., description="Project ID"),
+    format: str = Query("csv", pattern="^(csv|ndjson)$"),
+    status: Optional[str] = Query(None, description="ACTIVE / BLOCKED"),
+    funnel_step: Optional[int] = Query(None, description="Current funnel step"),
+    created_from: Optional[datetime] = Query(None, description="Registered at or after"),
+    created_to: Optional[datetime] = Query(None, description="Registered before"),
+):
+    """Download a project's users (filters as in the list) as CSV or NDJSON.
+    
+    Streamed in chunks, so any audience size exports in constant memory.
+    """
+    conditions = user_filters(project_id, status, funnel_step, created_from, created_to)
+    if format == "csv":
+        body, media_type = stream_csv(conditions), "text/csv; charset=utf-8"
+    else:
+        body, media_type = stream_ndjson(conditions), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="users_{project_id}.{format}"'}
     )
-    users = result.scalars().all()
-    return users
 
 
 @router.get("/{user_id}", response_model=UserResponse)
@@ -58,6 +287,18 @@ async def update_user_status(
     return user
 
 
+@router.post("/{user_id}/retry-funnel", response_model=UserResponse)
+async def retry_user_funnel(user_id: int, db: AsyncSession = Depends(get_db)):
+    """Send the failed step again to one dead-lettered user."""
+    user = await db.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    await retry_funnel(db, "id = :user_id", {"user_id": user_id})
+    await db.refresh(user)
+    return user
+
+
 @router.delete("/{user_id}")
 async def delete_user(user_id: int, db: AsyncSession = Depends(get_db)):
     """Delete a user."""
@@ -0,0 +1,66 @@
+"""Webhook endpoint for project bots (BOT_MODE=webhook)."""
+import hashlib
+import hmac
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Request
+
+from backend.core.config import WEBHOOK_BASE_URL, WEBHOOK_SECRET
+
+router = APIRouter(prefix="/webhook", tags=["webhook"])
+
+def webhook_url(project_id: int) -> str:
+    return f"{WEBHOOK_BASE_URL.rstrip('/')}/webhook/{project_id}"
+
+
+def webhook_secret(project_id: int, bot_token: str) -> str:
+    """secret_token Telegram sends back in X-Telegram-Bot-Api-Secret-Token."""
+    key = (WEBHOOK_SECRET or bot_token).encode()
+    return hmac.new(key, f"webhook:{project_id}".encode(), hashlib.sha256).hexdigest()
+
+
+async def expected_secret(project_id: int) -> Optional[str]:
+    """Secret a project's webhook must carry, without building a bot.
+
+    With WEBHOOK_SECRET it follows from the project id; otherwise from the
+    project's current bot token (one primary-key read). None - no project.
+    """
+    if WEBHOOK_SECRET:
+        return webhook_secret(project_id, "")
+    from bot.services import repository
+    project = await repository.get_project(project_id)
+    return webhook_secret(project_id, project["bot_token"]) if project else None
+
+
+@router.post("/{project_id}")
+async def receive_update(project_id: int, request: Request):
+    """Receive an update from Telegram and feed it to the dispatcher."""
+    try:
+        from run import cached_webhook_target, get_webhook_target, forget_webhook_receiver, dispatch_update
+    except ImportError:
+        raise HTTPException(status_code=503, detail="Bot manager is not running")
+
+    # Check the secret before any receiver is built or dropped, so forged
+    # requests cannot make this worker create bots or evict valid ones
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    cached = cached_webhook_target(project_id)
+    if cached is None or not hmac.compare_digest(token, cached[1]):
+        secret = await expected_secret(project_id)
+        if secret is None:
+            raise HTTPException(status_code=404, detail="Bot not found")
+        if not hmac.compare_digest(token, secret):
+            raise HTTPException(status_code=403, detail="Invalid secret token")
+        if cached:
+            # The bot token changed since the receiver was created
+            forget_webhook_receiver(project_id)
+
+    target = await get_webhook_target(project_id)
+    if not target:
+        raise HTTPException(status_code=404, detail="Bot not found")
+    bot = target[0]
+
+    from aiogram.types import Update
+    update = Update.model_validate(await request.json(), context={"bot": bot})
+
+    # Answer Telegram right away; handlers run in the background
+    dispatch_update(bot, update)
+    return {"ok": True}
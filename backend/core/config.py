@@ -29,3 +29,105 @@ if os.getenv("ENVIRONMENT") != "production":
         "http://127.0.0.1:3000",
         BACKEND_URL,
     ])
+
+
+# Telegram Bot API limits (per bot)
+BOT_RATE_LIMIT = float(os.getenv("BOT_RATE_LIMIT", "28"))  # messages per second
+BOT_PER_CHAT_INTERVAL = float(os.getenv("BOT_PER_CHAT_INTERVAL", "1.0"))  # seconds between messages to one chat
+
+# Broadcast engine
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))  # sends in flight
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_RECIPIENT_CHUNK_SIZE = int(os.getenv("BROADCAST_RECIPIENT_CHUNK_SIZE", "1000"))  # users read per query
+
+# Funnel fan-out: due steps sent in flight at once (across all bots), and sent
+# steps written per batch
+FUNNEL_CONCURRENCY = int(os.getenv("FUNNEL_CONCURRENCY", "20"))
+FUNNEL_STEP_BATCH_SIZE = int(os.getenv("FUNNEL_STEP_BATCH_SIZE", "100"))
+# Failed funnel sends are retried after BASE, 2*BASE, ... up to MAX seconds;
+# after FUNNEL_MAX_ATTEMPTS the user is dead-lettered
+FUNNEL_MAX_ATTEMPTS = int(os.getenv("FUNNEL_MAX_ATTEMPTS", "5"))
+FUNNEL_RETRY_BACKOFF_BASE = float(os.getenv("FUNNEL_RETRY_BACKOFF_BASE", "60"))
+FUNNEL_RETRY_BACKOFF_MAX = float(os.getenv("FUNNEL_RETRY_BACKOFF_MAX", "3600"))
+# Catch-up after downtime: when a bot starts, steps overdue by more than THRESHOLD s
+# are spread over WINDOW s (longer if needed to stay under RATE sends/s), most
+# overdue first, plus up to JITTER s of random delay. WINDOW=0 sends them at once.
+FUNNEL_CATCHUP_THRESHOLD = float(os.getenv("FUNNEL_CATCHUP_THRESHOLD", "300"))
+FUNNEL_CATCHUP_WINDOW = float(os.getenv("FUNNEL_CATCHUP_WINDOW", "3600"))
+FUNNEL_CATCHUP_RATE = float(os.getenv("FUNNEL_CATCHUP_RATE", "10"))
+FUNNEL_CATCHUP_JITTER = int(os.getenv("FUNNEL_CATCHUP_JITTER", "30"))
+# Due users are claimed by one funnel sender process for FUNNEL_LEASE_SECONDS;
+# a claim left by a crashed process is taken over after that
+FUNNEL_LEASE_SECONDS = float(os.getenv("FUNNEL_LEASE_SECONDS", "300"))
+# Max funnel steps a project sends per day (0 - no cap); the rest move to the next day
+FUNNEL_DAILY_CAP = int(os.getenv("FUNNEL_DAILY_CAP", "0"))
+
+# Chat (e.g. a private channel with the bot as admin) used to upload media once
+# and obtain telegram_file_id before fan-out. Empty - use the project's admin_id.
+MEDIA_STORAGE_CHAT_ID = int(os.getenv("MEDIA_STORAGE_CHAT_ID", "0") or 0)
+# A failed warm-up upload (e.g. the admin never started the bot) is retried after
+# RETRY_BASE s, doubling up to RETRY_MAX; until then the first send uploads the file
+MEDIA_WARMUP_RETRY_BASE = float(os.getenv("MEDIA_WARMUP_RETRY_BASE", "60"))
+MEDIA_WARMUP_RETRY_MAX = float(os.getenv("MEDIA_WARMUP_RETRY_MAX", "3600"))
+
+# SQLite connection profile, applied to every connection (see backend/db/sqlite_pragmas.py).
+# SQLITE_TUNING=0 keeps SQLite defaults.
+SQLITE_TUNING = os.getenv("SQLITE_TUNING", "1") != "0"
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000")),  # ms to wait for a lock
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB, i.e. 64 MB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": os.getenv("SQLITE_TEMP_STORE", "MEMORY"),
+}
+
+# /start registrations: with write-behind on, run.py buffers them and writes
+# batches of up to REGISTRATION_BATCH_SIZE at most every REGISTRATION_FLUSH_INTERVAL s
+REGISTRATION_WRITE_BEHIND = os.getenv("REGISTRATION_WRITE_BEHIND", "0") == "1"
+REGISTRATION_BATCH_SIZE = int(os.getenv("REGISTRATION_BATCH_SIZE", "200"))
+REGISTRATION_FLUSH_INTERVAL = float(os.getenv("REGISTRATION_FLUSH_INTERVAL", "0.5"))
+
+# Update ingestion: "polling" (getUpdates loop per bot) or "webhook"
+# (Telegram posts updates to {WEBHOOK_BASE_URL}/webhook/{project_id})
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", BACKEND_URL)
+# Key for the per-project secret_token; empty - derived from each bot token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Bot API server base URL, e.g. a local telegram-bot-api or
+# benchmarks/fake_bot_api.py. Empty - https://api.telegram.org
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER", "")
+
+# Connections of the HTTP pool shared by all bots (webhook mode; polling
+# bots each hold a long-poll request, so the pool is unbounded there)
+BOT_HTTP_POOL_SIZE = int(os.getenv("BOT_HTTP_POOL_SIZE", "100"))
+
+# Bot supervisor: crashed bots restart after BASE, 2*BASE, ... up to MAX seconds;
+# the projects table is re-read every RECONCILE_INTERVAL s (API changes apply at once)
+BOT_RESTART_BACKOFF_BASE = float(os.getenv("BOT_RESTART_BACKOFF_BASE", "5"))
+BOT_RESTART_BACKOFF_MAX = float(os.getenv("BOT_RESTART_BACKOFF_MAX", "600"))
+BOT_RECONCILE_INTERVAL = float(os.getenv("BOT_RECONCILE_INTERVAL", "60"))
+
+# Funnel scheduler: users due within FUNNEL_HEAP_HORIZON s are kept in an
+# in-memory timer heap (reloaded from the DB every half horizon)
+FUNNEL_HEAP_HORIZON = float(os.getenv("FUNNEL_HEAP_HORIZON", "300"))
+# Due times written by other processes (a webhook receiver or the API of another
+# worker, a funnel worker) reach the heap by a poll every FUNNEL_POLL_INTERVAL s.
+# 0 - only on refill, i.e. up to half the horizon late
+FUNNEL_POLL_INTERVAL = float(os.getenv("FUNNEL_POLL_INTERVAL", "2"))
+
+# Bot leases: each project's bot runs in exactly one of the processes sharing
+# bot.db (e.g. gunicorn workers). Leases last BOT_LEASE_TTL s and are renewed
+# every BOT_LEASE_HEARTBEAT s; a dead worker's bots move within BOT_LEASE_TTL.
+BOT_LEASES = os.getenv("BOT_LEASES", "1") != "0"
+BOT_LEASE_TTL = float(os.getenv("BOT_LEASE_TTL", "30"))
+BOT_LEASE_HEARTBEAT = float(os.getenv("BOT_LEASE_HEARTBEAT", "10"))
+
+# Users export: rows read per query while streaming a CSV / NDJSON download
+USERS_EXPORT_CHUNK_SIZE = int(os.getenv("USERS_EXPORT_CHUNK_SIZE", "1000"))
+
+# Button presses (for broadcast segments) are written in batches of up to
+# CLICK_LOG_BATCH_SIZE at most every CLICK_LOG_FLUSH_INTERVAL s
+CLICK_LOG_BATCH_SIZE = int(os.getenv("CLICK_LOG_BATCH_SIZE", "200"))
+CLICK_LOG_FLUSH_INTERVAL = float(os.getenv("CLICK_LOG_FLUSH_INTERVAL", "1.0"))
@@ -3,6 +3,8 @@ from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sess
 from sqlalchemy.orm import DeclarativeBase
 import os
 
+from backend.db.sqlite_pragmas import install as install_pragmas
+
 # Database URL
 BASE_DIR = os.getcwd()
 DATABASE_URL = f"sqlite+aiosqlite:///{os.path.join(BASE_DIR, 'bot.db')}"
@@ -14,6 +16,9 @@ engine = create_async_engine(
     future=True
 )
 
+# WAL, busy_timeout etc. on every pooled connection
+install_pragmas(engine.sync_engine)
+
 # Create async session factory
 AsyncSessionLocal = async_sessionmaker(
     engine,
@@ -43,6 +48,8 @@ async def get_db():
 
 
 async def init_db():
-    """Initialize database tables."""
+    """Initialize database tables and migrate existing databases."""
+    from backend.db.migrations import run_migrations
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(run_migrations)
@@ -0,0 +1,45 @@
+"""Due-time bookkeeping for the funnel queue.
+
+Every user row carries ``next_due_at`` - the moment its next funnel step
+becomes due. The scheduler only fetches rows with ``next_due_at <= now``
+through the ``(project_id, status, next_due_at)`` index, so a tick costs
+as much as the number of due users, not the size of the audience.
+
+The statements below use named parameters, so they work both with raw
+``sqlite3`` cursors and with SQLAlchemy ``text()``.
+"""
+
+# Reference time (created_at for new users, funnel_step_sent_at afterwards)
+# plus the delay of the next step, but not before funnel_hold_until (a retry
+# backoff, catch-up or daily-cap slot). NULL when there is no next step or the user is dead-lettered
+# (funnel_dead_at set).
+NEXT_DUE_AT_EXPR = """(
+    SELECT CASE WHEN users.funnel_dead_at IS NULL THEN MAX(datetime(
+        COALESCE(
+            CASE WHEN COALESCE(users.funnel_step, 0) = 0 THEN NULL ELSE users.funnel_step_sent_at END,
+            users.created_at
+        ),
+        '+' || fs.delay_seconds || ' seconds'
+    ), COALESCE(users.funnel_hold_until, '')) END
+    FROM funnel_steps fs
+    WHERE fs.project_id = users.project_id
+      AND fs.step_number = COALESCE(users.funnel_step, 0) + 1
+)"""
+
+# Recompute next_due_at for a single user (after /start or a sent step)
+REFRESH_USER_DUE_SQL = f"UPDATE users SET next_due_at = {NEXT_DUE_AT_EXPR} WHERE id = :user_id"
+
+# Same, addressed by (project_id, telegram_id) - for batched registrations
+REFRESH_MEMBER_DUE_SQL = (
+    f"UPDATE users SET next_due_at = {NEXT_DUE_AT_EXPR} "
+    "WHERE project_id = :project_id AND telegram_id = :telegram_id"
+)
+
+# Recompute next_due_at for a whole project (after the funnel was edited)
+REFRESH_PROJECT_DUE_SQL = f"UPDATE users SET next_due_at = {NEXT_DUE_AT_EXPR} WHERE project_id = :project_id"
+
+# Recompute next_due_at for every user (one-off backfill on migration)
+REFRESH_ALL_DUE_SQL = f"UPDATE users SET next_due_at = {NEXT_DUE_AT_EXPR}"
+
+# Same format SQLite's datetime() produces, so values compare as strings
+DUE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
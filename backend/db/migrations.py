@@ -0,0 +1,99 @@
+"""Lightweight schema migrations for existing bot.db files.
+
+``Base.metadata.create_all`` only creates missing tables; it never touches
+tables that already exist. This module adds columns and indexes that were
+introduced after a database was first created.
+"""
+from backend.db.funnel_queue import REFRESH_ALL_DUE_SQL
+
+
+# Columns added after the initial schema: (table, column, column DDL)
+ADDED_COLUMNS = [
+    ("users", "next_due_at", "DATETIME"),
+    ("projects", "funnel_version", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "funnel_attempts", "INTEGER NOT NULL DEFAULT 0"),
+    ("users", "funnel_error", "VARCHAR(255)"),
+    ("users", "funnel_dead_at", "DATETIME"),
+    ("users", "funnel_hold_until", "DATETIME"),
+    ("users", "lease_owner", "VARCHAR(64)"),
+    ("users", "lease_expires_at", "DATETIME"),
+    ("users", "last_activity_at", "DATETIME"),
+    ("broadcasts", "segment", "JSON"),
+]
+
+
+def _table_columns(conn, table: str) -> set:
+    """Return column names of an existing table."""
+    rows = conn.exec_driver_sql(f"PRAGMA table_info({table})").fetchall()
+    return {row[1] for row in rows}
+
+
+def _index_exists(conn, name: str) -> bool:
+    row = conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,)
+    ).first()
+    return row is not None
+
+
+def dedupe_users(conn) -> int:
+    """Delete duplicate (project_id, telegram_id) users, keeping the oldest row.
+
+    Older databases had no unique constraint, so a double /start could
+    register the same person twice. Returns the number of rows deleted.
+    """
+    duplicates = """
+        SELECT id FROM users
+        WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY project_id, telegram_id)
+    """
+    count = conn.exec_driver_sql(f"SELECT COUNT(*) FROM ({duplicates})").scalar()
+    if count:
+        print(f"[DB] Removing {count} duplicate users...")
+        conn.exec_driver_sql(f"DELETE FROM broadcast_deliveries WHERE user_id IN ({duplicates})")
+        conn.exec_driver_sql(f"DELETE FROM users WHERE id IN ({duplicates})")
+    return count
+
+
+def run_migrations(conn):
+    """Bring an existing database up to the current models.
+
+    Runs on a synchronous connection (``conn.run_sync``) right after
+    ``create_all``.
+    """
+    from backend.db.database import Base
+
+    added = set()
+    for table, column, ddl in ADDED_COLUMNS:
+        if column not in _table_columns(conn, table):
+            print(f"[DB] Adding missing {table}.{column} column...")
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}")
+            added.add((table, column))
+
+    # The unique index would fail on duplicates left by older versions
+    if not _index_exists(conn, "uq_users_project_telegram"):
+        dedupe_users(conn)
+
+    # The daily cap counts funnel_daily_sends now
+    conn.exec_driver_sql("DROP INDEX IF EXISTS ix_users_project_sent")
+
+    # Indexes of pre-existing tables are not created by create_all
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+    if ("users", "next_due_at") in added:
+        print("[DB] Backfilling users.next_due_at...")
+        conn.exec_driver_sql(REFRESH_ALL_DUE_SQL)
+
+    if ("users", "funnel_hold_until") in added:
+        # Pending retries wait for their backoff (next_due_at holds it)
+        print("[DB] Backfilling users.funnel_hold_until...")
+        conn.exec_driver_sql("""
+            UPDATE users SET funnel_hold_until = next_due_at
+            WHERE funnel_attempts > 0 AND funnel_dead_at IS NULL
+        """)
+
+    if ("users", "last_activity_at") in added:
+        # Registration is the last activity known for sure (updated_at
+        # also moves on funnel sends)
+        print("[DB] Backfilling users.last_activity_at...")
+        conn.exec_driver_sql("UPDATE users SET last_activity_at = created_at")
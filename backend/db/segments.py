@@ -0,0 +1,94 @@
+"""Broadcast audience segments compiled to SQL.
+
+A segment (``SegmentSpec`` in the API, stored as JSON in
+``broadcasts.segment``) is a set of conditions on the users of one
+project. ``compile_segment`` turns it into a single WHERE fragment over
+``users u`` with named parameters, so counting or streaming a segment is
+one indexed query and a narrow segment costs a narrow read:
+
+- status / funnel_step range - ``(project_id, status, funnel_step)``;
+- created_at window - ``(project_id, created_at)``;
+- last activity window - ``(project_id, last_activity_at)``;
+- clicked a button - ``u.telegram_id IN (...)`` over ``button_clicks``
+  ``(project_id, step_id, button_id, created_at, telegram_id)``;
+- did not click - ``NOT EXISTS`` over ``(project_id, telegram_id, ...)``.
+
+The fragment refers to ``:project_id``; the caller binds it.
+``audience_where`` adds the target audience and is used both to size an
+audience in the API and to stream the recipients, so the two agree.
+"""
+from datetime import datetime
+from typing import Optional, Tuple
+
+from backend.db.funnel_queue import DUE_TIME_FORMAT
+
+
+def _time(value) -> str:
+    """A datetime or ISO string (from the JSON column) in the stored format."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value.strftime(DUE_TIME_FORMAT)
+
+
+def _clicks_where(click: dict, prefix: str, params: dict) -> str:
+    conditions = [f"c.step_id = :{prefix}_step_id"]
+    params[f"{prefix}_step_id"] = click["step_id"]
+    if click.get("button_id"):
+        conditions.append(f"c.button_id = :{prefix}_button_id")
+        params[f"{prefix}_button_id"] = click["button_id"]
+    if click.get("since"):
+        conditions.append(f"c.created_at >= :{prefix}_since")
+        params[f"{prefix}_since"] = _time(click["since"])
+    return " AND ".join(conditions)
+
+
+def compile_segment(segment: Optional[dict]) -> Tuple[str, dict]:
+    """WHERE fragment (``AND ...`` conditions, or "") and its params."""
+    if not segment:
+        return "", {}
+
+    conditions, params = [], {}
+
+    def add(condition: str, name: str, value):
+        conditions.append(condition)
+        params[name] = value
+
+    if segment.get("status"):
+        add("u.status = :seg_status", "seg_status", segment["status"])
+    if segment.get("funnel_step_min") is not None:
+        add("u.funnel_step >= :seg_step_min", "seg_step_min", segment["funnel_step_min"])
+    if segment.get("funnel_step_max") is not None:
+        add("u.funnel_step <= :seg_step_max", "seg_step_max", segment["funnel_step_max"])
+    if segment.get("created_after"):
+        add("u.created_at >= :seg_created_after", "seg_created_after", _time(segment["created_after"]))
+    if segment.get("created_before"):
+        add("u.created_at < :seg_created_before", "seg_created_before", _time(segment["created_before"]))
+    if segment.get("active_after"):
+        add("u.last_activity_at >= :seg_active_after", "seg_active_after", _time(segment["active_after"]))
+    if segment.get("active_before"):
+        add("u.last_activity_at < :seg_active_before", "seg_active_before", _time(segment["active_before"]))
+
+    if segment.get("clicked"):
+        conditions.append(f"""u.telegram_id IN (
+            SELECT c.telegram_id FROM button_clicks c
+            WHERE c.project_id = :project_id AND {_clicks_where(segment["clicked"], "seg_clicked", params)}
+        )""")
+    if segment.get("not_clicked"):
+        conditions.append(f"""NOT EXISTS (
+            SELECT 1 FROM button_clicks c
+            WHERE c.project_id = u.project_id AND c.telegram_id = u.telegram_id
+              AND {_clicks_where(segment["not_clicked"], "seg_not_clicked", params)}
+        )""")
+
+    return "".join(f" AND {condition}" for condition in conditions), params
+
+
+def audience_where(target_audience: str, segment: Optional[dict]) -> Tuple[str, dict]:
+    """WHERE clause over ``users u`` selecting a broadcast's audience, and its params."""
+    where = "u.project_id = :project_id"
+    if target_audience == "active":
+        where += " AND u.status = 'ACTIVE'"
+    segment_where, params = compile_segment(segment)
+    return where + segment_where, params
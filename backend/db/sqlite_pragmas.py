@@ -0,0 +1,47 @@
+"""SQLite connection profile.
+
+Every connection the project opens gets the same pragmas: the async engine
+through a SQLAlchemy ``connect`` event, scripts and one-off reads through
+``connect()``. With WAL readers no longer block the writer, and busy_timeout
+makes concurrent writers (scheduler, /start handlers, API) wait for the lock
+instead of failing with "database is locked".
+"""
+import sqlite3
+from typing import Optional
+
+from backend.core.config import SQLITE_PRAGMAS, SQLITE_TUNING
+
+# Applied in this order - journal_mode first, it may need an exclusive lock
+PRAGMA_ORDER = ("journal_mode", "busy_timeout", "synchronous", "cache_size", "mmap_size", "temp_store")
+
+
+def apply_pragmas(dbapi_connection, profile: Optional[dict] = None):
+    """Run the pragma profile on a DB-API connection (sqlite3 or aiosqlite adapter)."""
+    if profile is None:
+        if not SQLITE_TUNING:
+            return
+        profile = SQLITE_PRAGMAS
+    cursor = dbapi_connection.cursor()
+    try:
+        for name in PRAGMA_ORDER:
+            value = profile.get(name)
+            if value is not None and value != "":
+                cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def install(sync_engine):
+    """Apply the profile to each new connection of a SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection)
+
+
+def connect(db_path: str, profile: Optional[dict] = None) -> sqlite3.Connection:
+    """sqlite3.connect() with the project's pragma profile applied."""
+    conn = sqlite3.connect(db_path)
+    apply_pragmas(conn, profile)
+    return conn
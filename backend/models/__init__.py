@@ -1,9 +1,11 @@
 # Models package
 from backend.models.project import Project
 from backend.models.user import User
-from backend.models.funnel import FunnelStep
+from backend.models.funnel import FunnelStep, FunnelDailySends
 from backend.models.media import MediaFile, funnel_media_association
-from backend.models.broadcast import Broadcast
+from backend.models.broadcast import Broadcast, BroadcastDelivery
+from backend.models.lease import BotWorker, BotLease
+from backend.models.button_click import ButtonClick
 from backend.db.database import Base
 
-__all__ = ['Project', 'User', 'FunnelStep', 'MediaFile', 'Broadcast', 'funnel_media_association', 'Base']
+__all__ = ['Project', 'User', 'FunnelStep', 'FunnelDailySends', 'MediaFile', 'Broadcast', 'BroadcastDelivery', 'BotWorker', 'BotLease', 'ButtonClick', 'funnel_media_association', 'Base']
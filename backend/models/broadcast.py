@@ -1,5 +1,5 @@
 """Broadcast model."""
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from backend.db.database import Base
@@ -15,11 +15,17 @@ class Broadcast(Base):
     content_text = Column(Text, nullable=True)
     content_type = Column(String(20), nullable=False)  # 'text', 'photo', 'video', 'album'
     target_audience = Column(String(20), default="all")  # 'all', 'active'
+    # Optional SegmentSpec narrowing the audience (see backend/db/segments.py)
+    segment = Column(JSON, nullable=True, default=None)
     status = Column(String(20), default="draft")  # 'draft', 'scheduled', 'sending', 'completed'
     scheduled_at = Column(DateTime, nullable=True)
     sent_count = Column(Integer, default=0)
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        Index('ix_broadcasts_project_created', 'project_id', 'created_at'),
+    )
+
     # Relationships
     project = relationship("Project", back_populates="broadcasts")
     media_files = relationship(
@@ -30,3 +36,22 @@ class Broadcast(Base):
 
     def __repr__(self):
         return f"<Broadcast(id={self.id}, name='{self.name}', status='{self.status}')>"
+
+
+class BroadcastDelivery(Base):
+    """BroadcastDelivery model - outcome of a broadcast for one user.
+
+    Written in batches while the broadcast is sending, so an interrupted
+    broadcast can be resumed without sending twice to the same user.
+    """
+    __tablename__ = "broadcast_deliveries"
+
+    broadcast_id = Column(Integer, ForeignKey("broadcasts.id", ondelete="CASCADE"), primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    status = Column(String(20), nullable=False)  # 'sent', 'blocked', 'failed', 'skipped'
+    message_id = Column(BigInteger, nullable=True)
+    error_code = Column(String(255), nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+
+    def __repr__(self):
+        return f"<BroadcastDelivery(broadcast_id={self.broadcast_id}, user_id={self.user_id}, status='{self.status}')>"
@@ -0,0 +1,29 @@
+"""Button click model."""
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index
+from backend.db.database import Base
+
+
+class ButtonClick(Base):
+    """ButtonClick model - a press of a funnel step's callback button.
+
+    Written in batches by the bot (see bot/services/click_log.py) and used
+    by broadcast segments ("clicked / did not click button X").
+    """
+    __tablename__ = "button_clicks"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    project_id = Column(Integer, ForeignKey("projects.id", ondelete="CASCADE"), nullable=False)
+    telegram_id = Column(BigInteger, nullable=False)
+    step_id = Column(Integer, nullable=False)
+    button_id = Column(String(32), nullable=False)  # stable id from funnel_steps.buttons
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Users who clicked a button (covering: segment "clicked")
+        Index('ix_button_clicks_button', 'project_id', 'step_id', 'button_id', 'created_at', 'telegram_id'),
+        # Clicks of one user (segment "did not click")
+        Index('ix_button_clicks_user', 'project_id', 'telegram_id', 'step_id', 'button_id'),
+    )
+
+    def __repr__(self):
+        return f"<ButtonClick(project_id={self.project_id}, telegram_id={self.telegram_id}, button='{self.step_id}:{self.button_id}')>"
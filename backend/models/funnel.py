@@ -1,5 +1,5 @@
 """Funnel step and button models."""
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, UniqueConstraint, JSON
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, ForeignKey, UniqueConstraint, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from backend.db.database import Base
@@ -34,3 +34,19 @@ class FunnelStep(Base):
 
     def __repr__(self):
         return f"<FunnelStep(id={self.id}, step_number={self.step_number}, content_type='{self.content_type}')>"
+
+
+class FunnelDailySends(Base):
+    """FunnelDailySends model - funnel steps a project sent on one day (daily cap).
+
+    Incremented in the transaction that stores the sent steps (see
+    bot/services/repository.py update_user_steps).
+    """
+    __tablename__ = "funnel_daily_sends"
+
+    project_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    sent = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<FunnelDailySends(project_id={self.project_id}, day={self.day}, sent={self.sent})>"
@@ -0,0 +1,37 @@
+"""Worker and bot lease models (several processes sharing one bot.db)."""
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from backend.db.database import Base
+
+
+class BotWorker(Base):
+    """BotWorker model - a process running project bots, alive while it heartbeats."""
+    __tablename__ = "bot_workers"
+
+    worker_id = Column(String(64), primary_key=True)  # host:pid
+    started_at = Column(DateTime, nullable=False)
+    heartbeat_at = Column(DateTime, nullable=False)
+
+    def __repr__(self):
+        return f"<BotWorker(worker_id='{self.worker_id}', heartbeat_at={self.heartbeat_at})>"
+
+
+class BotLease(Base):
+    """BotLease model - the worker that runs a project's bot until expires_at.
+
+    Only the owner polls the bot, runs its funnel scheduler and sends its
+    broadcasts; the lease is renewed on every heartbeat and taken over by
+    another worker once it expires.
+    """
+    __tablename__ = "bot_leases"
+
+    project_id = Column(Integer, primary_key=True)
+    owner = Column(String(64), nullable=False)
+    acquired_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index('ix_bot_leases_owner', 'owner'),
+    )
+
+    def __repr__(self):
+        return f"<BotLease(project_id={self.project_id}, owner='{self.owner}', expires_at={self.expires_at})>"
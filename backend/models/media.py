@@ -1,5 +1,5 @@
 """Media file model."""
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Table, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from backend.db.database import Base
@@ -10,7 +10,9 @@ funnel_media_association = Table(
     'funnel_media_association',
     Base.metadata,
     Column('funnel_step_id', Integer, ForeignKey('funnel_steps.id', ondelete='CASCADE'), primary_key=True),
-    Column('media_file_id', Integer, ForeignKey('media_files.id', ondelete='CASCADE'), primary_key=True)
+    Column('media_file_id', Integer, ForeignKey('media_files.id', ondelete='CASCADE'), primary_key=True),
+    # The primary key covers lookups by step; this one lookups by media file
+    Index('ix_funnel_media_media_file', 'media_file_id')
 )
 
 
@@ -19,7 +21,8 @@ broadcast_media_association = Table(
     'broadcast_media_association',
     Base.metadata,
     Column('broadcast_id', Integer, ForeignKey('broadcasts.id', ondelete='CASCADE'), primary_key=True),
-    Column('media_file_id', Integer, ForeignKey('media_files.id', ondelete='CASCADE'), primary_key=True)
+    Column('media_file_id', Integer, ForeignKey('media_files.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_broadcast_media_media_file', 'media_file_id')
 )
 
 
@@ -36,6 +39,10 @@ class MediaFile(Base):
     telegram_file_id = Column(String(255), nullable=True)
     created_at = Column(DateTime, server_default=func.now())
 
+    __table_args__ = (
+        Index('ix_media_files_project_created', 'project_id', 'created_at'),
+    )
+
     # Relationships
     project = relationship("Project", back_populates="media_files")
     funnel_steps = relationship(
@@ -13,6 +13,8 @@ class Project(Base):
     name = Column(String(255), nullable=False)
     bot_token = Column(String(255), nullable=False, unique=True)
     admin_id = Column(BigInteger, nullable=False)
+    # Bumped on every funnel/media change to invalidate bot-side caches
+    funnel_version = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime, server_default=func.now())
 
     # Relationships
@@ -1,5 +1,5 @@
 """User model."""
-from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from backend.db.database import Base
@@ -18,11 +18,41 @@ class User(Base):
     funnel_step = Column(Integer, default=0)
     funnel_step_sent_at = Column(DateTime, nullable=True)
     status = Column(String(20), default="ACTIVE")
+    # When the next funnel step becomes due (NULL - funnel finished)
+    next_due_at = Column(DateTime, nullable=True)
+    # Failed sends of the current step; set funnel_dead_at stops the funnel
+    # until an admin retries it (dead letter)
+    funnel_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    funnel_error = Column(String(255), nullable=True)
+    funnel_dead_at = Column(DateTime, nullable=True)
+    # Earliest time the next step may go out (retry backoff, catch-up spread,
+    # daily cap); due times recomputed after a funnel edit do not move before it
+    funnel_hold_until = Column(DateTime, nullable=True)
+    # Last /start or button press (broadcast segments by activity)
+    last_activity_at = Column(DateTime, nullable=True)
+    # Funnel sender process that claimed the user's due step, until lease_expires_at
+    lease_owner = Column(String(64), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
 
-    # Unique constraint for project_id + telegram_id
     __table_args__ = (
+        # Unique constraint for project_id + telegram_id (also serves /start lookups)
+        Index('uq_users_project_telegram', 'project_id', 'telegram_id', unique=True),
+        # Users list of a project, newest first
+        Index('ix_users_project_created', 'project_id', 'created_at'),
+        # Due-queue lookup for the funnel scheduler, broadcast audiences by status
+        Index('ix_users_project_status_due', 'project_id', 'status', 'next_due_at'),
+        # Due queue of all projects (one funnel scheduler per process)
+        Index('ix_users_status_due', 'status', 'next_due_at'),
+        # Users list filtered by status, and per status / step counts (covering)
+        Index('ix_users_project_status_step', 'project_id', 'status', 'funnel_step'),
+        # Broadcast recipients of a project in id order (keyset chunks, no sort)
+        Index('ix_users_project_id', 'project_id', 'id'),
+        # Segments by last activity
+        Index('ix_users_project_activity', 'project_id', 'last_activity_at'),
+        # Dead-lettered users of a project
+        Index('ix_users_project_dead', 'project_id', 'funnel_dead_at'),
         {"sqlite_autoincrement": True},
     )
 
@@ -1,11 +1,12 @@
 """Pydantic schemas for API validation."""
 from pydantic import BaseModel
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Dict
 from datetime import datetime
 
 
 # ============== Button Schema ==============
 class ButtonSchema(BaseModel):
+    id: Optional[str] = None  # Stable id used in callback_data, assigned on save
     text: str
     action: str  # 'url' or 'callback'
     value: str   # URL or message text
@@ -19,6 +20,12 @@ class ProjectCreate(BaseModel):
     admin_id: Optional[int] = 0
 
 
+class ProjectUpdate(BaseModel):
+    name: Optional[str] = None
+    bot_token: Optional[str] = None
+    admin_id: Optional[int] = None
+
+
 class ProjectResponse(BaseModel):
     id: Optional[int] = None
     name: Optional[str] = ""
@@ -41,6 +48,9 @@ class UserResponse(BaseModel):
     funnel_step: Optional[int] = 0
     funnel_step_sent_at: Optional[datetime] = None
     status: Optional[str] = "ACTIVE"
+    funnel_attempts: Optional[int] = 0
+    funnel_error: Optional[str] = None
+    funnel_dead_at: Optional[datetime] = None
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
@@ -48,6 +58,18 @@ class UserResponse(BaseModel):
         from_attributes = True
 
 
+class UserPage(BaseModel):
+    items: List[UserResponse] = []
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for the next page; None on the last one
+
+
+class UserStats(BaseModel):
+    total: int = 0
+    by_status: Dict[str, int] = {}
+    by_step: Dict[int, int] = {}
+    dead_letter: int = 0
+
+
 class UserStatusUpdate(BaseModel):
     status: str
 
@@ -102,6 +124,25 @@ class FunnelStepResponse(BaseModel):
 
 
 # ============== Broadcast Schemas ==============
+class ClickFilter(BaseModel):
+    step_id: int
+    button_id: Optional[str] = None  # None - any button of the step
+    since: Optional[datetime] = None
+
+
+class SegmentSpec(BaseModel):
+    """Audience filter of a broadcast; all given conditions must hold."""
+    status: Optional[str] = None
+    funnel_step_min: Optional[int] = None
+    funnel_step_max: Optional[int] = None
+    created_after: Optional[datetime] = None
+    created_before: Optional[datetime] = None
+    active_after: Optional[datetime] = None   # last /start or button press
+    active_before: Optional[datetime] = None
+    clicked: Optional[ClickFilter] = None
+    not_clicked: Optional[ClickFilter] = None
+
+
 class BroadcastCreate(BaseModel):
     project_id: int
     name: str
@@ -109,6 +150,7 @@ class BroadcastCreate(BaseModel):
     content_type: str = "text"
     media_file_ids: Optional[List[int]] = None
     target_audience: str = "all"
+    segment: Optional[SegmentSpec] = None
     scheduled_at: Optional[datetime] = None
 
 
@@ -118,9 +160,22 @@ class BroadcastUpdate(BaseModel):
     content_type: Optional[str] = None
     media_file_ids: Optional[List[int]] = None
     target_audience: Optional[str] = None
+    segment: Optional[SegmentSpec] = None
     scheduled_at: Optional[datetime] = None
 
 
+class AudiencePreview(BaseModel):
+    project_id: int
+    target_audience: str = "all"
+    segment: Optional[SegmentSpec] = None
+
+
+class AudienceEstimate(BaseModel):
+    project_id: int
+    target_audience: str = "all"
+    count: int = 0
+
+
 class BroadcastResponse(BaseModel):
     id: Optional[int] = None
     project_id: Optional[int] = None
@@ -128,6 +183,7 @@ class BroadcastResponse(BaseModel):
     content_text: Optional[str] = None
     content_type: Optional[str] = "text"
     target_audience: Optional[str] = "all"
+    segment: Optional[SegmentSpec] = None
     status: Optional[str] = "draft"
     scheduled_at: Optional[datetime] = None
     sent_count: Optional[int] = 0
@@ -0,0 +1,153 @@
+"""Local fake of the Telegram Bot API for load and webhook tests.
+
+Point the bots at it with TELEGRAM_API_SERVER=http://127.0.0.1:8081. Any
+token of the form "<digits>:<anything>" is accepted, except those whose
+secret part starts with "revoked" (401 Unauthorized). Sent messages are
+only counted. Updates are injected through the /fake endpoints and are
+delivered to the registered webhook, or returned by getUpdates when the
+bot polls.
+
+    python -m benchmarks.fake_bot_api [--port 8081]
+
+    POST /fake/{token}/start?user_id=1   simulate /start from a user
+    GET  /fake/stats                     calls per method, webhooks
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter, defaultdict
+
+import aiohttp
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake Bot API")
+
+calls = Counter()
+webhooks = {}  # token -> {"url": ..., "secret_token": ...}
+queued_updates = defaultdict(list)  # token -> updates waiting for getUpdates
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+_http = None
+
+
+def bot_id(token: str) -> int:
+    return int(token.split(":", 1)[0])
+
+
+def ok(result):
+    return {"ok": True, "result": result}
+
+
+def message(chat_id, **fields) -> dict:
+    return {
+        "message_id": next(_message_ids),
+        "date": int(time.time()),
+        "chat": {"id": int(chat_id), "type": "private"},
+        **fields,
+    }
+
+
+def file_fields(kind: str) -> dict:
+    file_id = f"fake-{kind}-{next(_message_ids)}"
+    media = {"file_id": file_id, "file_unique_id": file_id, "width": 1, "height": 1}
+    if kind == "photo":
+        return {"photo": [media]}
+    return {"video": {**media, "duration": 1}}
+
+
+async def params(request: Request) -> dict:
+    if request.headers.get("content-type", "").startswith("application/json"):
+        return await request.json()
+    return dict(await request.form())
+
+
+@app.post("/bot{token}/{method}")
+async def bot_method(token: str, method: str, request: Request):
+    data = await params(request)
+    calls[method] += 1
+    if token.split(":", 1)[-1].startswith("revoked"):
+        return JSONResponse({"ok": False, "error_code": 401, "description": "Unauthorized"}, status_code=401)
+    method = method.lower()
+
+    if method == "getme":
+        return ok({"id": bot_id(token), "is_bot": True, "first_name": "Fake", "username": f"fake_{bot_id(token)}_bot"})
+    if method == "setwebhook":
+        webhooks[token] = {"url": data.get("url"), "secret_token": data.get("secret_token")}
+        return ok(True)
+    if method == "deletewebhook":
+        webhooks.pop(token, None)
+        return ok(True)
+    if method == "getwebhookinfo":
+        return ok({"url": webhooks.get(token, {}).get("url", ""), "has_custom_certificate": False, "pending_update_count": 0})
+    if method == "getupdates":
+        timeout = min(float(data.get("timeout") or 0), 10)
+        deadline = time.monotonic() + timeout
+        while not queued_updates[token] and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        updates, queued_updates[token] = queued_updates[token], []
+        return ok(updates)
+    if method == "sendmessage":
+        return ok(message(data["chat_id"], text=data.get("text", "")))
+    if method in ("sendphoto", "sendvideo"):
+        return ok(message(data["chat_id"], **file_fields(method[4:])))
+    if method == "sendmediagroup":
+        media = json.loads(data["media"])
+        return ok([message(data["chat_id"], **file_fields(item["type"])) for item in media])
+    # deleteMessage, answerCallbackQuery, ...
+    return ok(True)
+
+
+def start_update(user_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "username": f"user{user_id}"}
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user,
+            "text": "/start",
+            "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+        },
+    }
+
+
+async def deliver(token: str, update: dict) -> dict:
+    """Post the update to the bot's webhook, or queue it for getUpdates."""
+    global _http
+    hook = webhooks.get(token)
+    if not hook:
+        queued_updates[token].append(update)
+        return {"delivered": "queued"}
+
+    if _http is None:
+        _http = aiohttp.ClientSession()
+    headers = {}
+    if hook["secret_token"]:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = hook["secret_token"]
+    started = time.perf_counter()
+    async with _http.post(hook["url"], json=update, headers=headers) as response:
+        return {"delivered": "webhook", "status": response.status,
+                "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+@app.post("/fake/{token}/start")
+async def fake_start(token: str, user_id: int):
+    return await deliver(token, start_update(user_id))
+
+
+@app.get("/fake/stats")
+async def fake_stats():
+    return {"calls": dict(calls), "webhooks": len(webhooks), "queued": sum(map(len, queued_updates.values()))}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
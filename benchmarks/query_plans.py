@@ -0,0 +1,201 @@
+"""EXPLAIN QUERY PLAN check for the hot queries.
+
+Builds a scratch database from the models (or opens an existing one) and
+fails if any hot query has to scan a table without an index.
+
+    python -m benchmarks.query_plans [path/to/bot.db]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+PARAMS = {
+    "project_id": 1, "telegram_id": 1, "user_id": 1, "step_id": 1,
+    "broadcast_id": 1, "now": "2024-01-01 00:00:00", "limit": 500,
+}
+
+HOT_QUERIES = {
+    "/start user lookup": """
+        SELECT id, status FROM users
+        WHERE telegram_id = :telegram_id AND project_id = :project_id
+    """,
+    "scheduler due users": """
+        SELECT id, telegram_id, COALESCE(funnel_step, 0) AS funnel_step
+        FROM users
+        WHERE project_id = :project_id AND status = 'ACTIVE'
+          AND next_due_at IS NOT NULL AND next_due_at <= :now
+        ORDER BY next_due_at
+        LIMIT :limit
+    """,
+    "scheduler claim (all projects)": """
+        SELECT id FROM users
+        WHERE status = 'ACTIVE'
+          AND next_due_at IS NOT NULL AND next_due_at <= :now
+          AND project_id IN (1, 2, 3)
+          AND (lease_expires_at IS NULL OR lease_expires_at <= :now)
+        ORDER BY next_due_at
+        LIMIT :limit
+    """,
+    "daily cap: sent today": """
+        SELECT sent FROM funnel_daily_sends
+        WHERE project_id = :project_id AND day = :now
+    """,
+    "daily cap: claimed by others": """
+        SELECT COUNT(*) FROM users
+        WHERE project_id = :project_id AND status = 'ACTIVE'
+          AND next_due_at IS NOT NULL AND next_due_at <= :now
+          AND lease_expires_at > :now AND lease_owner != 'x'
+    """,
+    "broadcast recipients (active)": """
+        SELECT u.id, u.telegram_id FROM users u
+        WHERE u.project_id = :project_id
+          AND NOT EXISTS (
+              SELECT 1 FROM broadcast_deliveries d
+              WHERE d.broadcast_id = :broadcast_id AND d.user_id = u.id AND d.status IN ('sent', 'blocked')
+          )
+          AND u.status = 'ACTIVE' AND u.id > :user_id
+        ORDER BY u.id
+        LIMIT :limit
+    """,
+    "broadcast recipients (all)": """
+        SELECT u.id, u.telegram_id FROM users u
+        WHERE u.project_id = :project_id
+          AND NOT EXISTS (
+              SELECT 1 FROM broadcast_deliveries d
+              WHERE d.broadcast_id = :broadcast_id AND d.user_id = u.id AND d.status IN ('sent', 'blocked')
+          )
+          AND u.id > :user_id
+        ORDER BY u.id
+        LIMIT :limit
+    """,
+    "broadcast audience size": """
+        SELECT COUNT(*) FROM users WHERE project_id = :project_id AND status = 'ACTIVE'
+    """,
+    "segment size (step range)": """
+        SELECT COUNT(*) FROM users u
+        WHERE u.project_id = :project_id AND u.status = 'ACTIVE' AND u.funnel_step >= 3 AND u.funnel_step <= 5
+    """,
+    "segment size (last activity)": """
+        SELECT COUNT(*) FROM users u WHERE u.project_id = :project_id AND u.last_activity_at >= :now
+    """,
+    "segment size (clicked a button)": """
+        SELECT COUNT(*) FROM users u
+        WHERE u.project_id = :project_id AND u.telegram_id IN (
+            SELECT c.telegram_id FROM button_clicks c
+            WHERE c.project_id = :project_id AND c.step_id = :step_id AND c.button_id = '0' AND c.created_at >= :now
+        )
+    """,
+    "segment size (did not click)": """
+        SELECT COUNT(*) FROM users u
+        WHERE u.project_id = :project_id AND u.status = 'ACTIVE' AND NOT EXISTS (
+            SELECT 1 FROM button_clicks c
+            WHERE c.project_id = u.project_id AND c.telegram_id = u.telegram_id AND c.step_id = :step_id
+        )
+    """,
+    "users list page": """
+        SELECT * FROM users
+        WHERE project_id = :project_id AND (created_at, id) < (:now, :user_id)
+        ORDER BY created_at DESC, id DESC
+        LIMIT :limit
+    """,
+    "users list page (by status)": """
+        SELECT * FROM users
+        WHERE project_id = :project_id AND status = 'ACTIVE' AND funnel_step = 1
+        ORDER BY created_at DESC, id DESC
+        LIMIT :limit
+    """,
+    "dead-letter page": """
+        SELECT * FROM users
+        WHERE project_id = :project_id AND funnel_dead_at IS NOT NULL
+          AND (funnel_dead_at, id) < (:now, :user_id)
+        ORDER BY funnel_dead_at DESC, id DESC
+        LIMIT :limit
+    """,
+    "users stats": """
+        SELECT status, funnel_step, COUNT(*) FROM users
+        WHERE project_id = :project_id
+        GROUP BY status, funnel_step
+    """,
+    "funnel steps": """
+        SELECT * FROM funnel_steps WHERE project_id = :project_id ORDER BY step_number
+    """,
+    "funnel media of a project": """
+        SELECT fma.funnel_step_id, mf.id
+        FROM funnel_media_association fma
+        JOIN funnel_steps fs ON fs.id = fma.funnel_step_id
+        JOIN media_files mf ON mf.id = fma.media_file_id
+        WHERE fs.project_id = :project_id
+    """,
+    "step media": """
+        SELECT mf.id FROM media_files mf
+        JOIN funnel_media_association fma ON mf.id = fma.media_file_id
+        WHERE fma.funnel_step_id = :step_id
+    """,
+    "broadcast media": """
+        SELECT mf.id FROM media_files mf
+        JOIN broadcast_media_association bma ON mf.id = bma.media_file_id
+        WHERE bma.broadcast_id = :broadcast_id
+    """,
+    "steps using a media file": """
+        SELECT funnel_step_id FROM funnel_media_association WHERE media_file_id = :step_id
+    """,
+    "broadcasts list": """
+        SELECT * FROM broadcasts WHERE project_id = :project_id ORDER BY created_at DESC
+    """,
+    "media list": """
+        SELECT * FROM media_files WHERE project_id = :project_id ORDER BY created_at DESC
+    """,
+}
+
+
+def create_scratch_db() -> str:
+    """Create an empty database with the current schema."""
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    from sqlalchemy.ext.asyncio import create_async_engine
+    import backend.models  # noqa: F401 - registers the tables
+    from backend.db.database import Base
+    from backend.db.migrations import run_migrations
+
+    async def build():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.run_sync(run_migrations)
+        await engine.dispose()
+
+    asyncio.run(build())
+    return path
+
+
+def check_plan(conn, sql: str):
+    """Return (plan lines scanning a table without an index, full plan)."""
+    plan = conn.execute(f"EXPLAIN QUERY PLAN {sql}", PARAMS).fetchall()
+    return [row[3] for row in plan if row[3].startswith("SCAN") and "INDEX" not in row[3]], plan
+
+
+def main() -> int:
+    path = sys.argv[1] if len(sys.argv) > 1 else create_scratch_db()
+    conn = sqlite3.connect(path)
+    failed = 0
+    for name, sql in HOT_QUERIES.items():
+        scans, plan = check_plan(conn, sql)
+        print(f"[{'X' if scans else 'OK'}] {name}")
+        for row in plan:
+            print(f"      {row[3]}")
+        failed += bool(scans)
+    conn.close()
+
+    if failed:
+        print(f"[X] {failed} hot queries scan a table without an index")
+        return 1
+    print("[OK] All hot queries use an index")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""Memory and socket cost of running many project bots.
+
+Starts a local fake Bot API server, then in a fresh process per variant
+starts N bots and reports RSS and open sockets:
+
+    legacy - Bot with its own HTTP session plus its own Dispatcher and
+             Router per project (how run.py used to work)
+    shared - run.py today: one Dispatcher, one shared AiohttpSession
+
+    python -m benchmarks.scale_bots [--bots 500] [--mode polling|webhook]
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FAKE_API_PORT = 8091
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def open_sockets() -> int:
+    count = 0
+    for fd in os.listdir("/proc/self/fd"):
+        try:
+            if os.readlink(f"/proc/self/fd/{fd}").startswith("socket:"):
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+def tokens(count: int):
+    return [f"{700000 + i}:fake-token-{i}" for i in range(count)]
+
+
+async def start_legacy(token: str, mode: str):
+    from aiogram import Bot, Dispatcher, Router
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.filters import Command
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(os.environ["TELEGRAM_API_SERVER"]))
+    bot = Bot(token=token, session=session)
+    dp = Dispatcher()
+    router = Router()
+
+    async def cmd_start(message):
+        pass
+
+    router.message.register(cmd_start, Command("start"))
+    dp.include_router(router)
+    await bot.get_me()
+    if mode == "webhook":
+        await bot.set_webhook(f"http://127.0.0.1:1/webhook/{bot.id}")
+        await asyncio.Event().wait()
+    await dp.start_polling(bot, handle_signals=False)
+
+
+async def start_shared(token: str, mode: str):
+    import run
+
+    bot = run.create_bot(token)
+    run.bot_projects[bot.id] = bot.id
+    run.get_dispatcher()
+    await bot.get_me()
+    if mode == "webhook":
+        await bot.set_webhook(f"http://127.0.0.1:1/webhook/{bot.id}")
+        await asyncio.Event().wait()
+    await run.poll_updates(bot)
+
+
+async def child(variant: str, mode: str, count: int, settle: float):
+    """Runs inside the measured process; prints one JSON line."""
+    before = {"rss_mb": rss_mb(), "sockets": open_sockets()}
+    started = time.perf_counter()
+    start = start_legacy if variant == "legacy" else start_shared
+    tasks = [asyncio.create_task(start(token, mode)) for token in tokens(count)]
+    await asyncio.sleep(settle)
+    failed = sum(1 for task in tasks if task.done() and task.exception())
+    after = {"rss_mb": rss_mb(), "sockets": open_sockets()}
+    print(json.dumps({
+        "variant": variant, "before": before, "after": after,
+        "failed": failed, "elapsed": time.perf_counter() - started,
+    }))
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bots", type=int, default=500)
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--settle", type=float, default=15.0, help="seconds to let all bots start")
+    parser.add_argument("--child", nargs=2, metavar=("VARIANT", "MODE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        asyncio.run(child(args.child[0], args.child[1], args.bots, args.settle))
+        return
+
+    api_url = f"http://127.0.0.1:{FAKE_API_PORT}"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_bot_api", "--port", str(FAKE_API_PORT)], cwd=ROOT
+    )
+    env = dict(os.environ, TELEGRAM_API_SERVER=api_url, BOT_MODE=args.mode, PYTHONPATH=ROOT)
+    workdir = tempfile.mkdtemp()  # run.py creates media/ and bot.db in cwd
+    try:
+        time.sleep(2)
+        print(f"[BENCH] {args.bots} bots, {args.mode} mode")
+        for variant in ("legacy", "shared"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.scale_bots", "--bots", str(args.bots),
+                 "--settle", str(args.settle), "--child", variant, args.mode],
+                cwd=workdir, env=env, capture_output=True, text=True
+            ).stdout.strip().splitlines()
+            result = json.loads(output[-1])
+            print(f"[BENCH] {variant:6}: RSS {result['before']['rss_mb']:6.1f} -> {result['after']['rss_mb']:6.1f} MB, "
+                  f"sockets {result['before']['sockets']:4} -> {result['after']['sockets']:4}, "
+                  f"failed bots: {result['failed']}")
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Write throughput of SQLite with and without the pragma profile.
+
+Simulates the bot runtime: several concurrent writers doing small
+transactions (/start registrations, funnel step updates) while a reader
+polls for due users.
+
+    python -m benchmarks.sqlite_writes [--writers 8] [--writes 500]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from backend.core.config import SQLITE_PRAGMAS
+from backend.db.sqlite_pragmas import apply_pragmas
+
+
+SCHEMA = """
+    CREATE TABLE users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER NOT NULL,
+        telegram_id BIGINT NOT NULL,
+        funnel_step INTEGER DEFAULT 0,
+        next_due_at DATETIME,
+        updated_at DATETIME
+    )
+"""
+
+
+async def run(tuned: bool, writers: int, writes: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "bench.db")
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, SQLITE_PRAGMAS if tuned else {})
+
+    async with engine.begin() as conn:
+        await conn.execute(text(SCHEMA))
+
+    errors = 0
+    done = False
+
+    async def writer(n: int):
+        nonlocal errors
+        for i in range(writes):
+            try:
+                async with engine.begin() as conn:
+                    result = await conn.execute(text(
+                        "INSERT INTO users (project_id, telegram_id, updated_at) VALUES (1, :tg, CURRENT_TIMESTAMP)"
+                    ), {"tg": n * writes + i})
+                    await conn.execute(text(
+                        "UPDATE users SET funnel_step = 1, next_due_at = datetime('now', '+1 hour') WHERE id = :id"
+                    ), {"id": result.lastrowid})
+            except OperationalError:
+                errors += 1
+
+    async def reader():
+        reads = 0
+        while not done:
+            async with engine.connect() as conn:
+                await conn.execute(text(
+                    "SELECT id FROM users WHERE next_due_at <= datetime('now') LIMIT 500"
+                ))
+            reads += 1
+            await asyncio.sleep(0)
+        return reads
+
+    reader_task = asyncio.create_task(reader())
+    started = time.perf_counter()
+    await asyncio.gather(*(writer(n) for n in range(writers)))
+    elapsed = time.perf_counter() - started
+    done = True
+    reads = await reader_task
+    await engine.dispose()
+
+    total = writers * writes - errors
+    return {"elapsed": elapsed, "tx_per_sec": total / elapsed, "errors": errors, "reads": reads}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--writes", type=int, default=500, help="transactions per writer")
+    args = parser.parse_args()
+
+    print(f"[BENCH] {args.writers} writers x {args.writes} transactions, profile: {SQLITE_PRAGMAS}")
+    for tuned in (False, True):
+        result = await run(tuned, args.writers, args.writes)
+        label = "profile " if tuned else "defaults"
+        print(f"[BENCH] {label}: {result['tx_per_sec']:8.0f} tx/s  {result['elapsed']:6.2f}s  "
+              f"locked errors: {result['errors']}  reader polls: {result['reads']}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
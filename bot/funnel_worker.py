@@ -0,0 +1,86 @@
+"""Standalone funnel sender.
+
+Sends funnel steps of all projects without polling their bots, next to
+run.py. Due users are claimed with a lease (see
+FunnelScheduler.get_due_users), so any number of these workers can run
+at once: a large project's sends spread over processes and cores, and
+no step is delivered twice.
+
+    python -m bot.funnel_worker
+"""
+import asyncio
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
+
+from backend.core.config import TELEGRAM_API_SERVER, BOT_HTTP_POOL_SIZE, BOT_RECONCILE_INTERVAL
+from bot.services import repository
+from bot.services.funnel_scheduler import funnel_scheduler
+from bot.services.worker import worker_id
+
+
+async def sync_projects(session: AiohttpSession, tokens: dict):
+    """Send for every project with a valid token; drop deleted ones."""
+    projects = {project["id"]: project for project in await repository.get_projects()}
+    
+    for project_id in list(tokens):
+        if project_id not in projects:
+            funnel_scheduler.unregister(project_id)
+            del tokens[project_id]
+            print(f"[FUNNEL] Project {project_id} deleted, stopped sending")
+    
+    for project_id, project in projects.items():
+        if tokens.get(project_id) == project["bot_token"]:
+            continue
+        bot = Bot(
+            token=project["bot_token"],
+            session=session,
+            default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+        )
+        try:
+            bot_info = await bot.get_me()
+        except Exception as e:
+            # Sending with a bad token would fail every user's step
+            print(f"[X] Project {project_id}: bot token rejected ({e}), not sending")
+            funnel_scheduler.unregister(project_id)
+            tokens.pop(project_id, None)
+            continue
+        funnel_scheduler.register(project_id, bot)
+        tokens[project_id] = project["bot_token"]
+        print(f"[OK] Sending funnel of project {project_id} via @{bot_info.username}")
+
+
+async def main():
+    """Run the funnel scheduler for all projects until stopped."""
+    print(f"[BOT] Funnel worker {worker_id()} starting...")
+    
+    api = TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else PRODUCTION
+    session = AiohttpSession(api=api, limit=BOT_HTTP_POOL_SIZE)
+    tokens = {}  # project_id -> bot token being sent with
+    
+    funnel_scheduler.start()
+    try:
+        while True:
+            try:
+                await sync_projects(session, tokens)
+            except Exception as e:
+                print(f"[X] Reading projects failed: {e}")
+            await asyncio.sleep(BOT_RECONCILE_INTERVAL)
+    finally:
+        funnel_scheduler.stop()
+        await session.close()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("\n[BYE] Funnel worker stopped.")
@@ -1,6 +1,5 @@
 """Telegram Bot entry point."""
 import asyncio
-import sqlite3
 import sys
 import os
 
@@ -11,8 +10,9 @@ from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from aiogram.client.default import DefaultBotProperties
 
+from backend.db import sqlite_pragmas
 from bot.handlers import start, common
-from bot.services.funnel_scheduler import FunnelScheduler
+from bot.services.funnel_scheduler import funnel_scheduler
 
 
 def get_bot_config():
@@ -24,7 +24,7 @@ def get_bot_config():
         print("Please run: python init_db.py")
         sys.exit(1)
     
-    conn = sqlite3.connect(db_path)
+    conn = sqlite_pragmas.connect(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT id, name, bot_token, admin_id FROM projects LIMIT 1")
     result = cursor.fetchone()
@@ -73,8 +73,8 @@ async def main():
         return await handler(event, data)
     
     # Start funnel scheduler
-    scheduler = FunnelScheduler(bot, config["project_id"])
-    scheduler.start()
+    funnel_scheduler.register(config["project_id"], bot)
+    funnel_scheduler.start()
     
     try:
         # Get bot info
@@ -90,7 +90,7 @@ async def main():
         raise
     
     finally:
-        scheduler.stop()
+        funnel_scheduler.stop()
         await bot.session.close()
 
 
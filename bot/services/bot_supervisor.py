@@ -0,0 +1,232 @@
+"""Lifecycle of the project bots.
+
+The projects API notifies the supervisor when a project is created,
+updated or deleted, so a new bot comes online at once. A slow reconcile
+against the projects table only catches changes made outside the API.
+
+- a crashed bot is restarted with exponential backoff;
+- an invalid or revoked token trips a circuit breaker: the project is
+  parked and not retried until its config changes;
+- a changed token / name / admin_id restarts the bot with the new config;
+- with ProjectLeases, only the projects leased to this process run here,
+  and the projects table is re-read on every lease heartbeat.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from aiogram.exceptions import TelegramUnauthorizedError
+from aiogram.utils.token import TokenValidationError
+
+from backend.core.config import (
+    BOT_RESTART_BACKOFF_BASE,
+    BOT_RESTART_BACKOFF_MAX,
+    BOT_RECONCILE_INTERVAL,
+)
+from bot.services import repository
+from bot.services.project_leases import ProjectLeases
+
+# Errors that will not go away by retrying with the same token
+BREAKER_ERRORS = (TelegramUnauthorizedError, TokenValidationError)
+
+# Project fields a running bot depends on
+CONFIG_FIELDS = ("name", "bot_token", "admin_id")
+
+
+def project_config(project: dict) -> tuple:
+    return tuple(project.get(field) for field in CONFIG_FIELDS)
+
+
+class BotState:
+    """Supervision state of one project bot."""
+
+    def __init__(self, project: dict):
+        self.project = project
+        self.task: Optional[asyncio.Task] = None
+        self.restart_task: Optional[asyncio.Task] = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.parked = False
+        self.last_error: Optional[str] = None
+
+    @property
+    def status(self) -> str:
+        if self.parked:
+            return "parked"
+        if self.task and not self.task.done():
+            return "running"
+        return "backoff"
+
+
+class BotSupervisor:
+    """Starts, restarts and stops one task per project.
+
+    run_bot(project) runs a bot until it is cancelled or fails.
+    release_bot(project_id) is awaited before a bot is stopped because
+    its project was deleted or changed (e.g. to delete the webhook).
+    """
+
+    def __init__(
+        self,
+        run_bot: Callable[[dict], Awaitable],
+        release_bot: Optional[Callable[[int], Awaitable]] = None,
+        backoff_base: float = BOT_RESTART_BACKOFF_BASE,
+        backoff_max: float = BOT_RESTART_BACKOFF_MAX,
+        reconcile_interval: float = BOT_RECONCILE_INTERVAL,
+        leases: Optional[ProjectLeases] = None,
+    ):
+        self.run_bot = run_bot
+        self.release_bot = release_bot
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.reconcile_interval = reconcile_interval
+        self.leases = leases
+        self.states: Dict[int, BotState] = {}
+        self._lock = asyncio.Lock()
+        self._notify_tasks = set()
+
+    # ---------- entry points ----------
+
+    async def run(self):
+        """Reconcile with the projects table now and then, forever."""
+        # Leases must be renewed well before they expire
+        interval = self.leases.heartbeat_interval if self.leases else self.reconcile_interval
+        while True:
+            try:
+                await self.reconcile()
+            except Exception as e:
+                print(f"[X] Bot supervisor reconcile failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def reconcile(self):
+        """Start, restart and stop bots to match the projects table."""
+        projects = {project["id"]: project for project in await repository.get_projects()}
+        async with self._lock:
+            if self.leases:
+                owned = await self.leases.sync(list(projects))
+                for project_id in list(self.states):
+                    if project_id in projects and project_id not in owned:
+                        # Another worker runs it now and keeps its webhook
+                        await self._remove(project_id, release=False)
+                projects = {project_id: project for project_id, project in projects.items() if project_id in owned}
+            for project_id in list(self.states):
+                if project_id not in projects:
+                    await self._remove(project_id)
+            for project in projects.values():
+                await self._apply(project)
+
+    async def reload(self, project_id: int):
+        """Re-read one project and apply it (it was created, changed or deleted)."""
+        project = await repository.get_project(project_id)
+        async with self._lock:
+            if project is None:
+                await self._remove(project_id)
+            elif self.leases and not await self.leases.acquire(project_id):
+                return  # another worker runs it and applies the change on its next heartbeat
+            else:
+                await self._apply(project, unpark=True)
+
+    def notify(self, project_id: int):
+        """Called by the projects API after a change; applied in the background."""
+        task = asyncio.create_task(self.reload(project_id))
+        self._notify_tasks.add(task)
+        task.add_done_callback(self._notify_tasks.discard)
+
+    async def shutdown(self):
+        """Stop all bots (webhooks stay registered)."""
+        async with self._lock:
+            for state in self.states.values():
+                await self._stop(state, release=False)
+            self.states.clear()
+            if self.leases:
+                # Let the other workers take over right away
+                try:
+                    await self.leases.release_all()
+                except Exception as e:
+                    print(f"[!] Releasing bot leases failed: {e}")
+
+    def status(self) -> Dict[int, dict]:
+        return {
+            project_id: {"status": state.status, "failures": state.failures, "last_error": state.last_error}
+            for project_id, state in self.states.items()
+        }
+
+    # ---------- internals ----------
+
+    async def _apply(self, project: dict, unpark: bool = False):
+        state = self.states.get(project["id"])
+        if state is None:
+            state = self.states[project["id"]] = BotState(project)
+            self._start(state)
+            return
+
+        if project_config(project) != project_config(state.project):
+            print(f"[BOT] Project {project['id']} config changed, restarting bot")
+            await self._stop(state)
+            state.project = project
+            state.failures = 0
+            state.parked = False
+            self._start(state)
+        elif unpark and state.parked:
+            state.failures = 0
+            state.parked = False
+            self._start(state)
+
+    def _start(self, state: BotState):
+        if state.restart_task:
+            state.restart_task.cancel()
+            state.restart_task = None
+        state.started_at = time.monotonic()
+        state.task = asyncio.create_task(self.run_bot(state.project))
+        state.task.add_done_callback(lambda task: self._on_exit(state, task))
+
+    def _on_exit(self, state: BotState, task: asyncio.Task):
+        project_id = state.project["id"]
+        # Stopped on purpose
+        if task.cancelled() or state.task is not task or self.states.get(project_id) is not state:
+            return
+
+        error = task.exception()
+        state.last_error = f"{type(error).__name__}: {error}" if error else "bot exited"
+
+        if isinstance(error, BREAKER_ERRORS):
+            state.parked = True
+            print(f"[X] Project {project_id} parked - invalid bot token ({state.last_error})")
+            return
+
+        # A bot that ran for a while before failing starts the backoff over
+        if time.monotonic() - state.started_at > self.backoff_max:
+            state.failures = 0
+        state.failures += 1
+        delay = min(self.backoff_base * 2 ** (state.failures - 1), self.backoff_max)
+        print(f"[!] Bot of project {project_id} failed ({state.last_error}), restart in {delay:.0f}s")
+        state.restart_task = asyncio.create_task(self._restart_later(state, delay))
+
+    async def _restart_later(self, state: BotState, delay: float):
+        await asyncio.sleep(delay)
+        if self.states.get(state.project["id"]) is state and not state.parked:
+            state.restart_task = None
+            self._start(state)
+
+    async def _stop(self, state: BotState, release: bool = True):
+        if state.restart_task:
+            state.restart_task.cancel()
+            state.restart_task = None
+        task, state.task = state.task, None
+        if task and not task.done():
+            if release and self.release_bot:
+                try:
+                    await self.release_bot(state.project["id"])
+                except Exception as e:
+                    print(f"[!] Releasing bot of project {state.project['id']} failed: {e}")
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _remove(self, project_id: int, release: bool = True):
+        state = self.states.pop(project_id, None)
+        if state:
+            await self._stop(state, release=release)
+            if release:
+                print(f"[BOT] Stopped bot for deleted project {project_id}")
+            else:
+                print(f"[BOT] Stopped bot of project {project_id}, it moved to another worker")
@@ -0,0 +1,171 @@
+"""Concurrent, rate-limit-aware broadcast engine."""
+import asyncio
+import time
+from typing import AsyncIterable, Iterable, Optional, Tuple, Union
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramRetryAfter,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramServerError,
+)
+
+from backend.core.config import BROADCAST_CONCURRENCY, BROADCAST_MAX_RETRIES
+from bot.services.content_sender import ContentSender
+from bot.services.delivery_log import DeliveryLog
+from bot.services.media_warmup import warm_up_media
+from bot.services.rate_limiter import get_rate_limiter
+
+
+# Delivery outcomes
+SENT = "sent"
+BLOCKED = "blocked"  # user blocked the bot / deactivated account
+FAILED = "failed"
+SKIPPED = "skipped"  # nothing to send
+
+
+def error_code(error: Exception) -> str:
+    """Short description of a send error for the delivery log."""
+    message = getattr(error, "message", None) or str(error)
+    return f"{type(error).__name__}: {message}"[:255]
+
+
+class BroadcastResult:
+    """Counters of one broadcast run."""
+
+    def __init__(self):
+        self.sent = 0
+        self.blocked = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = time.monotonic()
+
+    def add(self, outcome: str):
+        setattr(self, outcome, getattr(self, outcome) + 1)
+
+    @property
+    def total(self) -> int:
+        return self.sent + self.blocked + self.failed + self.skipped
+
+    def __repr__(self):
+        elapsed = time.monotonic() - self.started_at
+        return (f"<BroadcastResult(sent={self.sent}, blocked={self.blocked}, failed={self.failed}, "
+                f"skipped={self.skipped}, {elapsed:.1f}s)>")
+
+
+class BroadcastEngine:
+    """Sends a broadcast with N sends in flight under the bot's rate limit.
+
+    - every send waits for a token of the bot's shared limiter;
+    - TelegramRetryAfter pauses the whole bot for retry_after and retries
+      (flood waits do not count against max_retries);
+    - network / 5xx errors are retried with exponential backoff;
+    - TelegramForbiddenError and "chat not found" are reported as BLOCKED,
+      other API errors as FAILED.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        content_sender: Optional[ContentSender] = None,
+        concurrency: int = BROADCAST_CONCURRENCY,
+        max_retries: int = BROADCAST_MAX_RETRIES,
+    ):
+        self.bot = bot
+        self.content_sender = content_sender or ContentSender(bot)
+        self.limiter = get_rate_limiter(bot)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+
+    async def send_one(self, broadcast: dict, chat_id: int) -> Tuple[str, Optional[int], Optional[str]]:
+        """Deliver the broadcast to one chat.
+
+        Returns (outcome, message_id, error_code).
+        """
+        attempt = 0
+        while True:
+            await self.limiter.acquire(chat_id)
+            try:
+                message_id = await self.content_sender.send_broadcast_to_user(broadcast, chat_id)
+                return (SENT, message_id, None) if message_id is not None else (SKIPPED, None, None)
+            except TelegramRetryAfter as e:
+                # Flood control applies to the whole bot, not only this chat
+                print(f"[BCAST] Flood control, pausing for {e.retry_after}s")
+                self.limiter.pause(e.retry_after)
+                continue
+            except TelegramForbiddenError as e:
+                return BLOCKED, None, error_code(e)
+            except TelegramBadRequest as e:
+                if "chat not found" in e.message.lower():
+                    return BLOCKED, None, error_code(e)
+                print(f"[X] Failed to send broadcast to {chat_id}: {e}")
+                return FAILED, None, error_code(e)
+            except (TelegramNetworkError, TelegramServerError) as e:
+                if attempt >= self.max_retries:
+                    print(f"[X] Broadcast to {chat_id} failed after {attempt + 1} attempts: {e}")
+                    return FAILED, None, error_code(e)
+                await asyncio.sleep(2 ** attempt)
+            except Exception as e:
+                print(f"[X] Failed to send broadcast to {chat_id}: {e}")
+                return FAILED, None, error_code(e)
+            attempt += 1
+
+    async def run(
+        self,
+        broadcast: dict,
+        users: Union[Iterable[dict], AsyncIterable[dict]],
+        delivery_log: Optional[DeliveryLog] = None,
+    ) -> BroadcastResult:
+        """Send a broadcast to all users and return the counters.
+
+        users may be an async iterator (e.g. streamed from the DB); it is
+        only read as fast as the sends go. With a delivery_log, every
+        outcome is persisted per user.
+        """
+        result = BroadcastResult()
+        # Media rows and InputMedia are resolved once for all recipients
+        broadcast = await self.content_sender.prepare_broadcast(broadcast)
+
+        # Upload uncached media once, before the fan-out
+        media_files = broadcast["media_files"]
+        if media_files:
+            await warm_up_media(self.bot, media_files[0]["project_id"], media_files)
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        async def worker():
+            while True:
+                user = await queue.get()
+                try:
+                    if user is None:
+                        return
+                    outcome, message_id, error = await self.send_one(broadcast, user["telegram_id"])
+                    result.add(outcome)
+                    if delivery_log:
+                        await delivery_log.record(user["id"], outcome, message_id, error)
+                except Exception as e:
+                    # A dead worker would leave the producer blocked on a full queue;
+                    # an outcome that failed to write stays buffered for the next flush
+                    print(f"[X] Broadcast {broadcast.get('id')}: recording delivery failed: {e}")
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+        try:
+            if hasattr(users, "__aiter__"):
+                async for user in users:
+                    await queue.put(user)
+            else:
+                for user in users:
+                    await queue.put(user)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for task in workers:
+                task.cancel()
+            if delivery_log:
+                await delivery_log.flush()
+
+        print(f"[BCAST] Broadcast {broadcast.get('id')} finished: {result}")
+        return result
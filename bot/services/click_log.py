@@ -0,0 +1,66 @@
+"""Write-behind log of button presses (button_clicks).
+
+Presses are answered from the funnel cache without touching the DB; the
+clicks, and the users' last_activity_at, are written in batches of up to
+CLICK_LOG_BATCH_SIZE at most every CLICK_LOG_FLUSH_INTERVAL seconds, so a
+burst of presses after a broadcast costs a few transactions.
+"""
+import asyncio
+from typing import List, Optional
+
+from backend.core.config import CLICK_LOG_BATCH_SIZE, CLICK_LOG_FLUSH_INTERVAL
+from bot.services import repository
+
+
+class ClickLog:
+    """Buffers button presses and writes them in batched inserts."""
+
+    def __init__(self, batch_size: int = CLICK_LOG_BATCH_SIZE, flush_interval: float = CLICK_LOG_FLUSH_INTERVAL):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: List[dict] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def record(self, project_id: int, telegram_id: int, step_id: int, button_id: str, now: str):
+        """Remember one press; flushes right away when the batch is full."""
+        self._pending.append({
+            "project_id": project_id,
+            "telegram_id": telegram_id,
+            "step_id": step_id,
+            "button_id": button_id,
+            "now": now,
+        })
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Write all pending clicks in one transaction."""
+        async with self._lock:
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, []
+            try:
+                await repository.save_button_clicks(rows)
+            except Exception as e:
+                # Clicks only feed segments - losing a batch is better than piling up
+                print(f"[X] Failed to write {len(rows)} button clicks: {e}")
+
+    async def close(self):
+        """Stop the timer and write what is left."""
+        if self._timer and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
+
+
+# Process-wide log shared by all bots
+click_log = ClickLog()
@@ -1,9 +1,12 @@
 """Content sender service for sending funnel steps and broadcasts."""
 import os
-import sqlite3
 from typing import List, Optional
 from aiogram import Bot
-from aiogram.types import FSInputFile, InputMediaPhoto, InputMediaVideo, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import FSInputFile, InputMediaPhoto, InputMediaVideo, InlineKeyboardMarkup
+
+from bot.services import repository
+from bot.services.funnel_cache import parse_buttons, build_keyboard
 
 
 # Get absolute path to media directory
@@ -17,123 +20,54 @@ class ContentSender:
     def __init__(self, bot: Bot):
         self.bot = bot
     
-    def get_media_files(self, step_id: int) -> List[dict]:
+    async def get_media_files(self, step_id: int) -> List[dict]:
         """Get media files for a funnel step."""
-        db_path = os.path.join(BASE_DIR, 'bot.db')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT mf.id, mf.project_id, mf.filename, mf.original_name, mf.file_type, mf.telegram_file_id
-            FROM media_files mf
-            JOIN funnel_media_association fma ON mf.id = fma.media_file_id
-            WHERE fma.funnel_step_id = ?
-        """, (step_id,))
-        files = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "id": f[0],
-                "project_id": f[1],
-                "filename": f[2],
-                "original_name": f[3],
-                "file_type": f[4],
-                "telegram_file_id": f[5]
-            }
-            for f in files
-        ]
+        return await repository.get_step_media_files(step_id)
     
-    def get_broadcast_media_files(self, broadcast_id: int) -> List[dict]:
+    async def get_broadcast_media_files(self, broadcast_id: int) -> List[dict]:
         """Get media files for a broadcast."""
-        db_path = os.path.join(BASE_DIR, 'bot.db')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT mf.id, mf.project_id, mf.filename, mf.original_name, mf.file_type, mf.telegram_file_id
-            FROM media_files mf
-            JOIN broadcast_media_association bma ON mf.id = bma.media_file_id
-            WHERE bma.broadcast_id = ?
-        """, (broadcast_id,))
-        files = cursor.fetchall()
-        conn.close()
-        
-        return [
-            {
-                "id": f[0],
-                "project_id": f[1],
-                "filename": f[2],
-                "original_name": f[3],
-                "file_type": f[4],
-                "telegram_file_id": f[5]
-            }
-            for f in files
-        ]
+        return await repository.get_broadcast_media_files(broadcast_id)
     
-    def get_buttons(self, step_id: int) -> Optional[List[dict]]:
+    async def get_buttons(self, step_id: int) -> Optional[List[dict]]:
         """Get buttons for a funnel step."""
-        db_path = os.path.join(BASE_DIR, 'bot.db')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT buttons FROM funnel_steps WHERE id = ?", (step_id,))
-        result = cursor.fetchone()
-        conn.close()
-        
-        if result and result[0]:
-            import json
-            try:
-                return json.loads(result[0]) if isinstance(result[0], str) else result[0]
-            except:
-                return None
-        return None
+        return parse_buttons(await repository.get_step_buttons(step_id))
     
     def build_keyboard(self, buttons: List[dict], step_id: int) -> Optional[InlineKeyboardMarkup]:
         """Build InlineKeyboardMarkup from buttons config."""
-        if not buttons:
-            return None
-        
-        # Group buttons by row
-        rows = {}
-        for btn in buttons:
-            row_num = btn.get('row', 0)
-            if row_num not in rows:
-                rows[row_num] = []
-            
-            if btn['action'] == 'url':
-                rows[row_num].append(InlineKeyboardButton(
-                    text=btn['text'],
-                    url=btn['value']
-                ))
-            else:  # callback
-                rows[row_num].append(InlineKeyboardButton(
-                    text=btn['text'],
-                    callback_data=f"btn_{step_id}_{len(rows[row_num])}"
-                ))
-        
-        # Build keyboard rows
-        keyboard = []
-        for row_num in sorted(rows.keys()):
-            keyboard.append(rows[row_num])
-        
-        return InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
+        return build_keyboard(buttons, step_id)
+    
+    async def get_step_keyboard(self, step: dict) -> Optional[InlineKeyboardMarkup]:
+        """Keyboard of a step - prebuilt for compiled steps, else from DB."""
+        if "keyboard" in step:
+            return step["keyboard"]
+        buttons = await self.get_buttons(step["id"])
+        return self.build_keyboard(buttons, step["id"]) if buttons else None
+    
+    async def get_step_media_files(self, step: dict) -> List[dict]:
+        """Media of a step - cached for compiled steps, else from DB."""
+        if "media_files" in step:
+            return step["media_files"]
+        return await self.get_media_files(step["id"])
     
-    def update_telegram_file_id(self, media_id: int, file_id: str):
+    async def update_telegram_file_id(self, media_id: int, file_id: str):
         """Update telegram_file_id after first upload."""
-        db_path = os.path.join(BASE_DIR, 'bot.db')
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            "UPDATE media_files SET telegram_file_id = ? WHERE id = ?",
-            (file_id, media_id)
-        )
-        conn.commit()
-        conn.close()
+        await repository.update_telegram_file_id(media_id, file_id)
+    
+    async def cache_file_id(self, media: dict, file_id: str):
+        """Remember telegram_file_id in the DB and in the media row itself."""
+        media["telegram_file_id"] = file_id
+        await self.update_telegram_file_id(media["id"], file_id)
     
     def get_file_path(self, project_id: int, filename: str) -> str:
         """Get full path to media file."""
         return os.path.join(MEDIA_DIR, str(project_id), filename)
     
     async def send_funnel_step(self, user_telegram_id: int, step: dict) -> bool:
-        """Send funnel step content to a user."""
+        """Send funnel step content to a user.
+        
+        Bot API errors are raised, so the scheduler can tell a blocked user
+        from bad content or a network failure. False means nothing was sent.
+        """
         try:
             content_type = step["content_type"]
             content_text = step.get("content_text") or ""
@@ -143,8 +77,7 @@ class ContentSender:
             print(f"[SEND] Sending step {step['step_number']} to {user_telegram_id}: type={content_type}")
             
             # Get buttons for this step
-            buttons = self.get_buttons(step_id)
-            keyboard = self.build_keyboard(buttons, step_id) if buttons else None
+            keyboard = await self.get_step_keyboard(step)
             
             if content_type == "text":
                 if content_text:
@@ -158,7 +91,7 @@ class ContentSender:
                     return False
             
             elif content_type == "photo":
-                media_files = self.get_media_files(step_id)
+                media_files = await self.get_step_media_files(step)
                 print(f"[MEDIA] Found {len(media_files)} media files for step {step_id}")
                 
                 if media_files:
@@ -185,7 +118,7 @@ class ContentSender:
                                 caption=content_text or None,
                                 reply_markup=keyboard
                             )
-                            self.update_telegram_file_id(media["id"], msg.photo[-1].file_id)
+                            await self.cache_file_id(media, msg.photo[-1].file_id)
                             print(f"[OK] Photo sent and cached")
                         else:
                             print(f"[X] File not found: {file_path}")
@@ -204,7 +137,7 @@ class ContentSender:
                         )
             
             elif content_type == "video":
-                media_files = self.get_media_files(step_id)
+                media_files = await self.get_step_media_files(step)
                 print(f"[VIDEO] Found {len(media_files)} media files for video step {step_id}")
                 
                 if media_files:
@@ -231,7 +164,7 @@ class ContentSender:
                                 caption=content_text or None,
                                 reply_markup=keyboard
                             )
-                            self.update_telegram_file_id(media["id"], msg.video.file_id)
+                            await self.cache_file_id(media, msg.video.file_id)
                             print(f"[OK] Video sent and cached")
                         else:
                             print(f"[X] Video file not found: {file_path}")
@@ -251,7 +184,7 @@ class ContentSender:
                         )
             
             elif content_type == "album":
-                media_files = self.get_media_files(step_id)
+                media_files = await self.get_step_media_files(step)
                 print(f"[ALBUM] Found {len(media_files)} media files for album step {step_id}")
                 
                 if media_files:
@@ -286,9 +219,9 @@ class ContentSender:
                                 media = media_files[i]
                                 if not media["telegram_file_id"]:
                                     if msg.photo:
-                                        self.update_telegram_file_id(media["id"], msg.photo[-1].file_id)
+                                        await self.cache_file_id(media, msg.photo[-1].file_id)
                                     elif msg.video:
-                                        self.update_telegram_file_id(media["id"], msg.video.file_id)
+                                        await self.cache_file_id(media, msg.video.file_id)
                         print(f"[OK] Album sent with {len(media_group)} items")
                         
                         # Send buttons separately for albums
@@ -308,116 +241,145 @@ class ContentSender:
             
             return True
         
+        except TelegramAPIError:
+            raise
         except Exception as e:
             print(f"[X] Error sending to {user_telegram_id}: {e}")
             import traceback
             traceback.print_exc()
             return False
     
-    async def send_broadcast(self, broadcast: dict, users: List[dict]) -> int:
-        """Send broadcast to multiple users. Returns count of successful sends."""
-        sent_count = 0
+    async def prepare_broadcast(self, broadcast: dict) -> dict:
+        """Resolve broadcast media once, before the fan-out.
         
-        for user in users:
-            try:
-                content_type = broadcast.get("content_type", "text")
-                content_text = broadcast.get("content_text") or ""
-                broadcast_id = broadcast.get("id")
-                
-                if content_type == "text":
-                    if content_text:
-                        await self.bot.send_message(user["telegram_id"], content_text)
-                        sent_count += 1
-                
-                elif content_type == "photo":
-                    media_files = self.get_broadcast_media_files(broadcast_id)
-                    if media_files:
-                        media = media_files[0]
-                        file_id = media["telegram_file_id"]
-                        if file_id:
-                            await self.bot.send_photo(user["telegram_id"], file_id, caption=content_text or None)
-                            sent_count += 1
-                        else:
-                            file_path = self.get_file_path(media["project_id"], media["filename"])
-                            if os.path.exists(file_path):
-                                msg = await self.bot.send_photo(user["telegram_id"], FSInputFile(file_path), caption=content_text or None)
-                                self.update_telegram_file_id(media["id"], msg.photo[-1].file_id)
-                                sent_count += 1
-                            elif content_text:
-                                await self.bot.send_message(user["telegram_id"], content_text)
-                                sent_count += 1
-                    elif content_text:
-                        await self.bot.send_message(user["telegram_id"], content_text)
-                        sent_count += 1
-                
-                elif content_type == "video":
-                    media_files = self.get_broadcast_media_files(broadcast_id)
-                    if media_files:
-                        media = media_files[0]
-                        file_id = media["telegram_file_id"]
-                        if file_id:
-                            await self.bot.send_video(user["telegram_id"], file_id, caption=content_text or None)
-                            sent_count += 1
-                        else:
-                            file_path = self.get_file_path(media["project_id"], media["filename"])
-                            if os.path.exists(file_path):
-                                msg = await self.bot.send_video(user["telegram_id"], FSInputFile(file_path), caption=content_text or None)
-                                self.update_telegram_file_id(media["id"], msg.video.file_id)
-                                sent_count += 1
-                            elif content_text:
-                                await self.bot.send_message(user["telegram_id"], content_text)
-                                sent_count += 1
+        The returned payload is shared by all recipients: media rows (with
+        telegram_file_ids learned on the first send) and, for albums, the
+        prebuilt InputMedia list. Only the chat id changes per send.
+        """
+        if "media_files" in broadcast:
+            return broadcast
+        payload = dict(broadcast)
+        if payload.get("content_type", "text") != "text":
+            payload["media_files"] = await self.get_broadcast_media_files(payload["id"])
+        else:
+            payload["media_files"] = []
+        payload["input_media"] = None
+        return payload
+    
+    def build_media_group(self, media_files: List[dict], caption: str) -> list:
+        """Build InputMedia items for an album (uploads files without a file_id)."""
+        media_group = []
+        for i, media in enumerate(media_files):
+            file_id = media["telegram_file_id"]
+            item_caption = caption if i == 0 else None
+            if file_id:
+                source = file_id
+            else:
+                file_path = self.get_file_path(media["project_id"], media["filename"])
+                if not os.path.exists(file_path):
+                    continue
+                source = FSInputFile(file_path)
+            if media["file_type"] == "photo":
+                media_group.append(InputMediaPhoto(media=source, caption=item_caption))
+            else:
+                media_group.append(InputMediaVideo(media=source, caption=item_caption))
+        return media_group
+    
+    async def send_broadcast_to_user(self, broadcast: dict, chat_id: int) -> Optional[int]:
+        """Send broadcast content to one chat.
+        
+        Returns the message_id of the sent message (the first one for
+        albums), or None if there was nothing to send. Telegram errors are
+        raised to the caller (the broadcast engine classifies them).
+        """
+        broadcast = await self.prepare_broadcast(broadcast)
+        content_type = broadcast.get("content_type", "text")
+        content_text = broadcast.get("content_text") or ""
+        
+        if content_type == "text":
+            if content_text:
+                msg = await self.bot.send_message(chat_id, content_text)
+                return msg.message_id
+        
+        elif content_type == "photo":
+            media_files = broadcast["media_files"]
+            if media_files:
+                media = media_files[0]
+                file_id = media["telegram_file_id"]
+                if file_id:
+                    msg = await self.bot.send_photo(chat_id, file_id, caption=content_text or None)
+                    return msg.message_id
+                else:
+                    file_path = self.get_file_path(media["project_id"], media["filename"])
+                    if os.path.exists(file_path):
+                        msg = await self.bot.send_photo(chat_id, FSInputFile(file_path), caption=content_text or None)
+                        await self.cache_file_id(media, msg.photo[-1].file_id)
+                        return msg.message_id
                     elif content_text:
-                        await self.bot.send_message(user["telegram_id"], content_text)
-                        sent_count += 1
-                
-                elif content_type == "album":
-                    media_files = self.get_broadcast_media_files(broadcast_id)
-                    if media_files:
-                        media_group = []
-                        for i, media in enumerate(media_files):
-                            file_id = media["telegram_file_id"]
-                            caption = content_text if i == 0 else None
-                            if file_id:
-                                if media["file_type"] == "photo":
-                                    media_group.append(InputMediaPhoto(media=file_id, caption=caption))
-                                else:
-                                    media_group.append(InputMediaVideo(media=file_id, caption=caption))
-                            else:
-                                file_path = self.get_file_path(media["project_id"], media["filename"])
-                                if os.path.exists(file_path):
-                                    if media["file_type"] == "photo":
-                                        media_group.append(InputMediaPhoto(media=FSInputFile(file_path), caption=caption))
-                                    else:
-                                        media_group.append(InputMediaVideo(media=FSInputFile(file_path), caption=caption))
-                        
-                        if media_group:
-                            messages = await self.bot.send_media_group(user["telegram_id"], media_group)
-                            for i, msg in enumerate(messages):
-                                if i < len(media_files):
-                                    media = media_files[i]
-                                    if not media["telegram_file_id"]:
-                                        if msg.photo:
-                                            self.update_telegram_file_id(media["id"], msg.photo[-1].file_id)
-                                        elif msg.video:
-                                            self.update_telegram_file_id(media["id"], msg.video.file_id)
-                            sent_count += 1
-                        elif content_text:
-                            await self.bot.send_message(user["telegram_id"], content_text)
-                            sent_count += 1
+                        msg = await self.bot.send_message(chat_id, content_text)
+                        return msg.message_id
+            elif content_text:
+                msg = await self.bot.send_message(chat_id, content_text)
+                return msg.message_id
+        
+        elif content_type == "video":
+            media_files = broadcast["media_files"]
+            if media_files:
+                media = media_files[0]
+                file_id = media["telegram_file_id"]
+                if file_id:
+                    msg = await self.bot.send_video(chat_id, file_id, caption=content_text or None)
+                    return msg.message_id
+                else:
+                    file_path = self.get_file_path(media["project_id"], media["filename"])
+                    if os.path.exists(file_path):
+                        msg = await self.bot.send_video(chat_id, FSInputFile(file_path), caption=content_text or None)
+                        await self.cache_file_id(media, msg.video.file_id)
+                        return msg.message_id
                     elif content_text:
-                        await self.bot.send_message(user["telegram_id"], content_text)
-                        sent_count += 1
+                        msg = await self.bot.send_message(chat_id, content_text)
+                        return msg.message_id
+            elif content_text:
+                msg = await self.bot.send_message(chat_id, content_text)
+                return msg.message_id
+        
+        elif content_type == "album":
+            media_files = broadcast["media_files"]
+            if media_files:
+                # Prebuilt once all items have a telegram_file_id
+                media_group = broadcast.get("input_media") or self.build_media_group(media_files, content_text)
                 
-                else:
-                    # Unknown content type, send text only
-                    if content_text:
-                        await self.bot.send_message(user["telegram_id"], content_text)
-                        sent_count += 1
-                        
-            except Exception as e:
-                print(f"[X] Failed to send broadcast to {user['telegram_id']}: {e}")
-                import traceback
-                traceback.print_exc()
+                if media_group:
+                    messages = await self.bot.send_media_group(chat_id, media_group)
+                    for i, msg in enumerate(messages):
+                        if i < len(media_files):
+                            media = media_files[i]
+                            if not media["telegram_file_id"]:
+                                if msg.photo:
+                                    await self.cache_file_id(media, msg.photo[-1].file_id)
+                                elif msg.video:
+                                    await self.cache_file_id(media, msg.video.file_id)
+                    if not broadcast.get("input_media") and all(media["telegram_file_id"] for media in media_files):
+                        broadcast["input_media"] = self.build_media_group(media_files, content_text)
+                    return messages[0].message_id
+                elif content_text:
+                    msg = await self.bot.send_message(chat_id, content_text)
+                    return msg.message_id
+            elif content_text:
+                msg = await self.bot.send_message(chat_id, content_text)
+                return msg.message_id
+        
+        else:
+            # Unknown content type, send text only
+            if content_text:
+                msg = await self.bot.send_message(chat_id, content_text)
+                return msg.message_id
+        
+        return None
+    
+    async def send_broadcast(self, broadcast: dict, users: List[dict]) -> int:
+        """Send broadcast to multiple users. Returns count of successful sends."""
+        from bot.services.broadcast_engine import BroadcastEngine
         
-        return sent_count
+        result = await BroadcastEngine(self.bot, self).run(broadcast, users)
+        return result.sent
@@ -0,0 +1,56 @@
+"""Persistent per-user delivery log of a broadcast (broadcast_deliveries)."""
+import time
+from typing import List, Optional
+
+from bot.services import repository
+
+# Outcomes that are final - such users are skipped when a broadcast resumes
+DONE_STATUSES = ('sent', 'blocked')
+
+
+class DeliveryLog:
+    """Buffers delivery outcomes and writes them in batched inserts.
+
+    Each flush also stores the running sent_count on the broadcast, so the
+    admin panel sees progress while the broadcast is sending.
+    """
+
+    def __init__(self, broadcast_id: int, batch_size: int = 200, flush_interval: float = 2.0):
+        self.broadcast_id = broadcast_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending: List[dict] = []
+        self._flushed_at = time.monotonic()
+
+    async def record(self, user_id: int, status: str, message_id: Optional[int] = None, error_code: Optional[str] = None):
+        """Remember the outcome of one send; flush when the batch is full."""
+        self._pending.append({
+            "broadcast_id": self.broadcast_id,
+            "user_id": user_id,
+            "status": status,
+            "message_id": message_id,
+            "error_code": error_code
+        })
+        if (len(self._pending) >= self.batch_size
+                or time.monotonic() - self._flushed_at >= self.flush_interval):
+            await self.flush()
+
+    async def flush(self):
+        """Write buffered outcomes in one transaction."""
+        self._flushed_at = time.monotonic()
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+
+        sent = sum(1 for row in rows if row["status"] == 'sent')
+        try:
+            await repository.save_deliveries(self.broadcast_id, rows, sent)
+        except Exception:
+            # Keep them for the next flush, or these users get the broadcast again on resume
+            self._pending = rows + self._pending
+            raise
+
+    @staticmethod
+    async def clear(broadcast_id: int):
+        """Forget all outcomes - the broadcast will go to everyone again."""
+        await repository.clear_deliveries(broadcast_id)
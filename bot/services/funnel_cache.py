@@ -0,0 +1,164 @@
+"""In-memory cache of compiled funnels.
+
+A compiled funnel holds every step of a project with its parsed buttons,
+a prebuilt InlineKeyboardMarkup and the media rows, so sending a step to
+any number of users costs no DB reads for step metadata. It also maps
+every callback_data of its keyboards to the button, so button presses
+are answered from memory too.
+
+Callback buttons carry ``b:{step_id}:{button_id}``, where button_id is
+the stable id the admin API stores in the button (see ``button_id``).
+Messages sent before ids existed carry ``btn_{step_id}_{index}``; those
+still resolve to the index-th button of the step.
+
+Invalidation: the admin API bumps ``projects.funnel_version`` on every
+funnel or media change and calls ``invalidate()`` for the current process.
+Other processes notice the new version on the next periodic check.
+"""
+import json
+import time
+from typing import Dict, List, Optional
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from bot.services import repository
+
+# How often a cached funnel re-reads projects.funnel_version
+VERSION_CHECK_INTERVAL = 5.0
+
+
+def parse_buttons(raw) -> Optional[List[dict]]:
+    """Parse the funnel_steps.buttons JSON column."""
+    if not raw:
+        return None
+    try:
+        return json.loads(raw) if isinstance(raw, str) else raw
+    except (TypeError, ValueError):
+        return None
+
+
+def button_id(button: dict, index: int) -> str:
+    """Stable id of a button; buttons saved without one are known by position."""
+    return str(button.get("id") or index)
+
+
+def callback_data(step_id: int, button: dict, index: int) -> str:
+    return f"b:{step_id}:{button_id(button, index)}"
+
+
+def build_keyboard(buttons: List[dict], step_id: int) -> Optional[InlineKeyboardMarkup]:
+    """Build InlineKeyboardMarkup from buttons config."""
+    if not buttons:
+        return None
+
+    # Group buttons by row
+    rows = {}
+    for index, btn in enumerate(buttons):
+        row_num = btn.get('row', 0)
+        if row_num not in rows:
+            rows[row_num] = []
+
+        if btn['action'] == 'url':
+            rows[row_num].append(InlineKeyboardButton(
+                text=btn['text'],
+                url=btn['value']
+            ))
+        else:  # callback
+            rows[row_num].append(InlineKeyboardButton(
+                text=btn['text'],
+                callback_data=callback_data(step_id, btn, index)
+            ))
+
+    # Build keyboard rows
+    keyboard = []
+    for row_num in sorted(rows.keys()):
+        keyboard.append(rows[row_num])
+
+    return InlineKeyboardMarkup(inline_keyboard=keyboard) if keyboard else None
+
+
+class CompiledFunnel:
+    """All steps of one project, ready to send."""
+
+    def __init__(self, project_id: int, version: int, steps: Dict[int, dict]):
+        self.project_id = project_id
+        self.version = version
+        self.steps = steps  # step_number -> compiled step dict
+        # callback_data -> button, with its step_id and (stable) id
+        self.callbacks: Dict[str, dict] = {}
+        for step in steps.values():
+            for index, button in enumerate(step["buttons"] or []):
+                resolved = dict(button, id=button_id(button, index), step_id=step["id"])
+                self.callbacks[callback_data(step["id"], button, index)] = resolved
+                self.callbacks[f"btn_{step['id']}_{index}"] = resolved
+        self.checked_at = time.monotonic()
+
+    def get_step(self, step_number: int) -> Optional[dict]:
+        return self.steps.get(step_number)
+
+    def get_button(self, data: str) -> Optional[dict]:
+        """The button a callback_data of this project's keyboards belongs to."""
+        return self.callbacks.get(data)
+
+
+class FunnelCache:
+    """Per-project compiled funnel cache with version-based invalidation."""
+
+    def __init__(self):
+        self._funnels: Dict[int, CompiledFunnel] = {}
+
+    def invalidate(self, project_id: int):
+        """Drop the cached funnel of a project (called by the admin API)."""
+        self._funnels.pop(project_id, None)
+
+    async def get(self, project_id: int) -> CompiledFunnel:
+        """Get the compiled funnel, reloading it if the version changed."""
+        funnel = self._funnels.get(project_id)
+        if funnel and time.monotonic() - funnel.checked_at < VERSION_CHECK_INTERVAL:
+            return funnel
+
+        version = await repository.get_funnel_version(project_id)
+        if funnel and funnel.version == version:
+            funnel.checked_at = time.monotonic()
+            return funnel
+
+        funnel = await self._load(project_id, version)
+        self._funnels[project_id] = funnel
+        return funnel
+
+    async def get_step(self, project_id: int, step_number: int) -> Optional[dict]:
+        """Get a compiled step by its number."""
+        return (await self.get(project_id)).get_step(step_number)
+
+    async def get_button(self, project_id: int, data: str) -> Optional[dict]:
+        """Resolve a button press without reading the step."""
+        return (await self.get(project_id)).get_button(data)
+
+    async def _load(self, project_id: int, version: int) -> CompiledFunnel:
+        """Load and compile all steps of a project with two queries."""
+        step_rows = await repository.get_funnel_steps(project_id)
+
+        # One dict per media file, shared by every step that uses it, so a
+        # telegram_file_id learned on send is visible everywhere
+        media_by_id = {}
+        step_media = {}
+        for row in await repository.get_funnel_media(project_id):
+            step_id = row.pop("funnel_step_id")
+            media = media_by_id.setdefault(row["id"], row)
+            step_media.setdefault(step_id, []).append(media)
+
+        steps = {}
+        for row in step_rows:
+            buttons = parse_buttons(row.pop("buttons"))
+            steps[row["step_number"]] = dict(
+                row,
+                buttons=buttons,
+                keyboard=build_keyboard(buttons, row["id"]) if buttons else None,
+                media_files=step_media.get(row["id"], [])
+            )
+
+        print(f"[CACHE] Loaded funnel for project {project_id}: {len(steps)} steps (v{version})")
+        return CompiledFunnel(project_id, version, steps)
+
+
+# Process-wide cache shared by all schedulers and handlers
+funnel_cache = FunnelCache()
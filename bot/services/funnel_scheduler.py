@@ -1,169 +1,549 @@
 """Funnel scheduler service."""
-import sqlite3
-import os
 import asyncio
-from datetime import datetime
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
+import heapq
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
 from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError,
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
 
+from backend.core.config import (
+    FUNNEL_HEAP_HORIZON,
+    FUNNEL_POLL_INTERVAL,
+    FUNNEL_CONCURRENCY,
+    FUNNEL_STEP_BATCH_SIZE,
+    FUNNEL_MAX_ATTEMPTS,
+    FUNNEL_RETRY_BACKOFF_BASE,
+    FUNNEL_RETRY_BACKOFF_MAX,
+    FUNNEL_CATCHUP_THRESHOLD,
+    FUNNEL_CATCHUP_WINDOW,
+    FUNNEL_CATCHUP_RATE,
+    FUNNEL_CATCHUP_JITTER,
+    FUNNEL_DAILY_CAP,
+    FUNNEL_LEASE_SECONDS,
+)
+from backend.db.funnel_queue import DUE_TIME_FORMAT
+from bot.services import repository
+from bot.services.broadcast_engine import SENT, BLOCKED, FAILED, error_code
 from bot.services.content_sender import ContentSender
+from bot.services.funnel_cache import funnel_cache
+from bot.services.media_warmup import warm_up_media
+from bot.services.rate_limiter import get_rate_limiter
+from bot.services.worker import worker_id
 
 
-# Get absolute path to database
-BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-DB_PATH = os.path.join(BASE_DIR, 'bot.db')
+# Max users sent per tick; the rest are picked up by the next tick
+DUE_BATCH_SIZE = 500
+
+# Send outcome that retrying will not fix (bad content) - dead-lettered at once
+DEAD = "dead"
+
+
+def due_timestamp(next_due_at) -> Optional[float]:
+    """Epoch seconds of a next_due_at value ('YYYY-MM-DD HH:MM:SS' or datetime)."""
+    if not next_due_at:
+        return None
+    if isinstance(next_due_at, str):
+        next_due_at = datetime.strptime(next_due_at[:19], DUE_TIME_FORMAT)
+    return next_due_at.timestamp()
 
 
 class FunnelScheduler:
-    """Scheduler for processing funnel steps."""
+    """Scheduler for processing funnel steps of all running project bots.
+    
+    A min-heap holds the next due time of every user due within
+    FUNNEL_HEAP_HORIZON seconds. It is loaded from the DB on start and
+    every half horizon, and fed on /start and after each send. Due times
+    written by other processes are picked up by a poll of the users due
+    in the next FUNNEL_POLL_INTERVAL seconds, so they are sent at most
+    that late (without the poll, up to half the horizon late). The loop
+    sleeps exactly until the earliest entry, then runs one due-users
+    query across the registered projects (the DB stays the source of
+    truth) and hands every user to the bot of their project.
+    
+    Up to FUNNEL_CONCURRENCY sends of a tick are in flight at once, each
+    under its bot's rate limiter. A user gets at most one step per tick
+    and the next tick starts after all sent steps are written, so the
+    steps of one user never overtake each other.
+    
+    A failed send is classified: a user who blocked the bot is marked
+    BLOCKED, a rejected step (400) is dead-lettered, anything else is
+    retried with exponential backoff and dead-lettered after
+    FUNNEL_MAX_ATTEMPTS. Dead-lettered users are listed by the admin API
+    (/api/users/dead-letter) and get the step again on retry or /start.
+    
+    When a bot starts after downtime, the steps it missed are spread over
+    FUNNEL_CATCHUP_WINDOW instead of going out on the first tick, and
+    FUNNEL_DAILY_CAP limits the steps a project sends per day. Both only
+    move next_due_at, so new subscribers (due now) are served first, and
+    keep the slot in funnel_hold_until, so a funnel edit does not release
+    the backlog at once. The cap is counted from the DB before each send,
+    so it holds for all sender processes together.
+    
+    Due users are claimed with a lease (repository.claim_due_users), so
+    several processes may run a scheduler for the same projects - e.g.
+    bot/funnel_worker.py next to run.py - without sending a step twice.
+    The leases are renewed while a tick runs (a flood-control pause can
+    outlast them) and before a failed write of sent steps is retried.
+    """
+    
+    def __init__(
+        self,
+        horizon: float = FUNNEL_HEAP_HORIZON,
+        poll_interval: float = FUNNEL_POLL_INTERVAL,
+        concurrency: int = FUNNEL_CONCURRENCY,
+        step_batch_size: int = FUNNEL_STEP_BATCH_SIZE,
+        max_attempts: int = FUNNEL_MAX_ATTEMPTS,
+        backoff_base: float = FUNNEL_RETRY_BACKOFF_BASE,
+        backoff_max: float = FUNNEL_RETRY_BACKOFF_MAX,
+        catchup_threshold: float = FUNNEL_CATCHUP_THRESHOLD,
+        catchup_window: float = FUNNEL_CATCHUP_WINDOW,
+        catchup_rate: float = FUNNEL_CATCHUP_RATE,
+        catchup_jitter: int = FUNNEL_CATCHUP_JITTER,
+        daily_cap: int = FUNNEL_DAILY_CAP,
+        lease_seconds: float = FUNNEL_LEASE_SECONDS,
+    ):
+        self.bots: Dict[int, Bot] = {}
+        self.senders: Dict[int, ContentSender] = {}
+        # Per project: seconds the oldest due user waited at the last tick
+        self.lag: Dict[int, float] = {}
+        self.last_tick_at = None
+        self.tick_duration = 0.0
+        self.last_tick_sent = 0
+        self.last_tick_failed = 0
+        # Users still due after the last tick
+        self.backlog = 0
+        self.horizon = horizon
+        self.poll_interval = poll_interval
+        self.concurrency = max(1, concurrency)
+        self.step_batch_size = max(1, step_batch_size)
+        self.max_attempts = max(1, max_attempts)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.catchup_threshold = catchup_threshold
+        self.catchup_window = catchup_window
+        self.catchup_rate = catchup_rate
+        self.catchup_jitter = catchup_jitter
+        self.daily_cap = daily_cap
+        self.lease_seconds = lease_seconds
+        # Projects whose bot just started - missed steps are spread on the next refill
+        self._catchup: Set[int] = set()
+        # Sent steps waiting to be written
+        self._sent: List[dict] = []
+        self._flush_failed = False
+        # Users claimed by the running tick whose outcome is not written yet,
+        # and those whose lease another process took over meanwhile
+        self._claimed: Set[int] = set()
+        self._lost: Set[int] = set()
+        # (due timestamp, user_id); entries no longer in _scheduled are stale
+        self._heap: List[Tuple[float, int]] = []
+        self._scheduled: Dict[int, float] = {}
+        self._wakeup = asyncio.Event()
+        self._refill_at = 0.0
+        self._poll_at = 0.0
+        self._task: Optional[asyncio.Task] = None
     
-    def __init__(self, bot: Bot, project_id: int):
-        self.bot = bot
-        self.project_id = project_id
-        self.content_sender = ContentSender(bot)
-        self.scheduler = AsyncIOScheduler()
+    def register(self, project_id: int, bot: Bot):
+        """Send funnel steps of a project through this bot."""
+        self.bots[project_id] = bot
+        self.senders[project_id] = ContentSender(bot)
+        self.lag[project_id] = 0.0
+        # Level the steps missed while the bot was down, then load its due times
+        self._catchup.add(project_id)
+        self.refill_soon()
+    
+    def unregister(self, project_id: int):
+        self.bots.pop(project_id, None)
+        self.senders.pop(project_id, None)
+        self.lag.pop(project_id, None)
+        self._catchup.discard(project_id)
     
     def start(self):
-        """Start the scheduler."""
-        self.scheduler.add_job(
-            self.process_funnel,
-            'interval',
-            seconds=5,  # Check every 5 seconds for fast response
-            id='funnel_processor',
-            replace_existing=True
-        )
-        self.scheduler.start()
-        print("[OK] Funnel scheduler started (checking every 5 seconds)")
+        """Start the scheduler loop."""
+        if self._task and not self._task.done():
+            return
+        self._task = asyncio.create_task(self.run())
+        print(f"[OK] Funnel scheduler started (timer heap, {self.horizon:.0f}s horizon)")
     
     def stop(self):
         """Stop the scheduler."""
-        try:
-            self.scheduler.shutdown(wait=False)
-        except:
-            pass
-    
-    def get_active_users(self) -> list:
-        """Get all active users for the project."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, telegram_id, funnel_step, funnel_step_sent_at, created_at
-            FROM users
-            WHERE project_id = ? AND status = 'ACTIVE'
-        """, (self.project_id,))
-        users = cursor.fetchall()
-        conn.close()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+    
+    def schedule(self, user_id: int, next_due_at):
+        """Remember when a user's next step is due (after /start or a send)."""
+        due = due_timestamp(next_due_at)
+        if due is None:
+            self._scheduled.pop(user_id, None)
+            return
+        if due > time.time() + self.horizon or self._scheduled.get(user_id) == due:
+            return  # loaded by a later refill
+        self._scheduled[user_id] = due
+        heapq.heappush(self._heap, (due, user_id))
+        if self._heap[0][1] == user_id:
+            self._wakeup.set()  # earlier than what the loop sleeps for
+    
+    def schedule_many(self, due_times: Dict[int, Optional[str]]):
+        """schedule() for a batch of users (e.g. flushed registrations)."""
+        for user_id, next_due_at in due_times.items():
+            self.schedule(user_id, next_due_at)
+    
+    def refill_soon(self):
+        """Reload due times from the DB on the next loop pass (e.g. the funnel changed)."""
+        self._refill_at = 0.0
+        self._wakeup.set()
+    
+    async def refill(self):
+        """Load due times up to the horizon for all registered projects."""
+        self._refill_at = time.monotonic() + self.horizon / 2
+        while self._catchup:
+            project_id = self._catchup.pop()
+            if project_id in self.bots:
+                await self.catch_up(project_id)
+        if not self.bots:
+            return
+        until = (datetime.now() + timedelta(seconds=self.horizon)).strftime(DUE_TIME_FORMAT)
+        for row in await repository.get_scheduled_users(list(self.bots), until):
+            self.schedule(row["id"], row["next_due_at"])
+    
+    async def poll(self):
+        """Schedule unclaimed users due before the next poll (e.g. written by another process)."""
+        self._poll_at = time.monotonic() + self.poll_interval
+        if not self.bots:
+            return
+        now = datetime.now()
+        until = (now + timedelta(seconds=self.poll_interval)).strftime(DUE_TIME_FORMAT)
+        for row in await repository.get_unclaimed_due_users(list(self.bots), now.strftime(DUE_TIME_FORMAT), until):
+            self.schedule(row["id"], row["next_due_at"])
+    
+    async def catch_up(self, project_id: int):
+        """Spread the steps a project missed while its bot was down."""
+        if self.catchup_window <= 0:
+            return
         
-        return [
-            {
-                "id": u[0],
-                "telegram_id": u[1],
-                "funnel_step": u[2],
-                "funnel_step_sent_at": u[3],
-                "created_at": u[4]
-            }
-            for u in users
-        ]
-    
-    def get_next_step(self, current_step: int) -> dict | None:
+        now = datetime.now()
+        overdue_before = (now - timedelta(seconds=self.catchup_threshold)).strftime(DUE_TIME_FORMAT)
+        count = await repository.spread_due_users(
+            project_id, overdue_before, now.strftime(DUE_TIME_FORMAT),
+            self.catchup_window, self.catchup_rate, self.catchup_jitter
+        )
+        if count:
+            span = max(self.catchup_window, count / max(self.catchup_rate, 0.001))
+            print(f"[FUNNEL] Project {project_id}: {count} missed steps spread over {span / 60:.0f} min")
+    
+    async def remaining_today(self, project_id: int) -> Optional[int]:
+        """Steps a project may still send today (None - no daily cap).
+        
+        Counted from the DB on every check: steps sent today by any
+        process (funnel_daily_sends), plus due users other processes have
+        claimed.
+        """
+        if not self.daily_cap:
+            return None
+        now = datetime.now()
+        used = await repository.count_daily_cap_usage(
+            project_id, now.date().isoformat(), now.strftime(DUE_TIME_FORMAT), worker_id()
+        )
+        return max(0, self.daily_cap - used)
+    
+    async def defer_to_tomorrow(self, project_id: int):
+        """Move the due steps of a project that reached its daily cap to the next day."""
+        now = datetime.now()
+        tomorrow = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+        count = await repository.spread_due_users(
+            project_id, now.strftime(DUE_TIME_FORMAT), tomorrow.strftime(DUE_TIME_FORMAT),
+            self.catchup_window, self.catchup_rate, self.catchup_jitter
+        )
+        if count:
+            print(f"[FUNNEL] Project {project_id} reached its daily cap of {self.daily_cap}, "
+                  f"{count} steps moved to tomorrow")
+    
+    def _pop_due(self) -> bool:
+        """Drop entries that are due now; True if any of them was current."""
+        now = time.time()
+        due = False
+        while self._heap and self._heap[0][0] <= now:
+            timestamp, user_id = heapq.heappop(self._heap)
+            if self._scheduled.get(user_id) == timestamp:
+                del self._scheduled[user_id]
+                due = True
+        return due
+    
+    async def run(self):
+        """Sleep until the earliest due entry (or a wake-up), then send."""
+        while True:
+            try:
+                if time.monotonic() >= self._refill_at:
+                    await self.refill()
+                elif self.poll_interval > 0 and time.monotonic() >= self._poll_at:
+                    await self.poll()
+                if self._pop_due():
+                    # Batch limit reached - more users are due right now
+                    while await self.process_funnel() >= DUE_BATCH_SIZE:
+                        pass
+                
+                timeout = self._refill_at - time.monotonic()
+                if self.poll_interval > 0:
+                    timeout = min(timeout, self._poll_at - time.monotonic())
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - time.time())
+                self._wakeup.clear()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[X] Funnel scheduler error: {e}")
+                await asyncio.sleep(1)
+    
+    def stats(self) -> dict:
+        """Lag per project, backlog and duration of the last tick."""
+        return {
+            "last_tick_at": self.last_tick_at,
+            "tick_duration": round(self.tick_duration, 3),
+            "sent": self.last_tick_sent,
+            "failed": self.last_tick_failed,
+            "backlog": self.backlog,
+            "lag": {project_id: round(lag, 1) for project_id, lag in self.lag.items()}
+        }
+    
+    async def get_due_users(self) -> list:
+        """Claim active users of all registered projects whose next funnel step is due.
+        
+        Uses the (status, next_due_at) index, so the cost depends on the
+        number of due users only. Users claimed by another process are
+        skipped until their lease expires.
+        """
+        now = datetime.now()
+        lease_until = now + timedelta(seconds=self.lease_seconds)
+        return await repository.claim_due_users(
+            list(self.bots), now.strftime(DUE_TIME_FORMAT), DUE_BATCH_SIZE,
+            worker_id(), lease_until.strftime(DUE_TIME_FORMAT)
+        )
+    
+    async def get_next_step(self, project_id: int, current_step: int) -> dict | None:
         """Get the next funnel step for the user.
         For step 0 (new user), look for step 1.
         For other steps, look for current + 1.
-        """
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
         
-        # For new users (step 0), look for step 1
-        # For others, look for next step
+        Served from the compiled funnel cache - no DB read per user.
+        """
         next_step_number = 1 if current_step == 0 else current_step + 1
-        
-        cursor.execute("""
-            SELECT id, project_id, step_number, delay_seconds, content_type, content_text
-            FROM funnel_steps
-            WHERE project_id = ? AND step_number = ?
-        """, (self.project_id, next_step_number))
-        step = cursor.fetchone()
-        conn.close()
-        
-        if step:
-            return {
-                "id": step[0],
-                "project_id": step[1],
-                "step_number": step[2],
-                "delay_seconds": step[3],
-                "content_type": step[4],
-                "content_text": step[5]
-            }
-        return None
+        return await funnel_cache.get_step(project_id, next_step_number)
     
-    def update_user_step(self, user_id: int, new_step: int):
-        """Update user's funnel step."""
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        cursor.execute("""
-            UPDATE users
-            SET funnel_step = ?, funnel_step_sent_at = ?, updated_at = ?
-            WHERE id = ?
-        """, (new_step, now, now, user_id))
-        conn.commit()
-        conn.close()
-    
-    def calculate_delay(self, user: dict, step: dict) -> bool:
-        """Check if enough time has passed for the next step."""
-        delay_seconds = step["delay_seconds"]
-        
-        # Determine reference time
-        if user["funnel_step"] == 0:
-            # First step - use created_at
-            reference_time = user["created_at"]
-        else:
-            # Subsequent steps - use funnel_step_sent_at
-            reference_time = user["funnel_step_sent_at"]
-        
-        if not reference_time:
-            reference_time = user["created_at"]
-        
-        # Parse the reference time
+    async def update_user_step(self, user_id: int, new_step: int):
+        """Remember a sent step; written with the next batch."""
+        now = datetime.now().strftime(DUE_TIME_FORMAT)
+        self._sent.append({"user_id": user_id, "step": new_step, "now": now})
+        self.last_tick_sent += 1
+        if len(self._sent) >= self.step_batch_size:
+            await self.flush_steps()
+    
+    async def flush_steps(self):
+        """Write the buffered steps and schedule the following ones."""
+        if not self._sent:
+            return
+        rows, self._sent = self._sent, []
         try:
-            if isinstance(reference_time, str):
-                ref_dt = datetime.strptime(reference_time, '%Y-%m-%d %H:%M:%S')
-            else:
-                ref_dt = reference_time
-        except:
-            ref_dt = datetime.now()
-        
-        # Calculate elapsed time
-        elapsed = (datetime.now() - ref_dt).total_seconds()
-        
-        return elapsed >= delay_seconds
+            if self._flush_failed:
+                # Keep other senders off these users until the write goes through
+                await self.renew_leases([row["user_id"] for row in rows])
+            scheduled = await repository.update_user_steps(rows)
+        except Exception:
+            # Keep them for the next flush, or these users get the step again
+            self._sent = rows + self._sent
+            self._flush_failed = True
+            raise
+        self._flush_failed = False
+        for user_id, next_due_at in scheduled.items():
+            self.schedule(user_id, next_due_at)
+    
+    async def renew_leases(self, user_ids: List[int]):
+        """Extend this process's claims; users another process took over go to _lost."""
+        if not user_ids:
+            return
+        lease_until = (datetime.now() + timedelta(seconds=self.lease_seconds)).strftime(DUE_TIME_FORMAT)
+        held = await repository.renew_user_leases(user_ids, worker_id(), lease_until)
+        self._lost.update(set(user_ids) - set(held))
+    
+    async def keep_leases(self):
+        """Renew the leases of the running tick's users until it ends."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.renew_leases(list(self._claimed | {row["user_id"] for row in self._sent}))
+            except Exception as e:
+                print(f"[X] Renewing funnel leases failed: {e}")
     
-    async def process_funnel(self):
-        """Process funnel for all active users."""
+    async def refresh_user_due(self, user_id: int):
+        """Recompute next_due_at for a user (e.g. the next step was deleted)."""
+        self.schedule(user_id, await repository.refresh_user_due(user_id))
+    
+    async def process_funnel(self) -> int:
+        """Process funnel for users whose next step is due; returns how many were due."""
+        started = time.monotonic()
+        self.last_tick_sent = 0
+        self.last_tick_failed = 0
         try:
-            users = self.get_active_users()
+            now = datetime.now()
+            self.last_tick_at = now.strftime(DUE_TIME_FORMAT)
+            for project_id in self.lag:
+                self.lag[project_id] = 0.0
+            
+            if not self.bots:
+                return 0
+            # Steps a failed tick could not write yet
+            await self.flush_steps()
+            users = await self.get_due_users()
+            if not users:
+                self.backlog = 0
+                return 0
             
+            # Users come ordered by next_due_at - the first one of a project is its oldest
+            by_project = {}
             for user in users:
-                next_step = self.get_next_step(user["funnel_step"])
-                
-                if not next_step:
-                    # No more steps in funnel
-                    continue
-                
-                # Check if delay has passed
-                if self.calculate_delay(user, next_step):
-                    # Send the step
-                    success = await self.content_sender.send_funnel_step(
-                        user["telegram_id"],
-                        next_step
-                    )
-                    
-                    if success:
-                        # Update user's step
-                        self.update_user_step(user["id"], next_step["step_number"])
-                        print(f"[OK] Sent step {next_step['step_number']} to user {user['telegram_id']}")
+                if user["project_id"] not in by_project:
+                    due_at = datetime.strptime(user["next_due_at"], DUE_TIME_FORMAT)
+                    self.lag[user["project_id"]] = max(0.0, (now - due_at).total_seconds())
+                by_project.setdefault(user["project_id"], []).append(user)
+            
+            capped = []
+            for project_id, project_users in by_project.items():
+                remaining = await self.remaining_today(project_id)
+                if remaining is not None and len(project_users) > remaining:
+                    by_project[project_id] = project_users[:remaining]
+                    await repository.release_users([user["id"] for user in project_users[remaining:]], worker_id())
+                    capped.append(project_id)
+            
+            self._claimed = {user["id"] for project_users in by_project.values() for user in project_users}
+            self._lost = set()
+            heartbeat = asyncio.create_task(self.keep_leases())
+            try:
+                semaphore = asyncio.Semaphore(self.concurrency)
+                await asyncio.gather(*(
+                    self.process_project(project_id, project_users, semaphore)
+                    for project_id, project_users in by_project.items()
+                ))
+                await self.flush_steps()
+            finally:
+                heartbeat.cancel()
+                self._claimed = set()
+            for project_id in capped:
+                await self.defer_to_tomorrow(project_id)
+            
+            self.backlog = await repository.count_due_users(list(self.bots), datetime.now().strftime(DUE_TIME_FORMAT))
+            return len(users)
         
         except Exception as e:
             print(f"[X] Error processing funnel: {e}")
             import traceback
             traceback.print_exc()
+            return 0
+        finally:
+            self.tick_duration = time.monotonic() - started
+            if self.tick_duration > 1:
+                print(f"[FUNNEL] Tick sent {self.last_tick_sent} steps in {self.tick_duration:.1f}s, "
+                      f"backlog {self.backlog}")
+    
+    async def send_step(self, sender: ContentSender, limiter, chat_id: int, step: dict) -> Tuple[str, Optional[str]]:
+        """Send one step to a chat; returns (outcome, error_code)."""
+        while True:
+            await limiter.acquire(chat_id)
+            try:
+                if await sender.send_funnel_step(chat_id, step):
+                    return SENT, None
+                return FAILED, "Nothing was sent"
+            except TelegramRetryAfter as e:
+                # Flood control applies to the whole bot - wait and send again
+                print(f"[FUNNEL] Flood control, pausing for {e.retry_after}s")
+                limiter.pause(e.retry_after)
+            except TelegramForbiddenError as e:
+                return BLOCKED, error_code(e)
+            except TelegramBadRequest as e:
+                if "chat not found" in e.message.lower():
+                    return BLOCKED, error_code(e)
+                return DEAD, error_code(e)
+            except TelegramAPIError as e:
+                # Network errors, 5xx and the like
+                return FAILED, error_code(e)
+    
+    async def step_failed(self, user: dict, step: dict, outcome: str, error: str):
+        """Block, dead-letter or schedule a retry for a user whose send failed."""
+        self.last_tick_failed += 1
+        now = datetime.now()
+        attempts = user["funnel_attempts"] + 1
+        
+        if outcome == BLOCKED:
+            await repository.mark_user_blocked(user["id"], error, now.strftime(DUE_TIME_FORMAT))
+            self.schedule(user["id"], None)
+            print(f"[FUNNEL] User {user['telegram_id']} is unreachable, marked BLOCKED ({error})")
+        elif outcome == DEAD or attempts >= self.max_attempts:
+            await repository.dead_letter_user(user["id"], attempts, error, now.strftime(DUE_TIME_FORMAT))
+            self.schedule(user["id"], None)
+            print(f"[X] Step {step['step_number']} to user {user['telegram_id']} dead-lettered "
+                  f"after {attempts} attempt(s): {error}")
+        else:
+            delay = min(self.backoff_base * 2 ** (attempts - 1), self.backoff_max)
+            retry_at = (now + timedelta(seconds=delay)).strftime(DUE_TIME_FORMAT)
+            await repository.retry_funnel_step_later(user["id"], attempts, error, retry_at)
+            self.schedule(user["id"], retry_at)
+            print(f"[!] Step {step['step_number']} to user {user['telegram_id']} failed ({error}), "
+                  f"retry {attempts}/{self.max_attempts} in {delay:.0f}s")
+    
+    async def process_project(self, project_id: int, users: list, semaphore: asyncio.Semaphore):
+        """Send the due steps of one project's users, several at a time."""
+        bot = self.bots.get(project_id)
+        sender = self.senders.get(project_id)
+        if not bot or not sender:
+            return  # bot stopped meanwhile
+        limiter = get_rate_limiter(bot)
+        
+        # Upload uncached media of the due steps once, before sending
+        due_steps = {}
+        for user in users:
+            step = await self.get_next_step(project_id, user["funnel_step"])
+            if step:
+                due_steps[step["id"]] = step
+        for step in due_steps.values():
+            await warm_up_media(bot, project_id, step["media_files"])
+        
+        async def send(user: dict):
+            async with semaphore:
+                if user["id"] in self._lost:
+                    # Our lease expired and another sender claimed the user
+                    self._claimed.discard(user["id"])
+                    return
+                
+                next_step = await self.get_next_step(project_id, user["funnel_step"])
+                
+                if not next_step:
+                    # Funnel changed since next_due_at was computed
+                    await self.refresh_user_due(user["id"])
+                    self._claimed.discard(user["id"])
+                    return
+                
+                # Send the step
+                outcome, error = await self.send_step(sender, limiter, user["telegram_id"], next_step)
+            
+            if outcome == SENT:
+                # Update user's step
+                await self.update_user_step(user["id"], next_step["step_number"])
+                print(f"[OK] Sent step {next_step['step_number']} to user {user['telegram_id']}")
+            else:
+                await self.step_failed(user, next_step, outcome, error)
+            self._claimed.discard(user["id"])
+        
+        await asyncio.gather(*(send(user) for user in users))
+
+
+# Global instance shared by all project bots
+funnel_scheduler = FunnelScheduler()
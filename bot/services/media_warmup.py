@@ -0,0 +1,134 @@
+"""Warm-up upload of media files before fan-out.
+
+A file without telegram_file_id is uploaded once to a storage chat
+(MEDIA_STORAGE_CHAT_ID or the project's admin) and the returned file id is
+cached, so the actual sends to users only reference it. Without this the
+first recipients of a step or broadcast would all upload the same file.
+
+A failed upload is remembered per (project, media) with a backoff, so a
+storage chat that rejects the bot or a missing file does not cost an
+upload attempt on every scheduler tick.
+"""
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from aiogram import Bot
+from aiogram.types import FSInputFile
+
+from backend.core.config import MEDIA_STORAGE_CHAT_ID, MEDIA_WARMUP_RETRY_BASE, MEDIA_WARMUP_RETRY_MAX
+from bot.services import repository
+from bot.services.content_sender import ContentSender
+from bot.services.funnel_cache import funnel_cache
+
+# media_id -> running upload, so concurrent callers share one upload
+_uploads: Dict[int, asyncio.Task] = {}
+
+# (project_id, media_id) -> (failed uploads in a row, monotonic time of the next try)
+_failures: Dict[Tuple[int, int], Tuple[int, float]] = {}
+
+
+def _backing_off(media: dict) -> bool:
+    failure = _failures.get((media["project_id"], media["id"]))
+    return failure is not None and time.monotonic() < failure[1]
+
+
+def _upload_failed(media: dict) -> float:
+    """Remember a failed upload; returns the seconds until the next try."""
+    key = (media["project_id"], media["id"])
+    failures = _failures.get(key, (0, 0.0))[0] + 1
+    delay = min(MEDIA_WARMUP_RETRY_BASE * 2 ** (failures - 1), MEDIA_WARMUP_RETRY_MAX)
+    _failures[key] = (failures, time.monotonic() + delay)
+    return delay
+
+
+async def get_storage_chat(project_id: int) -> Optional[int]:
+    """Chat used for warm-up uploads of a project."""
+    if MEDIA_STORAGE_CHAT_ID:
+        return MEDIA_STORAGE_CHAT_ID
+    return await repository.get_project_admin(project_id) or None
+
+
+async def _upload(sender: ContentSender, media: dict, chat_id: int) -> Optional[str]:
+    """Upload one file to chat_id and cache its telegram_file_id."""
+    file_path = sender.get_file_path(media["project_id"], media["filename"])
+    if not os.path.exists(file_path):
+        delay = _upload_failed(media)
+        print(f"[X] Warm-up: file not found: {file_path}, next try in {delay:.0f}s")
+        return None
+
+    try:
+        if media["file_type"] == "photo":
+            msg = await sender.bot.send_photo(chat_id, FSInputFile(file_path), disable_notification=True)
+            file_id = msg.photo[-1].file_id
+        else:
+            msg = await sender.bot.send_video(chat_id, FSInputFile(file_path), disable_notification=True)
+            file_id = msg.video.file_id
+    except Exception as e:
+        delay = _upload_failed(media)
+        print(f"[X] Warm-up upload of media {media['id']} to {chat_id} failed: {e}, next try in {delay:.0f}s")
+        return None
+
+    _failures.pop((media["project_id"], media["id"]), None)
+    await sender.cache_file_id(media, file_id)
+    print(f"[MEDIA] Warmed up media {media['id']} ({media['file_type']})")
+
+    # The file id stays valid - keep the admin's chat clean
+    if chat_id != MEDIA_STORAGE_CHAT_ID:
+        try:
+            await sender.bot.delete_message(chat_id, msg.message_id)
+        except Exception:
+            pass
+    return file_id
+
+
+async def warm_up_media(bot: Bot, project_id: int, media_files: List[dict]) -> int:
+    """Make sure every media row has a telegram_file_id.
+
+    Rows are updated in place (they may be shared with the funnel cache or
+    a broadcast payload). Files whose last upload failed are skipped until
+    their backoff ends. Returns the number of files uploaded.
+    """
+    missing = [
+        media for media in media_files
+        if not media.get("telegram_file_id") and not _backing_off(media)
+    ]
+    if not missing:
+        return 0
+
+    chat_id = await get_storage_chat(project_id)
+    if not chat_id:
+        # No storage chat configured - the first send will upload instead
+        return 0
+
+    sender = ContentSender(bot)
+    uploaded = 0
+    for media in missing:
+        task = _uploads.get(media["id"])
+        if task is None:
+            task = asyncio.create_task(_upload(sender, media, chat_id))
+            _uploads[media["id"]] = task
+            task.add_done_callback(lambda _, media_id=media["id"]: _uploads.pop(media_id, None))
+        file_id = await task
+        if file_id:
+            media["telegram_file_id"] = file_id
+            uploaded += 1
+    return uploaded
+
+
+async def warm_up_funnel(bot: Bot, project_id: int) -> int:
+    """Upload the funnel media of a project that has no telegram_file_id.
+
+    Called when a bot starts: file ids are per bot, so after a token
+    change they are cleared and the new bot uploads them again here
+    instead of on its first sends. The cached rows are updated in place.
+    """
+    funnel = await funnel_cache.get(project_id)
+    media_files = {}
+    for step in funnel.steps.values():
+        for media in step["media_files"]:
+            media_files.setdefault(media["id"], media)
+    uploaded = await warm_up_media(bot, project_id, list(media_files.values()))
+    if uploaded:
+        print(f"[MEDIA] Warmed up {uploaded} funnel file(s) of project {project_id}")
+    return uploaded
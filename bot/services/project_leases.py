@@ -0,0 +1,86 @@
+"""Per-project leases: which process runs which project's bot.
+
+Several processes may share bot.db (gunicorn workers, or run.py restarted
+next to an old copy). Two of them polling one token make Telegram answer
+"terminated by other getUpdates request", and two funnel schedulers and
+broadcast runners for one project compete with each other. Each process
+heartbeats into bot_workers and holds leases in bot_leases; the bot
+supervisor only runs the bots of the projects leased to this process.
+
+- a lease lasts BOT_LEASE_TTL seconds and is renewed on every heartbeat;
+- the bots of a dead process move to the others once its leases expire;
+- every live worker takes at most its fair share (projects / workers),
+  so bots spread over the workers and a new worker gets some too.
+"""
+import math
+from datetime import datetime, timedelta
+from typing import List, Set
+
+from backend.core.config import BOT_LEASE_TTL, BOT_LEASE_HEARTBEAT
+from backend.db.funnel_queue import DUE_TIME_FORMAT
+from bot.services import repository
+from bot.services.worker import worker_id
+
+
+class ProjectLeases:
+    """Leases of this process, refreshed by sync() every heartbeat_interval."""
+
+    def __init__(self, ttl: float = BOT_LEASE_TTL, heartbeat_interval: float = BOT_LEASE_HEARTBEAT):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.owned: Set[int] = set()
+
+    def owns(self, project_id: int) -> bool:
+        return project_id in self.owned
+
+    async def sync(self, project_ids: List[int]) -> Set[int]:
+        """Heartbeat, renew our leases and take free ones up to our share."""
+        now = datetime.now()
+        now_str = now.strftime(DUE_TIME_FORMAT)
+        expires_at = (now + timedelta(seconds=self.ttl)).strftime(DUE_TIME_FORMAT)
+        owner = worker_id()
+
+        await repository.heartbeat_worker(owner, now_str)
+        workers = max(1, await repository.count_live_workers(
+            (now - timedelta(seconds=self.ttl)).strftime(DUE_TIME_FORMAT)
+        ))
+        owned = set(await repository.renew_leases(owner, now_str, expires_at))
+
+        # Leases of deleted projects, and the surplus over our share, so
+        # that a worker that just started gets its part
+        share = math.ceil(len(project_ids) / workers)
+        stale = owned - set(project_ids)
+        surplus = sorted(owned - stale)[share:]
+        if stale or surplus:
+            await repository.release_leases(owner, list(stale | set(surplus)))
+            owned -= stale | set(surplus)
+
+        for project_id in sorted(project_ids):
+            if len(owned) >= share:
+                break
+            if project_id not in owned and await repository.acquire_lease(project_id, owner, now_str, expires_at):
+                owned.add(project_id)
+
+        gained, lost = owned - self.owned, self.owned - owned
+        if gained or lost:
+            print(f"[BOT] Worker {owner} runs projects {sorted(owned)} "
+                  f"({workers} worker(s), +{len(gained)} -{len(lost)})")
+        self.owned = owned
+        return owned
+
+    async def acquire(self, project_id: int) -> bool:
+        """Own the project if we do or its lease is free (e.g. it was just created)."""
+        if project_id in self.owned:
+            return True
+        now = datetime.now()
+        expires_at = (now + timedelta(seconds=self.ttl)).strftime(DUE_TIME_FORMAT)
+        if await repository.acquire_lease(project_id, worker_id(), now.strftime(DUE_TIME_FORMAT), expires_at):
+            self.owned.add(project_id)
+            return True
+        return False
+
+    async def release_all(self):
+        """Hand all bots over to the other workers (on shutdown)."""
+        self.owned = set()
+        await repository.release_leases(worker_id())
+        await repository.delete_worker(worker_id())
@@ -0,0 +1,79 @@
+"""Rate limiting for outgoing Bot API calls.
+
+Telegram allows roughly 30 messages per second per bot overall and about
+one message per second to the same chat. Every sender that talks to a bot
+(broadcasts, funnel fan-out) goes through the bot's shared limiter.
+"""
+import asyncio
+import time
+from typing import Dict
+from aiogram import Bot
+
+from backend.core.config import BOT_RATE_LIMIT, BOT_PER_CHAT_INTERVAL
+
+
+class RateLimiter:
+    """Token bucket for one bot plus per-chat spacing and flood-wait pauses."""
+
+    def __init__(self, rate: float = BOT_RATE_LIMIT, per_chat_interval: float = BOT_PER_CHAT_INTERVAL):
+        self.rate = rate
+        self.capacity = max(1.0, rate)
+        self.per_chat_interval = per_chat_interval
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._chat_last_send: Dict[int, float] = {}
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Stop all sends for a while (Telegram answered with retry_after)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int = None):
+        """Wait until a message to chat_id may be sent."""
+        if chat_id is not None:
+            # Reserve the chat's next slot first, so one busy chat does not
+            # hold up sends to everybody else
+            now = time.monotonic()
+            last = self._chat_last_send.get(chat_id)
+            slot = now if last is None else max(now, last + self.per_chat_interval)
+            self._chat_last_send[chat_id] = slot
+            self._prune(now)
+            if slot > now:
+                await asyncio.sleep(slot - now)
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                wait = self._paused_until - now
+                if self._tokens < 1:
+                    wait = max(wait, (1 - self._tokens) / self.rate)
+
+                if wait <= 0:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep(wait)
+
+    def _prune(self, now: float):
+        """Forget chats whose spacing window has passed."""
+        if len(self._chat_last_send) < 10000:
+            return
+        cutoff = now - self.per_chat_interval
+        self._chat_last_send = {
+            chat: ts for chat, ts in self._chat_last_send.items() if ts > cutoff
+        }
+
+
+# One limiter per bot (Telegram limits are per bot token)
+_limiters: Dict[int, RateLimiter] = {}
+
+
+def get_rate_limiter(bot: Bot) -> RateLimiter:
+    """Get the shared limiter of a bot."""
+    limiter = _limiters.get(bot.id)
+    if limiter is None:
+        limiter = _limiters[bot.id] = RateLimiter()
+    return limiter
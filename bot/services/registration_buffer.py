@@ -0,0 +1,86 @@
+"""Write-behind buffer for /start registrations.
+
+During a /start spike (a channel post driving thousands of joins a minute)
+writing every registration in its own transaction makes SQLite the
+bottleneck. The buffer collects registrations and upserts them in batches:
+when REGISTRATION_BATCH_SIZE are pending or REGISTRATION_FLUSH_INTERVAL
+seconds after the first one, whichever comes first.
+"""
+import asyncio
+from typing import Callable, Dict, Optional, Tuple
+
+from backend.core.config import REGISTRATION_BATCH_SIZE, REGISTRATION_FLUSH_INTERVAL
+from bot.services import repository
+
+
+class RegistrationBuffer:
+    """Batches user upserts; repeated /start of one user collapse into one row.
+
+    on_flush gets the written users' new next_due_at by user id.
+    """
+
+    def __init__(
+        self,
+        restart_funnel: bool = False,
+        batch_size: int = REGISTRATION_BATCH_SIZE,
+        flush_interval: float = REGISTRATION_FLUSH_INTERVAL,
+        on_flush: Optional[Callable[[Dict[int, Optional[str]]], None]] = None,
+    ):
+        self.restart_funnel = restart_funnel
+        self.on_flush = on_flush
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[int, int], dict] = {}
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    async def add(self, project_id: int, telegram_id: int, username, first_name, last_name, now: str):
+        """Queue a registration; flushes right away when the batch is full."""
+        self._pending[(project_id, telegram_id)] = {
+            "project_id": project_id,
+            "telegram_id": telegram_id,
+            "username": username,
+            "first_name": first_name,
+            "last_name": last_name,
+            "now": now,
+        }
+        if len(self._pending) >= self.batch_size:
+            await self.flush()
+        else:
+            self._schedule()
+
+    def _schedule(self):
+        if self._timer is None or self._timer.done():
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def flush(self):
+        """Write all pending registrations in one transaction."""
+        async with self._lock:
+            if not self._pending:
+                return
+            rows, self._pending = self._pending, {}
+            try:
+                due_times = await repository.upsert_users(list(rows.values()), self.restart_funnel)
+            except Exception as e:
+                print(f"[X] Failed to write {len(rows)} registrations, will retry: {e}")
+                # Keep newer registrations of the same users that arrived meanwhile
+                for key, row in rows.items():
+                    self._pending.setdefault(key, row)
+                self._schedule()
+                return
+        print(f"[DB] Registered {len(rows)} users (batched)")
+        if self.on_flush:
+            self.on_flush(due_times)
+
+    async def close(self):
+        """Stop the timer and write what is left."""
+        if self._timer and not self._timer.done():
+            self._timer.cancel()
+        await self.flush()
@@ -0,0 +1,633 @@
+"""Async data access for the bot runtime.
+
+Every bot-side query (scheduler, content sender, /start and button
+handlers, broadcasts, bot manager) goes through the shared SQLAlchemy
+async engine from backend.db.database: connections are reused from its
+pool and aiosqlite runs the queries off the event loop, so a slow write
+never stalls polling of the other bots in the process.
+"""
+import json
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from sqlalchemy import text
+
+from backend.core.config import BROADCAST_RECIPIENT_CHUNK_SIZE
+from backend.db.database import engine
+from backend.db.funnel_queue import REFRESH_USER_DUE_SQL, REFRESH_MEMBER_DUE_SQL
+from backend.db.segments import audience_where
+
+
+async def fetch_all(sql: str, params: Optional[dict] = None) -> List[dict]:
+    """Run a SELECT and return rows as dicts."""
+    async with engine.connect() as conn:
+        result = await conn.execute(text(sql), params or {})
+        return [dict(row) for row in result.mappings()]
+
+
+async def fetch_one(sql: str, params: Optional[dict] = None) -> Optional[dict]:
+    """Run a SELECT and return the first row as a dict (or None)."""
+    async with engine.connect() as conn:
+        result = await conn.execute(text(sql), params or {})
+        row = result.mappings().first()
+        return dict(row) if row else None
+
+
+async def execute(sql: str, params=None):
+    """Run a write statement in its own transaction.
+
+    ``params`` may be a list of dicts to execute the statement for each.
+    """
+    async with engine.begin() as conn:
+        return await conn.execute(text(sql), params or {})
+
+
+# ============== Projects ==============
+
+async def get_projects() -> List[dict]:
+    """All projects the bot manager should run."""
+    return await fetch_all("SELECT id, name, bot_token, admin_id FROM projects")
+
+
+async def get_project(project_id: int) -> Optional[dict]:
+    return await fetch_one(
+        "SELECT id, name, bot_token, admin_id FROM projects WHERE id = :project_id", {"project_id": project_id}
+    )
+
+
+async def get_project_admin(project_id: int) -> Optional[int]:
+    row = await fetch_one("SELECT admin_id FROM projects WHERE id = :project_id", {"project_id": project_id})
+    return row["admin_id"] if row else None
+
+
+async def get_funnel_version(project_id: int) -> int:
+    row = await fetch_one("SELECT funnel_version FROM projects WHERE id = :project_id", {"project_id": project_id})
+    return (row["funnel_version"] or 0) if row else 0
+
+
+# ============== Users ==============
+
+# New users start at funnel step 0; a known user only gets the profile
+# refreshed, or, with restart, is reactivated and the funnel starts over
+INSERT_USER_SQL = """
+    INSERT INTO users
+    (project_id, telegram_id, username, first_name, last_name, status, funnel_step, created_at, updated_at, last_activity_at)
+    VALUES (:project_id, :telegram_id, :username, :first_name, :last_name, 'ACTIVE', 0, :now, :now, :now)
+"""
+
+UPDATE_USER_SET = """
+        username = :username,
+        first_name = :first_name,
+        last_name = :last_name,
+        updated_at = :now,
+        last_activity_at = :now
+"""
+
+UPDATE_USER_RESTART_SET = UPDATE_USER_SET + """,
+        status = 'ACTIVE',
+        funnel_step = 0,
+        funnel_step_sent_at = NULL,
+        funnel_attempts = 0,
+        funnel_error = NULL,
+        funnel_dead_at = NULL,
+        funnel_hold_until = NULL
+"""
+
+
+def _update_set(restart_funnel: bool) -> str:
+    return UPDATE_USER_RESTART_SET if restart_funnel else UPDATE_USER_SET
+
+
+async def upsert_user(project_id: int, telegram_id: int, username, first_name, last_name, now: str,
+                      restart_funnel: bool = False) -> dict:
+    """Register a subscriber or refresh an existing one in one transaction.
+
+    Returns the row's id, status and next_due_at plus ``created`` - True
+    only if this call inserted the row (INSERT ... DO NOTHING RETURNING
+    gives a row only then), so a double-tapped /start is not a second
+    registration. Without restart_funnel the status is left untouched,
+    so it is the status the user had before.
+    """
+    params = {
+        "project_id": project_id, "telegram_id": telegram_id, "username": username,
+        "first_name": first_name, "last_name": last_name, "now": now
+    }
+    async with engine.begin() as conn:
+        result = await conn.execute(text(INSERT_USER_SQL + """
+            ON CONFLICT (project_id, telegram_id) DO NOTHING
+            RETURNING id, status
+        """), params)
+        inserted = result.mappings().first()
+        if inserted is not None:
+            row = dict(inserted)
+        else:
+            result = await conn.execute(text(f"""
+                UPDATE users SET {_update_set(restart_funnel)}
+                WHERE project_id = :project_id AND telegram_id = :telegram_id
+                RETURNING id, status
+            """), params)
+            row = dict(result.mappings().one())
+        result = await conn.execute(text(REFRESH_USER_DUE_SQL + " RETURNING next_due_at"), {"user_id": row["id"]})
+        row["next_due_at"] = result.scalar_one()
+    row["created"] = inserted is not None
+    return row
+
+
+async def upsert_users(rows: List[dict], restart_funnel: bool = False) -> Dict[int, Optional[str]]:
+    """Batched upsert_user for many registrations in one transaction.
+
+    Each row needs project_id, telegram_id, username, first_name,
+    last_name and now. Returns the new next_due_at per user id.
+    """
+    if not rows:
+        return {}
+    async with engine.begin() as conn:
+        await conn.execute(text(INSERT_USER_SQL + f"""
+            ON CONFLICT (project_id, telegram_id) DO UPDATE SET {_update_set(restart_funnel)}
+        """), rows)
+        await conn.execute(text(REFRESH_MEMBER_DUE_SQL), [
+            {"project_id": row["project_id"], "telegram_id": row["telegram_id"]} for row in rows
+        ])
+        members = ", ".join(f"(:project_{i}, :telegram_{i})" for i in range(len(rows)))
+        params = {}
+        for i, row in enumerate(rows):
+            params[f"project_{i}"] = row["project_id"]
+            params[f"telegram_{i}"] = row["telegram_id"]
+        result = await conn.execute(text(f"""
+            SELECT id, next_due_at FROM users
+            WHERE (project_id, telegram_id) IN (VALUES {members})
+        """), params)
+        return {row.id: row.next_due_at for row in result}
+
+
+def in_params(name: str, values) -> tuple:
+    """Placeholders and params for an ``IN (...)`` list."""
+    params = {f"{name}_{i}": value for i, value in enumerate(values)}
+    return ", ".join(f":{key}" for key in params), params
+
+
+# Clears the claim of a funnel sender (see claim_due_users)
+RELEASE_LEASE = "lease_owner = NULL, lease_expires_at = NULL"
+
+
+async def claim_due_users(project_ids: List[int], now: str, limit: int, owner: str, lease_until: str) -> List[dict]:
+    """Claim active users of the given projects whose next funnel step is due, oldest first.
+
+    The claim is one UPDATE ... RETURNING: a user is taken only when no
+    other sender holds an unexpired lease on it, so any number of
+    processes can pull disjoint batches. The lease is cleared when the
+    outcome of the send is written, or expires at lease_until if the
+    owner dies.
+    """
+    if not project_ids:
+        return []
+    placeholders, params = in_params("project", project_ids)
+    async with engine.begin() as conn:
+        result = await conn.execute(text(f"""
+            UPDATE users SET lease_owner = :owner, lease_expires_at = :lease_until
+            WHERE id IN (
+                SELECT id FROM users
+                WHERE status = 'ACTIVE'
+                  AND next_due_at IS NOT NULL AND next_due_at <= :now
+                  AND project_id IN ({placeholders})
+                  AND (lease_expires_at IS NULL OR lease_expires_at <= :now)
+                ORDER BY next_due_at
+                LIMIT :limit
+            )
+            RETURNING id, project_id, telegram_id, COALESCE(funnel_step, 0) AS funnel_step, next_due_at,
+                      COALESCE(funnel_attempts, 0) AS funnel_attempts
+        """), {"now": now, "limit": limit, "owner": owner, "lease_until": lease_until, **params})
+        rows = [dict(row) for row in result.mappings()]
+    # RETURNING does not keep the subquery's order
+    return sorted(rows, key=lambda row: (row["next_due_at"], row["id"]))
+
+
+async def release_users(user_ids: List[int], owner: str):
+    """Give up claims that were not sent (e.g. over the daily cap)."""
+    if not user_ids:
+        return
+    placeholders, params = in_params("user", user_ids)
+    await execute(f"""
+        UPDATE users SET {RELEASE_LEASE}
+        WHERE id IN ({placeholders}) AND lease_owner = :owner
+    """, {"owner": owner, **params})
+
+
+async def renew_user_leases(user_ids: List[int], owner: str, lease_until: str) -> List[int]:
+    """Extend the owner's claims to lease_until; returns the ids it still holds."""
+    if not user_ids:
+        return []
+    placeholders, params = in_params("user", user_ids)
+    async with engine.begin() as conn:
+        result = await conn.execute(text(f"""
+            UPDATE users SET lease_expires_at = :lease_until
+            WHERE id IN ({placeholders}) AND lease_owner = :owner
+            RETURNING id
+        """), {"owner": owner, "lease_until": lease_until, **params})
+        return list(result.scalars())
+
+
+async def get_scheduled_users(project_ids: List[int], until: str) -> List[dict]:
+    """Active users of the given projects whose next step is due by ``until``."""
+    if not project_ids:
+        return []
+    placeholders, params = in_params("project", project_ids)
+    return await fetch_all(f"""
+        SELECT id, next_due_at
+        FROM users
+        WHERE status = 'ACTIVE'
+          AND next_due_at IS NOT NULL AND next_due_at <= :until
+          AND project_id IN ({placeholders})
+    """, {"until": until, **params})
+
+
+async def get_unclaimed_due_users(project_ids: List[int], now: str, until: str) -> List[dict]:
+    """Active users due by ``until`` that no sender has claimed.
+
+    Polled by the scheduler every few seconds, so it only reads the users
+    due before the next poll.
+    """
+    if not project_ids:
+        return []
+    placeholders, params = in_params("project", project_ids)
+    return await fetch_all(f"""
+        SELECT id, next_due_at
+        FROM users
+        WHERE status = 'ACTIVE'
+          AND next_due_at IS NOT NULL AND next_due_at <= :until
+          AND project_id IN ({placeholders})
+          AND (lease_expires_at IS NULL OR lease_expires_at <= :now)
+    """, {"now": now, "until": until, **params})
+
+
+async def count_due_users(project_ids: List[int], now: str) -> int:
+    """Number of active users of the given projects whose next step is due."""
+    if not project_ids:
+        return 0
+    placeholders, params = in_params("project", project_ids)
+    row = await fetch_one(f"""
+        SELECT COUNT(*) AS due
+        FROM users
+        WHERE status = 'ACTIVE'
+          AND next_due_at IS NOT NULL AND next_due_at <= :now
+          AND project_id IN ({placeholders})
+    """, {"now": now, **params})
+    return row["due"]
+
+
+async def spread_due_users(project_id: int, due_before: str, start: str,
+                           window: float, rate: float, jitter: int) -> int:
+    """Reschedule a project's users due by due_before into slots from start on.
+
+    The most overdue user gets the first slot. Slots are window / count
+    seconds apart, but at least 1 / rate, and each gets up to jitter
+    seconds of random delay. The slot is also the user's
+    funnel_hold_until, so a funnel edit does not release the spread
+    users at once. Returns the number of users moved.
+    """
+    # Materialized, so each user's RANDOM() jitter is drawn once for both columns
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            WITH slots AS MATERIALIZED (
+                SELECT id, datetime(
+                    :start,
+                    '+' || (CAST(rank * MAX(:window / total, 1.0 / :rate) AS INTEGER)
+                            + ABS(RANDOM()) % (:jitter + 1)) || ' seconds'
+                ) AS due
+                FROM (
+                    SELECT id,
+                           ROW_NUMBER() OVER (ORDER BY next_due_at, id) - 1 AS rank,
+                           COUNT(*) OVER () AS total
+                    FROM users
+                    WHERE project_id = :project_id AND status = 'ACTIVE'
+                      AND next_due_at IS NOT NULL AND next_due_at <= :due_before
+                )
+            )
+            UPDATE users
+            SET next_due_at = slots.due, funnel_hold_until = slots.due
+            FROM slots
+            WHERE users.id = slots.id
+        """), {
+            "project_id": project_id, "due_before": due_before, "start": start,
+            "window": float(window), "rate": max(rate, 0.001), "jitter": max(0, jitter)
+        })
+        # rowcount is not reported for a statement with a CTE
+        return (await conn.execute(text("SELECT changes()"))).scalar_one()
+
+
+async def count_daily_cap_usage(project_id: int, today: str, now: str, owner: str) -> int:
+    """Steps a project sent on ``today`` plus the due users other senders hold.
+
+    A claimed user counts until the outcome is written, and from then on
+    through funnel_daily_sends, so senders that check the daily cap
+    against this right before sending stay under it together.
+    """
+    row = await fetch_one("""
+        SELECT
+            COALESCE((SELECT sent FROM funnel_daily_sends
+                      WHERE project_id = :project_id AND day = :today), 0) AS sent,
+            (SELECT COUNT(*) FROM users
+             WHERE project_id = :project_id AND status = 'ACTIVE'
+               AND next_due_at IS NOT NULL AND next_due_at <= :now
+               AND lease_expires_at > :now AND lease_owner != :owner) AS claimed
+    """, {"project_id": project_id, "today": today, "now": now, "owner": owner})
+    return row["sent"] + row["claimed"]
+
+
+async def update_user_steps(rows: List[dict]) -> Dict[int, Optional[str]]:
+    """Store sent steps and schedule the following ones in one transaction.
+
+    Each row needs user_id, step and now. The send is also counted in
+    funnel_daily_sends for the day of ``now``. Returns the new next_due_at
+    per user id.
+    """
+    if not rows:
+        return {}
+    async with engine.begin() as conn:
+        await conn.execute(text(f"""
+            UPDATE users
+            SET funnel_step = :step, funnel_step_sent_at = :now, updated_at = :now,
+                funnel_attempts = 0, funnel_error = NULL, funnel_hold_until = NULL, {RELEASE_LEASE}
+            WHERE id = :user_id
+        """), rows)
+        await conn.execute(text("""
+            INSERT INTO funnel_daily_sends (project_id, day, sent)
+            SELECT project_id, date(:now), 1 FROM users WHERE id = :user_id
+            ON CONFLICT (project_id, day) DO UPDATE SET sent = sent + 1
+        """), rows)
+        await conn.execute(text(REFRESH_USER_DUE_SQL), [{"user_id": row["user_id"]} for row in rows])
+        placeholders, params = in_params("user", [row["user_id"] for row in rows])
+        result = await conn.execute(text(f"SELECT id, next_due_at FROM users WHERE id IN ({placeholders})"), params)
+        return {row.id: row.next_due_at for row in result}
+
+
+async def retry_funnel_step_later(user_id: int, attempts: int, error: str, retry_at: str):
+    """Count a failed send and move the user's next try to retry_at.
+
+    retry_at is also kept as funnel_hold_until, so a funnel edit that
+    recomputes due times does not cut the backoff short.
+    """
+    await execute(f"""
+        UPDATE users SET funnel_attempts = :attempts, funnel_error = :error, next_due_at = :retry_at,
+            funnel_hold_until = :retry_at, {RELEASE_LEASE}
+        WHERE id = :user_id
+    """, {"user_id": user_id, "attempts": attempts, "error": error, "retry_at": retry_at})
+
+
+async def dead_letter_user(user_id: int, attempts: int, error: str, now: str):
+    """Stop the funnel of a user whose step cannot be delivered."""
+    await execute(f"""
+        UPDATE users
+        SET funnel_attempts = :attempts, funnel_error = :error, funnel_dead_at = :now, next_due_at = NULL,
+            funnel_hold_until = NULL, {RELEASE_LEASE}
+        WHERE id = :user_id
+    """, {"user_id": user_id, "attempts": attempts, "error": error, "now": now})
+
+
+async def mark_user_blocked(user_id: int, error: str, now: str):
+    """The user blocked the bot or deleted the account - stop sending to them."""
+    await execute(f"""
+        UPDATE users SET status = 'BLOCKED', funnel_error = :error, updated_at = :now, {RELEASE_LEASE}
+        WHERE id = :user_id
+    """, {"user_id": user_id, "error": error, "now": now})
+
+
+async def refresh_user_due(user_id: int) -> Optional[str]:
+    async with engine.begin() as conn:
+        await conn.execute(text(f"UPDATE users SET {RELEASE_LEASE} WHERE id = :user_id"), {"user_id": user_id})
+        result = await conn.execute(text(REFRESH_USER_DUE_SQL + " RETURNING next_due_at"), {"user_id": user_id})
+        return result.scalar_one_or_none()
+
+
+# ============== Funnel steps and media ==============
+
+MEDIA_COLUMNS = "mf.id, mf.project_id, mf.filename, mf.original_name, mf.file_type, mf.telegram_file_id"
+
+
+async def get_funnel_steps(project_id: int) -> List[dict]:
+    return await fetch_all("""
+        SELECT id, project_id, step_number, delay_seconds, content_type, content_text, buttons
+        FROM funnel_steps
+        WHERE project_id = :project_id
+    """, {"project_id": project_id})
+
+
+async def get_funnel_media(project_id: int) -> List[dict]:
+    """Media of all steps of a project, with the step id they belong to."""
+    return await fetch_all(f"""
+        SELECT fma.funnel_step_id, {MEDIA_COLUMNS}
+        FROM funnel_media_association fma
+        JOIN funnel_steps fs ON fs.id = fma.funnel_step_id
+        JOIN media_files mf ON mf.id = fma.media_file_id
+        WHERE fs.project_id = :project_id
+        ORDER BY fma.funnel_step_id, mf.id
+    """, {"project_id": project_id})
+
+
+async def get_step_buttons(step_id: int):
+    row = await fetch_one("SELECT buttons FROM funnel_steps WHERE id = :step_id", {"step_id": step_id})
+    return row["buttons"] if row else None
+
+
+async def get_step_media_files(step_id: int) -> List[dict]:
+    return await fetch_all(f"""
+        SELECT {MEDIA_COLUMNS}
+        FROM media_files mf
+        JOIN funnel_media_association fma ON mf.id = fma.media_file_id
+        WHERE fma.funnel_step_id = :step_id
+    """, {"step_id": step_id})
+
+
+async def get_broadcast_media_files(broadcast_id: int) -> List[dict]:
+    return await fetch_all(f"""
+        SELECT {MEDIA_COLUMNS}
+        FROM media_files mf
+        JOIN broadcast_media_association bma ON mf.id = bma.media_file_id
+        WHERE bma.broadcast_id = :broadcast_id
+    """, {"broadcast_id": broadcast_id})
+
+
+async def update_telegram_file_id(media_id: int, file_id: str):
+    await execute(
+        "UPDATE media_files SET telegram_file_id = :file_id WHERE id = :media_id",
+        {"file_id": file_id, "media_id": media_id}
+    )
+
+
+# ============== Broadcasts ==============
+
+async def get_sending_broadcasts(project_id: int) -> List[dict]:
+    rows = await fetch_all("""
+        SELECT id, content_text, content_type, target_audience, segment
+        FROM broadcasts WHERE project_id = :project_id AND status = 'sending'
+    """, {"project_id": project_id})
+    for row in rows:
+        row["segment"] = json.loads(row["segment"]) if row["segment"] else None
+    return rows
+
+
+async def set_broadcast_status(broadcast_id: int, status: str):
+    await execute(
+        "UPDATE broadcasts SET status = :status WHERE id = :broadcast_id",
+        {"status": status, "broadcast_id": broadcast_id}
+    )
+
+
+def _recipients_where(target_audience: str, segment: Optional[dict]) -> Tuple[str, dict]:
+    """Target users that have not received the broadcast yet, and segment params.
+
+    The audience itself is the one the API sizes (segments.audience_where).
+    """
+    where, params = audience_where(target_audience, segment)
+    return where + """
+        AND NOT EXISTS (
+            SELECT 1 FROM broadcast_deliveries d
+            WHERE d.broadcast_id = :broadcast_id AND d.user_id = u.id AND d.status IN ('sent', 'blocked')
+        )
+    """, params
+
+
+async def iter_broadcast_recipients(
+    broadcast_id: int,
+    project_id: int,
+    target_audience: str,
+    segment: Optional[dict] = None,
+    chunk_size: int = BROADCAST_RECIPIENT_CHUNK_SIZE,
+) -> AsyncIterator[dict]:
+    """Yield the recipients in id order, reading chunk_size users per query.
+    
+    Keyset chunks over the (project_id, id) index: memory does not grow
+    with the audience, and each query is short, so the delivery log can
+    write between them.
+    """
+    where, params = _recipients_where(target_audience, segment)
+    query = f"""
+        SELECT u.id, u.telegram_id FROM users u
+        WHERE {where} AND u.id > :after_id
+        ORDER BY u.id
+        LIMIT :limit
+    """
+    params.update(project_id=project_id, broadcast_id=broadcast_id, after_id=0, limit=chunk_size)
+    while True:
+        users = await fetch_all(query, params)
+        for user in users:
+            yield user
+        if len(users) < chunk_size:
+            return
+        params["after_id"] = users[-1]["id"]
+
+
+async def count_broadcast_recipients(broadcast_id: int, project_id: int, target_audience: str,
+                                     segment: Optional[dict] = None) -> int:
+    where, params = _recipients_where(target_audience, segment)
+    params.update(project_id=project_id, broadcast_id=broadcast_id)
+    row = await fetch_one(f"SELECT COUNT(*) AS count FROM users u WHERE {where}", params)
+    return row["count"]
+
+
+async def save_deliveries(broadcast_id: int, rows: List[dict], sent: int):
+    """Store a batch of delivery outcomes and advance sent_count."""
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            INSERT OR REPLACE INTO broadcast_deliveries
+            (broadcast_id, user_id, status, message_id, error_code, created_at)
+            VALUES (:broadcast_id, :user_id, :status, :message_id, :error_code, CURRENT_TIMESTAMP)
+        """), rows)
+        await conn.execute(text(
+            "UPDATE broadcasts SET sent_count = COALESCE(sent_count, 0) + :sent WHERE id = :broadcast_id"
+        ), {"sent": sent, "broadcast_id": broadcast_id})
+
+
+async def clear_deliveries(broadcast_id: int):
+    await execute("DELETE FROM broadcast_deliveries WHERE broadcast_id = :broadcast_id", {"broadcast_id": broadcast_id})
+
+
+# ============== Button clicks ==============
+
+async def save_button_clicks(rows: List[dict]):
+    """Store a batch of button presses and the users' last activity.
+
+    Each row needs project_id, telegram_id, step_id, button_id and now.
+    """
+    if not rows:
+        return
+    async with engine.begin() as conn:
+        await conn.execute(text("""
+            INSERT INTO button_clicks (project_id, telegram_id, step_id, button_id, created_at)
+            VALUES (:project_id, :telegram_id, :step_id, :button_id, :now)
+        """), rows)
+        await conn.execute(text("""
+            UPDATE users SET last_activity_at = :now
+            WHERE project_id = :project_id AND telegram_id = :telegram_id
+              AND (last_activity_at IS NULL OR last_activity_at < :now)
+        """), rows)
+
+
+# ============== Worker leases ==============
+
+async def heartbeat_worker(worker_id: str, now: str):
+    """Register this process or refresh its heartbeat."""
+    await execute("""
+        INSERT INTO bot_workers (worker_id, started_at, heartbeat_at) VALUES (:worker_id, :now, :now)
+        ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+    """, {"worker_id": worker_id, "now": now})
+
+
+async def count_live_workers(since: str) -> int:
+    """Workers that sent a heartbeat after ``since``; forgets the others."""
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM bot_workers WHERE heartbeat_at < :since"), {"since": since})
+        result = await conn.execute(text("SELECT COUNT(*) FROM bot_workers"))
+        return result.scalar_one()
+
+
+async def renew_leases(owner: str, now: str, expires_at: str) -> List[int]:
+    """Extend the unexpired leases of a worker; returns their project ids."""
+    async with engine.begin() as conn:
+        result = await conn.execute(text("""
+            UPDATE bot_leases SET expires_at = :expires_at
+            WHERE owner = :owner AND expires_at > :now
+            RETURNING project_id
+        """), {"owner": owner, "now": now, "expires_at": expires_at})
+        return list(result.scalars())
+
+
+async def acquire_lease(project_id: int, owner: str, now: str, expires_at: str) -> bool:
+    """Take a project's lease if it is free or expired."""
+    async with engine.begin() as conn:
+        result = await conn.execute(text("""
+            INSERT INTO bot_leases (project_id, owner, acquired_at, expires_at)
+            VALUES (:project_id, :owner, :now, :expires_at)
+            ON CONFLICT (project_id) DO UPDATE SET
+                owner = excluded.owner,
+                acquired_at = excluded.acquired_at,
+                expires_at = excluded.expires_at
+            WHERE bot_leases.expires_at <= :now OR bot_leases.owner = excluded.owner
+            RETURNING project_id
+        """), {"project_id": project_id, "owner": owner, "now": now, "expires_at": expires_at})
+        return result.first() is not None
+
+
+async def release_leases(owner: str, project_ids: Optional[List[int]] = None):
+    """Give up some (or all) leases of a worker."""
+    if project_ids is None:
+        await execute("DELETE FROM bot_leases WHERE owner = :owner", {"owner": owner})
+        return
+    if not project_ids:
+        return
+    placeholders, params = in_params("project", project_ids)
+    await execute(
+        f"DELETE FROM bot_leases WHERE owner = :owner AND project_id IN ({placeholders})",
+        {"owner": owner, **params}
+    )
+
+
+async def get_lease_owner(project_id: int, now: str) -> Optional[str]:
+    """Worker holding an unexpired lease on the project, if any."""
+    row = await fetch_one(
+        "SELECT owner FROM bot_leases WHERE project_id = :project_id AND expires_at > :now",
+        {"project_id": project_id, "now": now}
+    )
+    return row["owner"] if row else None
+
+
+async def delete_worker(worker_id: str):
+    await execute("DELETE FROM bot_workers WHERE worker_id = :worker_id", {"worker_id": worker_id})
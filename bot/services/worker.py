@@ -0,0 +1,20 @@
+"""Identity of this process among the processes sharing bot.db."""
+import os
+import socket
+from typing import Optional
+
+_worker_id: Optional[str] = None
+_worker_pid: Optional[int] = None
+
+
+def worker_id() -> str:
+    """host:pid of this process.
+
+    Computed on first use and again after a fork, so gunicorn workers
+    forked from a preloaded app do not share the master's id.
+    """
+    global _worker_id, _worker_pid
+    if _worker_pid != os.getpid():
+        _worker_pid = os.getpid()
+        _worker_id = f"{socket.gethostname()}:{_worker_pid}"[:64]
+    return _worker_id
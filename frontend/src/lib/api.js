@@ -17,14 +17,24 @@ export const projectsAPI = {
     getAll: () => api.get('/api/projects'),
     getById: (id) => api.get(`/api/projects/${id}`),
     create: (data) => api.post('/api/projects', data),
+    update: (id, data) => api.put(`/api/projects/${id}`, data),
     delete: (id) => api.delete(`/api/projects/${id}`)
 };
 
 // ============== Users API ==============
 export const usersAPI = {
-    getByProject: (projectId) => api.get('/api/users', { params: { project_id: projectId } }),
+    // One page, newest first; params: status, funnel_step, created_from, created_to, cursor, limit
+    getByProject: (projectId, params = {}) => api.get('/api/users', { params: { project_id: projectId, ...params } }),
+    getStats: (projectId) => api.get('/api/users/stats', { params: { project_id: projectId } }),
+    // Download link; format: 'csv' | 'ndjson', params: the list filters
+    getExportUrl: (projectId, format, params = {}) =>
+        `${API_BASE}/api/users/export?${new URLSearchParams({ project_id: projectId, format, ...params })}`,
     getById: (id) => api.get(`/api/users/${id}`),
     updateStatus: (id, status) => api.put(`/api/users/${id}/status`, { status }),
+    // One page, latest first; params: cursor, limit
+    getDeadLetter: (projectId, params = {}) => api.get('/api/users/dead-letter', { params: { project_id: projectId, ...params } }),
+    retryDeadLetter: (projectId) => api.post('/api/users/dead-letter/retry', null, { params: { project_id: projectId } }),
+    retryFunnel: (id) => api.post(`/api/users/${id}/retry-funnel`),
     delete: (id) => api.delete(`/api/users/${id}`)
 };
 
@@ -43,9 +43,9 @@ function Broadcast() {
 
     const loadUsersCounts = async () => {
         try {
-            const response = await usersAPI.getByProject(projectId);
-            setUsersCount(response.data.length);
-            setActiveUsersCount(response.data.filter(u => u.status === 'ACTIVE').length);
+            const response = await usersAPI.getStats(projectId);
+            setUsersCount(response.data.total);
+            setActiveUsersCount(response.data.by_status.ACTIVE || 0);
         } catch (error) {
             console.error('Failed to load users count:', error);
         }
@@ -116,6 +116,7 @@ function Funnel() {
         const validButtons = formData.buttons
             .filter(btn => btn.text && btn.text.trim() !== '')
             .map(btn => ({
+                ...(btn.id ? { id: btn.id } : {}),
                 text: btn.text.trim(),
                 action: btn.action,
                 value: btn.value || '',
@@ -2,19 +2,38 @@ import { useState, useEffect } from 'react';
 import { useOutletContext } from 'react-router-dom';
 import { usersAPI } from '../lib/api';
 
+const PAGE_SIZE = 50;
+
 function Users() {
     const { projectId } = useOutletContext();
     const [users, setUsers] = useState([]);
+    const [stats, setStats] = useState(null);
+    const [nextCursor, setNextCursor] = useState(null);
+    const [filters, setFilters] = useState({ status: '', funnel_step: '' });
     const [loading, setLoading] = useState(true);
+    const [loadingMore, setLoadingMore] = useState(false);
 
     useEffect(() => {
         if (projectId) loadUsers();
-    }, [projectId]);
+    }, [projectId, filters]);
+
+    const filterParams = () => {
+        const params = {};
+        if (filters.status) params.status = filters.status;
+        if (filters.funnel_step !== '') params.funnel_step = filters.funnel_step;
+        return params;
+    };
 
+    // First page and totals; further pages are appended by loadMore
     const loadUsers = async () => {
         try {
-            const response = await usersAPI.getByProject(projectId);
-            setUsers(response.data);
+            const [page, statsResponse] = await Promise.all([
+                usersAPI.getByProject(projectId, { ...filterParams(), limit: PAGE_SIZE }),
+                usersAPI.getStats(projectId)
+            ]);
+            setUsers(page.data.items);
+            setNextCursor(page.data.next_cursor);
+            setStats(statsResponse.data);
         } catch (error) {
             console.error('Failed to load users:', error);
         } finally {
@@ -22,6 +41,19 @@ function Users() {
         }
     };
 
+    const loadMore = async () => {
+        setLoadingMore(true);
+        try {
+            const page = await usersAPI.getByProject(projectId, { ...filterParams(), limit: PAGE_SIZE, cursor: nextCursor });
+            setUsers(prev => [...prev, ...page.data.items]);
+            setNextCursor(page.data.next_cursor);
+        } catch (error) {
+            console.error('Failed to load users:', error);
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const toggleStatus = async (user) => {
         const newStatus = user.status === 'ACTIVE' ? 'BLOCKED' : 'ACTIVE';
         try {
@@ -51,11 +83,41 @@ function Users() {
             <div className="flex items-center justify-between mb-6">
                 <div>
                     <h1 className="text-2xl font-bold text-white">Пользователи</h1>
-                    <p className="text-gray-400 mt-1">Всего: {users.length}</p>
+                    <p className="text-gray-400 mt-1">
+                        Всего: {stats ? stats.total : 0}
+                        {stats && ` (активных: ${stats.by_status.ACTIVE || 0}, заблокированных: ${stats.by_status.BLOCKED || 0})`}
+                    </p>
+                </div>
+                <div className="flex gap-2">
+                    <select
+                        value={filters.status}
+                        onChange={(e) => setFilters(prev => ({ ...prev, status: e.target.value }))}
+                        className="select"
+                    >
+                        <option value="">Все статусы</option>
+                        <option value="ACTIVE">Активные</option>
+                        <option value="BLOCKED">Заблокированные</option>
+                    </select>
+                    <select
+                        value={filters.funnel_step}
+                        onChange={(e) => setFilters(prev => ({ ...prev, funnel_step: e.target.value }))}
+                        className="select"
+                    >
+                        <option value="">Все шаги</option>
+                        {stats && Object.entries(stats.by_step).map(([step, count]) => (
+                            <option key={step} value={step}>Шаг {step} ({count})</option>
+                        ))}
+                    </select>
+                    <a
+                        href={usersAPI.getExportUrl(projectId, 'csv', filterParams())}
+                        className="btn-secondary"
+                    >
+                        ⬇️ CSV
+                    </a>
+                    <button onClick={loadUsers} className="btn-secondary">
+                        🔄 Обновить
+                    </button>
                 </div>
-                <button onClick={loadUsers} className="btn-secondary">
-                    🔄 Обновить
-                </button>
             </div>
 
             {users.length === 0 ? (
@@ -139,6 +201,13 @@ function Users() {
                             ))}
                         </tbody>
                     </table>
+                    {nextCursor && (
+                        <div className="text-center py-4">
+                            <button onClick={loadMore} disabled={loadingMore} className="btn-secondary">
+                                {loadingMore ? 'Загрузка...' : 'Показать ещё'}
+                            </button>
+                        </div>
+                    )}
                 </div>
             )}
         </div>
@@ -1,7 +1,7 @@
 """Database initialization script."""
 import asyncio
-import sqlite3
 import os
+from backend.db import sqlite_pragmas
 from backend.db.database import init_db, engine
 from backend.models import Project, User, FunnelStep, MediaFile, Broadcast, Base
 
@@ -17,7 +17,7 @@ async def main():
     db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.db')
     if os.path.exists(db_path):
         try:
-            conn = sqlite3.connect(db_path)
+            conn = sqlite_pragmas.connect(db_path)
             cursor = conn.cursor()
             # Check if admin_id exists in projects
             cursor.execute("PRAGMA table_info(projects)")
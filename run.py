@@ -5,8 +5,6 @@ TG-Otvet: Main Launcher
 import asyncio
 import sys
 import os
-import sqlite3
-import json
 from datetime import datetime
 from contextlib import asynccontextmanager
 
@@ -20,9 +18,19 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 
 
-# Global bot tasks and instances
-bot_tasks = {}
+# Global bot supervisor and instances
+bot_supervisor = None  # BotSupervisor, created on startup
 bot_instances = {}  # Store bot instances for broadcasts
+bot_projects = {}  # bot id -> project_id, resolves the project of an update
+webhook_targets = {}  # project_id -> (bot, secret) in webhook mode
+webhook_receivers = {}  # project_id -> (bot, secret) of bots run by another worker
+dispatcher = None  # One Dispatcher serves every project bot
+http_session = None  # AiohttpSession (connection pool) shared by all bots
+update_tasks = set()  # Updates being handled
+
+# getUpdates long-poll timeout, seconds
+POLLING_TIMEOUT = 30
+registration_buffer = None  # RegistrationBuffer when REGISTRATION_WRITE_BEHIND is on
 
 
 def log(message: str, level: str = "INFO"):
@@ -32,110 +40,64 @@ def log(message: str, level: str = "INFO"):
     print(f"[{timestamp}] {symbols.get(level, '[INFO]')} {message}")
 
 
-def create_start_handler(project_id: int):
-    """Create start command handler for specific project."""
+def create_start_handler():
+    """Create start command handler (project_id comes from the project middleware)."""
     from aiogram.types import Message
+    from bot.services import repository
+    from bot.services.funnel_scheduler import funnel_scheduler
     
-    db_path = os.path.join(BASE_DIR, 'bot.db')
-    
-    async def cmd_start(message: Message):
+    async def cmd_start(message: Message, project_id: int):
         """Handle /start command - register user without sending message."""
         user = message.from_user
         now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        if registration_buffer is not None:
+            # Spike mode - written in the next batch
+            await registration_buffer.add(
+                project_id, user.id, user.username, user.first_name, user.last_name, now
+            )
+            return
         
-        # Check if user exists
-        cursor.execute(
-            "SELECT id, status FROM users WHERE telegram_id = ? AND project_id = ?",
-            (user.id, project_id)
+        # New user starts at funnel_step = 0, existing one is reactivated and restarts the funnel
+        row = await repository.upsert_user(
+            project_id, user.id, user.username, user.first_name, user.last_name, now,
+            restart_funnel=True
         )
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Update existing user - reactivate if blocked
-            cursor.execute("""
-                UPDATE users SET 
-                    username = ?, 
-                    first_name = ?, 
-                    last_name = ?,
-                    status = 'ACTIVE',
-                    funnel_step = 0,
-                    funnel_step_sent_at = NULL,
-                    updated_at = ?
-                WHERE id = ?
-            """, (user.username, user.first_name, user.last_name, now, existing[0]))
-            conn.commit()
-            conn.close()
-            print(f"[User] {user.id} ({user.username}) restarted funnel for project {project_id}")
-        else:
-            # Create new user with funnel_step = 0
-            cursor.execute("""
-                INSERT INTO users 
-                (project_id, telegram_id, username, first_name, last_name, status, funnel_step, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, 'ACTIVE', 0, ?, ?)
-            """, (project_id, user.id, user.username, user.first_name, user.last_name, now, now))
-            conn.commit()
-            conn.close()
+        funnel_scheduler.schedule(row["id"], row["next_due_at"])
+        if row["created"]:
             print(f"[New User] {user.id} ({user.username}) registered for project {project_id}")
+        else:
+            print(f"[User] {user.id} ({user.username}) restarted funnel for project {project_id}")
         
         # NO automatic message - funnel step 1 will be sent by scheduler
     
     return cmd_start
 
 
-def create_callback_handler(project_id: int):
+def create_callback_handler():
     """Create callback query handler for button presses."""
     from aiogram.types import CallbackQuery
+    from bot.services.funnel_cache import funnel_cache
+    from bot.services.click_log import click_log
     
-    db_path = os.path.join(BASE_DIR, 'bot.db')
-    
-    async def handle_callback(callback: CallbackQuery):
-        """Handle button presses."""
-        data = callback.data
-        
-        if not data.startswith("btn_"):
-            await callback.answer()
-            return
-        
-        # Parse callback data: btn_{step_id}_{button_index}
-        try:
-            parts = data.split("_")
-            step_id = int(parts[1])
-            btn_index = int(parts[2])
-        except:
-            await callback.answer("[X] Error")
-            return
+    async def handle_callback(callback: CallbackQuery, project_id: int):
+        """Handle button presses.
         
-        # Get button config
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT buttons FROM funnel_steps WHERE id = ?", (step_id,))
-        result = cursor.fetchone()
-        conn.close()
+        Resolved from the compiled funnel of the project, so a burst of
+        presses (e.g. right after a broadcast) does not read the DB.
+        """
+        data = callback.data or ""
         
-        if not result or not result[0]:
-            await callback.answer("[X] Button not found")
-            return
-        
-        try:
-            buttons = json.loads(result[0]) if isinstance(result[0], str) else result[0]
-        except:
-            await callback.answer("[X] Error")
+        if not data.startswith(("b:", "btn_")):
+            await callback.answer()
             return
         
-        # Find button by row and index
-        all_buttons = []
-        for btn in buttons:
-            all_buttons.append(btn)
+        button = await funnel_cache.get_button(project_id, data)
         
-        if btn_index >= len(all_buttons):
+        if not button:
             await callback.answer("[X] Button not found")
             return
         
-        button = all_buttons[btn_index]
-        
         if button['action'] == 'callback':
             # Send the message from button value
             await callback.message.answer(button['value'])
@@ -143,125 +105,244 @@ def create_callback_handler(project_id: int):
         else:
             await callback.answer()
         
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        await click_log.record(project_id, callback.from_user.id, button['step_id'], button['id'], now)
         print(f"[Button] {button['text']} pressed by user {callback.from_user.id}")
     
     return handle_callback
 
 
-async def run_single_bot(project_id: int, project_name: str, bot_token: str):
-    """Run a single bot instance."""
-    from aiogram import Bot, Dispatcher, Router
+async def project_middleware(handler, event, data):
+    """Put the project_id of the receiving bot into handler data."""
+    project_id = bot_projects.get(data["bot"].id)
+    if project_id is None:
+        return None  # bot was stopped meanwhile
+    data["project_id"] = project_id
+    return await handler(event, data)
+
+
+def get_dispatcher():
+    """The Dispatcher shared by all project bots (created on first use)."""
+    global dispatcher
+    if dispatcher is None:
+        from aiogram import Dispatcher, Router
+        from aiogram.filters import Command
+        
+        dispatcher = Dispatcher()
+        dispatcher.update.outer_middleware(project_middleware)
+        
+        router = Router()
+        # Register start handler
+        router.message.register(create_start_handler(), Command("start"))
+        # Register callback handler for buttons
+        router.callback_query.register(create_callback_handler())
+        dispatcher.include_router(router)
+    return dispatcher
+
+
+def get_http_session():
+    """AiohttpSession shared by all bots, talking to TELEGRAM_API_SERVER when configured."""
+    global http_session
+    if http_session is None:
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer, PRODUCTION
+        from backend.core.config import TELEGRAM_API_SERVER, BOT_MODE, BOT_HTTP_POOL_SIZE
+        
+        api = TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else PRODUCTION
+        # Every polling bot keeps a getUpdates request open, so the pool
+        # is only bounded in webhook mode
+        limit = BOT_HTTP_POOL_SIZE if BOT_MODE == "webhook" else 0
+        http_session = AiohttpSession(api=api, limit=limit)
+    return http_session
+
+
+def create_bot(bot_token: str):
+    """Create a Bot on the shared HTTP session."""
+    from aiogram import Bot
     from aiogram.enums import ParseMode
     from aiogram.client.default import DefaultBotProperties
-    from aiogram.filters import Command
-    from bot.services.funnel_scheduler import FunnelScheduler
+    
+    return Bot(
+        token=bot_token,
+        session=get_http_session(),
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    )
+
+
+def dispatch_update(bot, update):
+    """Handle an update in the background."""
+    task = asyncio.create_task(get_dispatcher().feed_update(bot, update))
+    update_tasks.add(task)
+    task.add_done_callback(update_tasks.discard)
+
+
+async def poll_updates(bot):
+    """Long-poll getUpdates for one bot and hand updates to the dispatcher."""
+    from aiogram.exceptions import TelegramNetworkError, TelegramServerError
+    
+    allowed_updates = get_dispatcher().resolve_used_update_types()
+    offset = None
+    backoff = 1
+    while True:
+        try:
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=POLLING_TIMEOUT,
+                allowed_updates=allowed_updates,
+                request_timeout=POLLING_TIMEOUT + 10
+            )
+        except (TelegramNetworkError, TelegramServerError) as e:
+            log(f"Polling error for bot {bot.id}: {e}, retry in {backoff}s", "WARNING")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+            continue
+        backoff = 1
+        for update in updates:
+            offset = update.update_id + 1
+            dispatch_update(bot, update)
+
+
+async def run_single_bot(project_id: int, project_name: str, bot_token: str):
+    """Run a single bot instance."""
+    from backend.api.webhook import webhook_url, webhook_secret
+    from backend.core.config import BOT_MODE
+    from bot.services.funnel_scheduler import funnel_scheduler
     
     log(f"Starting bot: {project_name} (ID: {project_id})", "SUCCESS")
     
-    scheduler = None
     bot = None
     
     try:
-        bot = Bot(
-            token=bot_token,
-            default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-        )
+        bot = create_bot(bot_token)
         
         # Store bot instance for broadcasts
         bot_instances[project_id] = bot
+        bot_projects[bot.id] = project_id
         
-        # Create new dispatcher and router for this bot
-        dp = Dispatcher()
-        router = Router()
-        
-        # Register start handler
-        router.message.register(create_start_handler(project_id), Command("start"))
-        
-        # Register callback handler for buttons
-        router.callback_query.register(create_callback_handler(project_id))
-        
-        dp.include_router(router)
-        
-        scheduler = FunnelScheduler(bot, project_id)
-        scheduler.start()
+        funnel_scheduler.register(project_id, bot)
         
         bot_info = await bot.get_me()
         log(f"Bot @{bot_info.username} connected!", "SUCCESS")
         
-        await dp.start_polling(bot)
+        # Finish broadcasts interrupted by a restart
+        from backend.api.broadcast import resume_broadcasts
+        asyncio.create_task(resume_broadcasts(project_id))
         
+        # Upload funnel media this bot has no file ids for (e.g. new token)
+        from bot.services.media_warmup import warm_up_funnel
+        asyncio.create_task(warm_up_funnel(bot, project_id))
+        
+        if BOT_MODE == "webhook":
+            # Telegram pushes updates to /webhook/{project_id}; nothing to poll
+            secret = webhook_secret(project_id, bot_token)
+            webhook_targets[project_id] = (bot, secret)
+            await bot.set_webhook(
+                webhook_url(project_id),
+                secret_token=secret,
+                allowed_updates=get_dispatcher().resolve_used_update_types()
+            )
+            log(f"Webhook set for @{bot_info.username}", "SUCCESS")
+            await asyncio.Event().wait()
+        else:
+            # getUpdates does not work while a webhook is set
+            await bot.delete_webhook()
+            await poll_updates(bot)
+    
     except asyncio.CancelledError:
         log(f"Bot {project_name} stopped", "WARNING")
     except Exception as e:
         log(f"Bot {project_name} error: {e}", "ERROR")
+        raise  # the supervisor decides about the restart
     finally:
+        webhook_targets.pop(project_id, None)
         if project_id in bot_instances:
             del bot_instances[project_id]
-        if scheduler:
-            scheduler.stop()
-        if bot:
-            await bot.session.close()
+        if bot and bot_projects.get(bot.id) == project_id:
+            del bot_projects[bot.id]
+        funnel_scheduler.unregister(project_id)
+        # The HTTP session is shared - it is closed on shutdown
+
+
+async def release_bot(project_id: int):
+    """Unregister the webhook of a bot whose project was deleted or changed."""
+    bot = bot_instances.get(project_id)
+    if bot:
+        await bot.delete_webhook()
 
 
-async def bot_manager_task():
-    """Background task to manage bots."""
-    global bot_tasks
+def create_bot_supervisor():
+    from backend.core.config import BOT_LEASES
+    from bot.services.bot_supervisor import BotSupervisor
+    from bot.services.project_leases import ProjectLeases
     
-    log("Bot Manager started - auto-starting bots from database", "INFO")
+    return BotSupervisor(
+        run_bot=lambda project: run_single_bot(project["id"], project["name"], project["bot_token"]),
+        release_bot=release_bot,
+        leases=ProjectLeases() if BOT_LEASES else None
+    )
+
+
+async def pick_up_broadcasts(interval: float):
+    """Send broadcasts that were started through another worker's API."""
+    from backend.api.broadcast import resume_broadcasts
     
     while True:
-        try:
-            db_path = os.path.join(BASE_DIR, "bot.db")
-            if os.path.exists(db_path):
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT id, name, bot_token FROM projects")
-                projects = cursor.fetchall()
-                conn.close()
-                
-                # Start new bots
-                current_ids = set()
-                for project_id, name, token in projects:
-                    current_ids.add(project_id)
-                    if project_id not in bot_tasks or bot_tasks[project_id].done():
-                        task = asyncio.create_task(run_single_bot(project_id, name, token))
-                        bot_tasks[project_id] = task
-                
-                # Stop removed bots
-                for pid in list(bot_tasks.keys()):
-                    if pid not in current_ids:
-                        bot_tasks[pid].cancel()
-                        del bot_tasks[pid]
-                        log(f"Stopped bot for deleted project {pid}", "WARNING")
-        
-        except Exception as e:
-            log(f"Bot manager error: {e}", "ERROR")
-        
-        await asyncio.sleep(10)
+        await asyncio.sleep(interval)
+        for project_id in list(bot_instances):
+            task = asyncio.create_task(resume_broadcasts(project_id))
+            update_tasks.add(task)
+            task.add_done_callback(update_tasks.discard)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager."""
+    global registration_buffer, bot_supervisor
+    
     # Initialize database
     from backend.db.database import init_db
     from backend.models import Project, User, FunnelStep, MediaFile, Broadcast
     await init_db()
     log("Database initialized", "SUCCESS")
     
+    from backend.core.config import REGISTRATION_WRITE_BEHIND
+    from bot.services.funnel_scheduler import funnel_scheduler
+    if REGISTRATION_WRITE_BEHIND:
+        from bot.services.registration_buffer import RegistrationBuffer
+        # A batch may bring due steps - reload the scheduler's timer heap
+        registration_buffer = RegistrationBuffer(restart_funnel=True, on_flush=funnel_scheduler.schedule_many)
+        log("Registration write-behind enabled", "INFO")
+    
     # Create media directory
     media_dir = os.path.join(BASE_DIR, "media")
     os.makedirs(media_dir, exist_ok=True)
     
-    # Start bot manager
-    manager_task = asyncio.create_task(bot_manager_task())
+    # One funnel scheduler for all bots
+    funnel_scheduler.start()
+    
+    # Start bot supervisor
+    bot_supervisor = create_bot_supervisor()
+    manager_task = asyncio.create_task(bot_supervisor.run())
+    log("Bot supervisor started - auto-starting bots from database", "INFO")
+    
+    broadcasts_task = None
+    if bot_supervisor.leases:
+        broadcasts_task = asyncio.create_task(pick_up_broadcasts(bot_supervisor.leases.heartbeat_interval))
     
     yield
     
     # Cleanup
     manager_task.cancel()
-    for task in bot_tasks.values():
-        task.cancel()
+    if broadcasts_task:
+        broadcasts_task.cancel()
+    await bot_supervisor.shutdown()
+    funnel_scheduler.stop()
+    if registration_buffer is not None:
+        await registration_buffer.close()
+    from bot.services.click_log import click_log
+    await click_log.close()
+    if http_session is not None:
+        await http_session.close()
 
 
 # Create FastAPI app with bot manager
@@ -270,6 +351,7 @@ from backend.api.users import router as users_router
 from backend.api.funnel import router as funnel_router
 from backend.api.media import router as media_router
 from backend.api.broadcast import router as broadcast_router
+from backend.api.webhook import router as webhook_router
 from backend.core.config import MEDIA_DIR
 
 app = FastAPI(
@@ -302,6 +384,7 @@ app.include_router(users_router)
 app.include_router(funnel_router)
 app.include_router(media_router)
 app.include_router(broadcast_router)
+app.include_router(webhook_router)
 
 # Serve frontend static files LAST (so they don't override API)
 frontend_dist = os.path.join(BASE_DIR, "frontend", "dist")
@@ -328,7 +411,7 @@ if os.path.exists(frontend_dist):
         if os.path.isfile(file_path):
             from fastapi.responses import FileResponse
             return FileResponse(file_path)
-            
+        
         # Otherwise serve index.html for React Router
         from fastapi.responses import FileResponse
         return FileResponse(os.path.join(frontend_dist, "index.html"))
@@ -344,6 +427,50 @@ def get_bot_instance(project_id: int):
     return bot_instances.get(project_id)
 
 
+def cached_webhook_target(project_id: int):
+    """(bot, secret) of a project's webhook if this worker has one already."""
+    return webhook_targets.get(project_id) or webhook_receivers.get(project_id)
+
+
+async def get_webhook_target(project_id: int):
+    """(bot, secret) receiving webhook updates of a project.
+    
+    Telegram may post to any worker. A bot run by another worker gets a
+    receiver here: it handles the update (e.g. registers the /start user)
+    while polling, funnel and broadcasts stay with the lease owner.
+    Builds a bot, so only call it for a request whose secret was checked.
+    A receiver is checked against the project's current token on every
+    update: the token may change on another worker, and with WEBHOOK_SECRET
+    the secret stays the same.
+    """
+    target = webhook_targets.get(project_id)
+    if target:
+        return target
+    
+    from backend.api.webhook import webhook_secret
+    from bot.services import repository
+    
+    project = await repository.get_project(project_id)
+    if not project:
+        forget_webhook_receiver(project_id)
+        return None
+    target = webhook_receivers.get(project_id)
+    if target is None or target[0].token != project["bot_token"]:
+        forget_webhook_receiver(project_id)
+        bot = create_bot(project["bot_token"])
+        target = webhook_receivers[project_id] = (bot, webhook_secret(project_id, project["bot_token"]))
+    # Lets the project middleware resolve updates of the receiver
+    bot_projects.setdefault(target[0].id, project_id)
+    return target
+
+
+def forget_webhook_receiver(project_id: int):
+    """Drop a project's receiver (its token changed or the project is gone)."""
+    target = webhook_receivers.pop(project_id, None)
+    if target and bot_projects.get(target[0].id) == project_id and project_id not in bot_instances:
+        del bot_projects[target[0].id]
+
+
 
 
 @app.options("/{full_path:path}")
@@ -354,7 +481,16 @@ async def preflight_handler(request):
 
 @app.get("/health")
 async def health():
-    return {"status": "healthy", "bots": len(bot_tasks)}
+    from bot.services.funnel_scheduler import funnel_scheduler
+    bots = bot_supervisor.status() if bot_supervisor else {}
+    return {
+        "status": "healthy",
+        "bots": len(bots),
+        "running": sum(1 for bot in bots.values() if bot["status"] == "running"),
+        "parked": [project_id for project_id, bot in bots.items() if bot["status"] == "parked"],
+        "leases": sorted(bot_supervisor.leases.owned) if bot_supervisor and bot_supervisor.leases else None,
+        "funnel": funnel_scheduler.stats()
+    }
 
 
 if __name__ == "__main__":
@@ -0,0 +1,64 @@
+"""Every test gets a fresh bot.db in a temporary directory.
+
+backend.core.config and backend.db.database place media/ and bot.db in
+the working directory when they are imported, so the directory is
+switched before any backend module is loaded.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix="bot-tests-"))
+
+import backend.models  # noqa: E402,F401  (registers the tables)
+from backend.db.database import Base, engine, init_db  # noqa: E402
+from bot.services import repository  # noqa: E402
+
+NOW = "2026-01-10 12:00:00"
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db():
+    """Empty, migrated database; the pool is closed with the test's event loop."""
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+    await init_db()
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+async def project(db):
+    """Project 1 with a three-step funnel: 0s, 1h and 1 day after the previous step."""
+    await repository.execute(
+        "INSERT INTO projects (id, name, bot_token, admin_id) VALUES (1, 'Test', '111:test', 0)"
+    )
+    await repository.execute("""
+        INSERT INTO funnel_steps (project_id, step_number, delay_seconds, content_type, content_text)
+        VALUES (1, :step_number, :delay_seconds, 'text', 'Step')
+    """, [
+        {"step_number": 1, "delay_seconds": 0},
+        {"step_number": 2, "delay_seconds": 3600},
+        {"step_number": 3, "delay_seconds": 86400},
+    ])
+    return 1
+
+
+async def add_user(project_id: int, telegram_id: int, now: str = NOW, **columns) -> int:
+    """Register a user as /start does, then set any extra columns; returns the id."""
+    row = await repository.upsert_user(project_id, telegram_id, f"user{telegram_id}", "First", "Last", now)
+    if columns:
+        assignments = ", ".join(f"{name} = :{name}" for name in columns)
+        await repository.execute(
+            f"UPDATE users SET {assignments} WHERE id = :user_id", {"user_id": row["id"], **columns}
+        )
+    return row["id"]
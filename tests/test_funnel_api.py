@@ -0,0 +1,30 @@
+"""Stable button ids of funnel steps (backend/api/funnel.py)."""
+from backend.api.funnel import assign_button_ids
+
+
+def test_buttons_without_ids_keep_their_position():
+    buttons = [{"text": "A", "action": "callback"}, {"text": "B", "action": "url"}]
+    assert [button["id"] for button in assign_button_ids(buttons)] == ["0", "1"]
+
+
+def test_existing_ids_survive_edits():
+    buttons = [{"text": "New", "action": "callback"}, {"text": "Old", "action": "callback", "id": "1"}]
+    result = assign_button_ids(buttons)
+
+    assert result[1]["id"] == "1"
+    assert result[0]["id"] not in ("", "1")
+    # The input is not modified
+    assert "id" not in buttons[0]
+
+
+def test_copied_and_oversized_ids_are_replaced():
+    buttons = [
+        {"text": "A", "action": "callback", "id": "abc"},
+        {"text": "Copy of A", "action": "callback", "id": "abc"},
+        {"text": "B", "action": "callback", "id": "x" * 17},
+    ]
+    ids = [button["id"] for button in assign_button_ids(buttons)]
+
+    assert ids[0] == "abc"
+    assert len(set(ids)) == 3
+    assert all(len(button_id) <= 16 for button_id in ids)
@@ -0,0 +1,155 @@
+"""Due times, claims and the daily cap of the funnel queue (bot/services/repository.py)."""
+import asyncio
+
+import pytest
+
+from bot.services import repository
+from conftest import NOW, add_user
+
+pytestmark = pytest.mark.anyio
+
+LATER = "2026-01-10 12:05:00"
+
+
+async def user_row(user_id: int) -> dict:
+    return await repository.fetch_one("SELECT * FROM users WHERE id = :user_id", {"user_id": user_id})
+
+
+async def test_upsert_user_reports_created_only_once(project):
+    first = await repository.upsert_user(project, 100, "u", "F", "L", NOW)
+    again = await repository.upsert_user(project, 100, "renamed", "F", "L", LATER)
+
+    assert first["created"] is True
+    assert again["created"] is False
+    assert again["id"] == first["id"]
+    assert (await user_row(first["id"]))["username"] == "renamed"
+
+
+async def test_upsert_user_restart_starts_the_funnel_over(project):
+    user_id = await add_user(
+        project, 100, funnel_step=2, funnel_step_sent_at=NOW, funnel_dead_at=NOW, status="BLOCKED"
+    )
+    row = await repository.upsert_user(project, 100, "u", "F", "L", LATER, restart_funnel=True)
+
+    user = await user_row(user_id)
+    assert user["status"] == "ACTIVE"
+    assert user["funnel_step"] == 0
+    assert user["funnel_dead_at"] is None
+    # Step 1 has no delay; the reference time is still the registration
+    assert row["next_due_at"] == NOW
+
+
+async def test_next_due_at_follows_the_step_delay_and_hold(project):
+    user_id = await add_user(project, 100)
+    scheduled = await repository.update_user_steps([{"user_id": user_id, "step": 1, "now": NOW}])
+    assert scheduled == {user_id: "2026-01-10 13:00:00"}
+
+    # A retry backoff or catch-up slot later than the delay wins
+    await repository.execute(
+        "UPDATE users SET funnel_hold_until = '2026-01-10 15:00:00' WHERE id = :user_id", {"user_id": user_id}
+    )
+    assert await repository.refresh_user_due(user_id) == "2026-01-10 15:00:00"
+
+    # ...an earlier one does not pull the step forward
+    await repository.execute(
+        "UPDATE users SET funnel_hold_until = '2026-01-10 12:30:00' WHERE id = :user_id", {"user_id": user_id}
+    )
+    assert await repository.refresh_user_due(user_id) == "2026-01-10 13:00:00"
+
+
+async def test_next_due_at_is_null_after_the_last_step_or_dead_letter(project):
+    finished = await add_user(project, 100)
+    await repository.update_user_steps([{"user_id": finished, "step": 3, "now": NOW}])
+    dead = await add_user(project, 101)
+    await repository.dead_letter_user(dead, 5, "Bad Request", NOW)
+
+    assert (await user_row(finished))["next_due_at"] is None
+    assert await repository.refresh_user_due(dead) is None
+
+
+async def test_claim_is_exclusive_until_the_lease_expires(project):
+    user_ids = {await add_user(project, telegram_id) for telegram_id in (100, 101, 102)}
+
+    claimed = await repository.claim_due_users([project], NOW, 10, "worker-a", LATER)
+    assert {user["id"] for user in claimed} == user_ids
+    assert await repository.claim_due_users([project], NOW, 10, "worker-b", LATER) == []
+
+    # A crashed owner's claims are taken over once the lease runs out
+    taken_over = await repository.claim_due_users([project], LATER, 10, "worker-b", "2026-01-10 12:10:00")
+    assert {user["id"] for user in taken_over} == user_ids
+
+    # The old owner can neither release nor renew them any more
+    await repository.release_users(list(user_ids), "worker-a")
+    assert await repository.renew_user_leases(list(user_ids), "worker-a", "2026-01-10 13:00:00") == []
+    assert {(await user_row(user_id))["lease_owner"] for user_id in user_ids} == {"worker-b"}
+
+
+async def test_concurrent_claims_are_disjoint(project):
+    for telegram_id in range(100, 110):
+        await add_user(project, telegram_id)
+
+    batches = await asyncio.gather(*(
+        repository.claim_due_users([project], NOW, 4, f"worker-{n}", LATER) for n in range(3)
+    ))
+    ids = [user["id"] for batch in batches for user in batch]
+    assert len(ids) == len(set(ids)) == 10
+
+
+async def test_sent_step_clears_the_lease(project):
+    user_id = await add_user(project, 100)
+    await repository.claim_due_users([project], NOW, 10, "worker-a", LATER)
+    assert await repository.renew_user_leases([user_id], "worker-a", "2026-01-10 12:10:00") == [user_id]
+
+    await repository.update_user_steps([{"user_id": user_id, "step": 1, "now": NOW}])
+    user = await user_row(user_id)
+    assert user["lease_owner"] is None and user["lease_expires_at"] is None
+
+
+async def test_daily_cap_counts_every_send(project):
+    user_id = await add_user(project, 100)
+    for step in (1, 2, 3):
+        await repository.update_user_steps([{"user_id": user_id, "step": step, "now": NOW}])
+    assert await repository.count_daily_cap_usage(project, "2026-01-10", NOW, "worker-a") == 3
+
+    # Starting the funnel over does not give the sends back
+    await repository.upsert_user(project, 100, "u", "F", "L", LATER, restart_funnel=True)
+    assert await repository.count_daily_cap_usage(project, "2026-01-10", LATER, "worker-a") == 3
+    assert await repository.count_daily_cap_usage(project, "2026-01-11", LATER, "worker-a") == 0
+
+
+async def test_daily_cap_counts_users_claimed_by_other_senders(project):
+    await add_user(project, 100)
+    await add_user(project, 101)
+    await repository.claim_due_users([project], NOW, 1, "worker-b", LATER)
+
+    assert await repository.count_daily_cap_usage(project, "2026-01-10", NOW, "worker-a") == 1
+    # A sender's own claims are what it is about to check
+    assert await repository.count_daily_cap_usage(project, "2026-01-10", NOW, "worker-b") == 0
+
+
+async def test_spread_due_users_keeps_the_overdue_order(project):
+    user_ids = [
+        await add_user(project, 100 + n, now=f"2026-01-10 0{n}:00:00") for n in range(4)
+    ]
+    await add_user(project, 200, now=LATER)  # not overdue yet
+
+    moved = await repository.spread_due_users(project, NOW, "2026-01-10 12:00:00", 40, 100, 0)
+
+    assert moved == 4
+    rows = [await user_row(user_id) for user_id in user_ids]
+    assert [row["next_due_at"] for row in rows] == [
+        "2026-01-10 12:00:00", "2026-01-10 12:00:10", "2026-01-10 12:00:20", "2026-01-10 12:00:30",
+    ]
+    assert all(row["funnel_hold_until"] == row["next_due_at"] for row in rows)
+
+
+async def test_spread_due_users_stays_under_the_rate(project):
+    for n in range(3):
+        await add_user(project, 100 + n, now="2026-01-10 08:00:00")
+
+    await repository.spread_due_users(project, NOW, NOW, 0, 0.1, 0)
+
+    rows = await repository.fetch_all("SELECT next_due_at FROM users ORDER BY next_due_at")
+    assert [row["next_due_at"] for row in rows] == [
+        "2026-01-10 12:00:00", "2026-01-10 12:00:10", "2026-01-10 12:00:20",
+    ]
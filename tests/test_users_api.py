@@ -0,0 +1,84 @@
+"""Keyset pagination of the users list and the dead-letter list (backend/api/users.py)."""
+import pytest
+from fastapi import HTTPException
+
+from backend.api.users import decode_cursor, encode_cursor, get_dead_letter_users, get_users
+from backend.db.database import AsyncSessionLocal
+from bot.services import repository
+from conftest import add_user
+
+pytestmark = pytest.mark.anyio
+
+
+async def users_page(cursor=None, limit=2, **filters):
+    params = dict(status=None, funnel_step=None, created_from=None, created_to=None)
+    params.update(filters)
+    async with AsyncSessionLocal() as db:
+        return await get_users(project_id=1, cursor=cursor, limit=limit, db=db, **params)
+
+
+async def dead_letter_page(cursor=None, limit=2):
+    async with AsyncSessionLocal() as db:
+        return await get_dead_letter_users(project_id=1, cursor=cursor, limit=limit, db=db)
+
+
+async def all_pages(fetch_page, **kwargs) -> list:
+    ids, cursor = [], None
+    while True:
+        page = await fetch_page(cursor=cursor, **kwargs)
+        ids += [user.id for user in page.items]
+        if page.next_cursor is None:
+            return ids
+        cursor = page.next_cursor
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor("2026-01-10 12:00:00", 42)) == ("2026-01-10 12:00:00", 42)
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        decode_cursor("not a cursor")
+    assert error.value.status_code == 400
+
+
+async def test_users_pages_are_newest_first_without_gaps(project):
+    # Three users share a registration second: the id breaks the tie
+    times = ["2026-01-01 10:00:00", "2026-01-02 10:00:00", "2026-01-02 10:00:00",
+             "2026-01-02 10:00:00", "2026-01-03 10:00:00"]
+    user_ids = [await add_user(project, 100 + n, now=now) for n, now in enumerate(times)]
+
+    first = await users_page(limit=2)
+    assert [user.id for user in first.items] == [user_ids[4], user_ids[3]]
+    assert await all_pages(users_page, limit=2) == [user_ids[n] for n in (4, 3, 2, 1, 0)]
+
+    # An exact page ends without a cursor to an empty one
+    assert (await users_page(limit=5)).next_cursor is None
+
+
+async def test_new_registrations_do_not_shift_later_pages(project):
+    user_ids = [await add_user(project, 100 + n, now=f"2026-01-0{n + 1} 10:00:00") for n in range(4)]
+    first = await users_page(limit=2)
+
+    await add_user(project, 200, now="2026-01-09 10:00:00")
+
+    second = await users_page(cursor=first.next_cursor, limit=2)
+    assert [user.id for user in second.items] == [user_ids[1], user_ids[0]]
+
+
+async def test_users_pages_apply_filters(project):
+    active = [await add_user(project, 100 + n, now=f"2026-01-0{n + 1} 10:00:00") for n in range(3)]
+    await add_user(project, 200, now="2026-01-05 10:00:00", status="BLOCKED")
+
+    assert await all_pages(users_page, limit=1, status="ACTIVE") == active[::-1]
+
+
+async def test_dead_letter_pages(project):
+    dead = []
+    for n, dead_at in enumerate(["2026-01-02 10:00:00", "2026-01-03 10:00:00", "2026-01-03 10:00:00"]):
+        user_id = await add_user(project, 100 + n)
+        await repository.dead_letter_user(user_id, 5, "Bad Request", dead_at)
+        dead.append(user_id)
+    await add_user(project, 200)
+
+    assert await all_pages(dead_letter_page, limit=2) == [dead[2], dead[1], dead[0]]